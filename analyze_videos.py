@@ -0,0 +1,176 @@
+import os
+import argparse
+from pathlib import Path
+
+# ===================== Настройка моделей DeepFace =====================
+MODELS_DIR = Path('models')
+os.environ.setdefault('DEEPFACE_HOME', str(MODELS_DIR))
+os.makedirs(MODELS_DIR / '.deepface' / 'weights', exist_ok=True)
+
+from video_handler import process_video_one_cell, load_deepface_models
+from chunked_processing import process_video_chunked
+from detection_log import DETECTION_LOG_NAME
+from model_registry import DETECTOR_BACKEND, DETECTOR_BACKENDS, INFERENCE_ENGINES, configure_inference_engine
+from tflite_engine import QUANTIZATIONS, DEFAULT_QUANTIZATION
+from identity_store import IDENTITY_STORE_DIR
+from processing_metrics import PROFILERS
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov")
+
+
+def analyze_video(video_path, output_dir, detections=False, num_workers=1, metrics_format=None, profiler=None, **process_kwargs):
+    """
+    Анализирует видео без аннотации и кодирования: выполняет детекцию, идентификацию
+    и накопление метрик лиц и сохраняет только CSV с результатами.
+
+    Параметры:
+      video_path (str): Путь к видеофайлу.
+      output_dir (str): Папка для результатов (video_results.csv, detections.csv, detections.arrows, faces/).
+      detections (bool): Сохранять покадровый журнал детекций (detections.arrows) и, при обработке
+                         одним процессом, его копию в CSV (detections.csv).
+      num_workers (int): Число процессов-обработчиков (больше 1 — параллельная обработка фрагментами).
+      metrics_format (str): Сохранять метрики этапов обработки в metrics.json ('json') или metrics.prom ('prom');
+                            None — не сохранять. Только при обработке одним процессом.
+      profiler (str): Профилировщик ('cprofile' или 'pyinstrument'); только при обработке одним процессом.
+      process_kwargs: Дополнительные параметры process_video_one_cell (шаг анализа, порог, трекинг и т.д.).
+
+    Возвращает:
+      dict: Словарь объектов FaceMetrics для каждого уникального лица.
+    """
+    faces_dir = os.path.join(output_dir, "faces")
+    os.makedirs(faces_dir, exist_ok=True)
+    csv_output_path = os.path.join(output_dir, "video_results.csv")
+    detection_log_path = os.path.join(output_dir, DETECTION_LOG_NAME) if detections else None
+
+    if num_workers > 1:
+        # CSV с детекциями, метрики и профиль пишутся одним процессом, поэтому в параллельном режиме
+        # сохраняется только журнал
+        return process_video_chunked(
+            video_path=video_path,
+            faces_dir=faces_dir,
+            output_video_path=None,
+            num_workers=num_workers,
+            csv_output_path=csv_output_path,
+            detection_log_path=detection_log_path,
+            **process_kwargs
+        )
+    return process_video_one_cell(
+        video_path=video_path,
+        faces_dir=faces_dir,
+        output_video_path=None,
+        csv_output_path=csv_output_path,
+        detections_output_path=os.path.join(output_dir, "detections.csv") if detections else None,
+        detection_log_path=detection_log_path,
+        metrics_output_path=os.path.join(output_dir, f"metrics.{metrics_format}") if metrics_format else None,
+        profiler=profiler,
+        profile_output_path=os.path.join(output_dir, "profile.pstats" if profiler == 'cprofile' else "profile.html"),
+        **process_kwargs
+    )
+
+
+def find_videos(input_path, extensions=VIDEO_EXTENSIONS):
+    """
+    Возвращает список видеофайлов: сам файл или все видео в папке (без вложенных папок).
+
+    Параметры:
+      input_path (str): Путь к видеофайлу или папке с видео.
+      extensions (tuple): Допустимые расширения видеофайлов.
+
+    Возвращает:
+      list: Отсортированный список путей к видеофайлам.
+    """
+    if os.path.isfile(input_path):
+        return [input_path]
+    return sorted(
+        os.path.join(input_path, name) for name in os.listdir(input_path)
+        if name.lower().endswith(extensions)
+    )
+
+
+def analyze_directory(input_dir, output_dir, extensions=VIDEO_EXTENSIONS, **analyze_kwargs):
+    """
+    Анализирует все видео в папке; результаты каждого видео сохраняются в подпапку с его именем,
+    чтобы результаты разных видео не перезаписывали друг друга.
+
+    Параметры:
+      input_dir (str): Папка с видео или путь к одному видеофайлу.
+      output_dir (str): Папка для результатов.
+      extensions (tuple): Допустимые расширения видеофайлов.
+      analyze_kwargs: Параметры analyze_video.
+
+    Возвращает:
+      dict: Словарь {путь к видео: словарь FaceMetrics}.
+    """
+    results = {}
+    for video_path in find_videos(input_dir, extensions):
+        video_output_dir = os.path.join(output_dir, Path(video_path).stem)
+        print(f"Анализ {video_path} -> {video_output_dir}")
+        results[video_path] = analyze_video(video_path, video_output_dir, **analyze_kwargs)
+    return results
+
+
+def _parse_detection_scale(value):
+    return value if value == 'auto' else float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Анализ лиц на видео без создания аннотированного видео")
+    parser.add_argument('inputs', nargs='+', help="Видеофайлы или папки с видео")
+    parser.add_argument('--output-dir', default='results_folder/headless', help="Папка для результатов")
+    parser.add_argument('--detections', action='store_true', help="Сохранять покадровые детекции (detections.arrows и detections.csv)")
+    parser.add_argument('--workers', type=int, default=1, help="Число процессов-обработчиков на видео")
+    parser.add_argument('--detector', default=DETECTOR_BACKEND, choices=DETECTOR_BACKENDS, help="Детектор лиц DeepFace")
+    parser.add_argument('--face-conf-threshold', type=float, default=0.7, help="Порог уверенности для детекции лиц")
+    parser.add_argument('--min-face-size', type=int, default=0, help="Минимальный размер лица в пикселях")
+    parser.add_argument('--roi', type=float, nargs=4, default=None, metavar=('LEFT', 'TOP', 'RIGHT', 'BOTTOM'),
+                        help="Область интереса в долях ширины и высоты кадра")
+    parser.add_argument('--detection-scale', type=_parse_detection_scale, default=None,
+                        help="Масштаб кадра для детекции: множитель (например, 0.5) или auto — по --min-face-size")
+    parser.add_argument('--detection-short-side', type=int, default=None,
+                        help="Меньшая сторона кадра для детекции в пикселях")
+    parser.add_argument('--frame-stride', type=int, default=1, help="Анализировать каждый N-й кадр")
+    parser.add_argument('--target-fps', type=float, default=None, help="Целевая частота анализа кадров")
+    parser.add_argument('--detect-interval', type=int, default=1, help="Интервал детекции при трекинге лиц")
+    parser.add_argument('--batch-size', type=int, default=32, help="Размер пакета лиц для анализа атрибутов")
+    parser.add_argument('--align', action='store_true', help="Выравнивать лица перед анализом")
+    parser.add_argument('--metrics-format', choices=('json', 'prom'), default=None,
+                        help="Сохранять метрики этапов обработки (metrics.json или metrics.prom в папке видео)")
+    parser.add_argument('--profile', choices=PROFILERS, default=None,
+                        help="Профилировать обработку (только в одном процессе; результат — в папке видео)")
+    parser.add_argument('--identity-store', nargs='?', const=IDENTITY_STORE_DIR, default=None, metavar='DIR',
+                        help=f"Сопоставлять лица с общей базой лиц между видео (по умолчанию {IDENTITY_STORE_DIR})")
+    parser.add_argument('--engine', choices=INFERENCE_ENGINES, default='keras',
+                        help="Движок инференса моделей атрибутов и эмбеддингов (tflite — квантованные модели для CPU)")
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=DEFAULT_QUANTIZATION, help="Квантование весов для TFLite")
+    parser.add_argument('--engine-threads', type=int, default=None, help="Число потоков интерпретатора TFLite")
+    args = parser.parse_args()
+
+    configure_inference_engine(args.engine, args.quantization, args.engine_threads)
+    load_deepface_models(args.detector)
+    for input_path in args.inputs:
+        results = analyze_directory(
+            input_path,
+            args.output_dir,
+            detections=args.detections,
+            num_workers=args.workers,
+            detector_backend=args.detector,
+            face_conf_threshold=args.face_conf_threshold,
+            min_face_size=args.min_face_size,
+            roi=tuple(args.roi) if args.roi else None,
+            detection_scale=args.detection_scale,
+            detection_short_side=args.detection_short_side,
+            identity_store_dir=args.identity_store,
+            align=args.align,
+            frame_stride=args.frame_stride,
+            target_fps=args.target_fps,
+            detect_interval=args.detect_interval,
+            batch_size=args.batch_size,
+            metrics_format=args.metrics_format,
+            profiler=args.profile,
+        )
+        for video_path, tracked_faces in results.items():
+            print(f"{video_path}: найдено уникальных лиц: {len(tracked_faces)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# ===================== Настройка моделей DeepFace =====================
+os.environ.setdefault('DEEPFACE_HOME', 'models')
+
+# Видео для замера по умолчанию
+DEFAULT_BENCHMARK_VIDEO = os.path.join('media', 'result_video.mp4')
+# Число кадров, на которых замеряется каждый детектор
+DEFAULT_MAX_FRAMES = 300
+# Число первых кадров, которые не учитываются в замере (прогрев)
+DEFAULT_WARMUP_FRAMES = 5
+# Процентили задержки детекции одного кадра
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def benchmark_detector(detector_backend, video_path=DEFAULT_BENCHMARK_VIDEO, max_frames=DEFAULT_MAX_FRAMES,
+                       warmup_frames=DEFAULT_WARMUP_FRAMES, align=False):
+    """
+    Замеряет скорость одного детектора лиц на кадрах видео. Учитывается только время детекции:
+    декодирование кадров в замер не входит.
+
+    Параметры:
+      detector_backend (str): Детектор лиц DeepFace.
+      video_path (str): Путь к видео.
+      max_frames (int): Максимальное число замеряемых кадров.
+      warmup_frames (int): Число первых кадров, не учитываемых в замере.
+      align (bool): Флаг выравнивания лиц.
+
+    Возвращает:
+      dict: Частота кадров, процентили задержки (мс), время загрузки модели, пиковая память процесса
+            и число найденных лиц.
+    """
+    import cv2
+    from model_registry import model_registry, check_detector_backend, get_peak_memory_mb
+    from face_analysis import extract_frame_faces, is_full_frame_region
+
+    model_registry.get('face_detector', check_detector_backend(detector_backend))
+    load_report = model_registry.report[('face_detector', detector_backend)]
+
+    cap = cv2.VideoCapture(video_path)
+    latencies = []
+    faces = 0
+    frames_with_faces = 0
+    frame_index = 0
+    try:
+        while len(latencies) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            start_time = time.perf_counter()
+            face_objs = extract_frame_faces(frame, detector_backend=detector_backend, align=align)
+            latency = time.perf_counter() - start_time
+            frame_index += 1
+            if frame_index <= warmup_frames:
+                continue
+            height, width = frame.shape[:2]
+            frame_faces = sum(1 for face_obj in face_objs if not is_full_frame_region(face_obj['facial_area'], width, height))
+            latencies.append(latency)
+            faces += frame_faces
+            frames_with_faces += 1 if frame_faces else 0
+    finally:
+        cap.release()
+
+    if not latencies:
+        raise ValueError(f"В видео {video_path} недостаточно кадров для замера")
+    latencies_ms = np.array(latencies) * 1000
+    result = {
+        'detector': detector_backend,
+        'frames': len(latencies),
+        'fps': len(latencies) / latencies_ms.sum() * 1000,
+    }
+    for percentile in LATENCY_PERCENTILES:
+        result[f'p{percentile}_ms'] = float(np.percentile(latencies_ms, percentile))
+    result.update({
+        'load_time_s': load_report['load_time_s'],
+        'peak_memory_mb': get_peak_memory_mb(),
+        'faces': faces,
+        'frames_with_faces': frames_with_faces,
+        'error': None,
+    })
+    return result
+
+
+def run_benchmark(detector_backends, video_path=DEFAULT_BENCHMARK_VIDEO, max_frames=DEFAULT_MAX_FRAMES,
+                  warmup_frames=DEFAULT_WARMUP_FRAMES, align=False):
+    """
+    Замеряет детекторы по очереди, каждый в отдельном процессе: так пиковая память процесса относится
+    к одному детектору, а модели разных детекторов не влияют друг на друга. Детектор, который не удалось
+    загрузить (например, не установлен нужный пакет), попадает в таблицу с текстом ошибки.
+
+    Параметры:
+      detector_backends (list): Детекторы лиц DeepFace.
+      video_path (str): Путь к видео.
+      max_frames (int): Максимальное число замеряемых кадров.
+      warmup_frames (int): Число первых кадров, не учитываемых в замере.
+      align (bool): Флаг выравнивания лиц.
+
+    Возвращает:
+      pandas.DataFrame: Строка на детектор, отсортированная по убыванию частоты кадров.
+    """
+    # spawn: каждый замер начинается в чистом процессе без загруженного TensorFlow
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for detector_backend in detector_backends:
+        print(f"Замер детектора {detector_backend}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            future = executor.submit(benchmark_detector, detector_backend, video_path, max_frames, warmup_frames, align)
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Детектор {detector_backend} не удалось замерить: {e}")
+                results.append({'detector': detector_backend, 'error': str(e)})
+    df = pd.DataFrame(results)
+    if 'fps' in df.columns:
+        df = df.sort_values('fps', ascending=False, na_position='last', ignore_index=True)
+    return df
+
+
+def format_benchmark(df):
+    """
+    Формирует текстовую таблицу результатов замера.
+    """
+    return df.to_string(index=False, float_format=lambda value: f"{value:.2f}")
+
+
+def main():
+    from model_registry import DETECTOR_BACKENDS
+
+    parser = argparse.ArgumentParser(description="Сравнение скорости детекторов лиц DeepFace на видео")
+    parser.add_argument('--video', default=DEFAULT_BENCHMARK_VIDEO, help="Видео для замера")
+    parser.add_argument('--detectors', nargs='+', default=list(DETECTOR_BACKENDS), choices=DETECTOR_BACKENDS,
+                        help="Детекторы для замера (по умолчанию все)")
+    parser.add_argument('--max-frames', type=int, default=DEFAULT_MAX_FRAMES, help="Число замеряемых кадров")
+    parser.add_argument('--warmup-frames', type=int, default=DEFAULT_WARMUP_FRAMES, help="Число кадров прогрева")
+    parser.add_argument('--align', action='store_true', help="Выравнивать лица")
+    parser.add_argument('--gpu', action='store_true', help="Разрешить использование GPU (по умолчанию замер на CPU)")
+    parser.add_argument('--output-csv', default=None, help="Сохранить результаты в CSV")
+    args = parser.parse_args()
+
+    if not args.gpu:
+        # Переменная наследуется процессами замера до импорта TensorFlow
+        os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    df = run_benchmark(args.detectors, args.video, args.max_frames, args.warmup_frames, args.align)
+    print(format_benchmark(df))
+    if args.output_csv:
+        df.to_csv(args.output_csv, index=False)
+        print(f"Результаты сохранены в {args.output_csv}")
+
+
+if __name__ == "__main__":
+    main()
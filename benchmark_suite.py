@@ -0,0 +1,421 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import pandas as pd
+
+# ===================== Настройка моделей DeepFace =====================
+os.environ.setdefault('DEEPFACE_HOME', 'models')
+
+from video_encoder import FFmpegVideoWriter
+from results_store import EMOTIONS
+
+# Папка с данными замеров: лица для синтетических видео, синтетические видео, эталоны, результаты, история
+BENCHMARK_DIR = "benchmarks"
+SPRITES_DIR = os.path.join(BENCHMARK_DIR, "sprites")
+CLIPS_DIR = os.path.join(BENCHMARK_DIR, "clips")
+BASELINES_DIR = os.path.join(BENCHMARK_DIR, "baselines")
+RUNS_DIR = os.path.join(BENCHMARK_DIR, "runs")
+HISTORY_PATH = os.path.join(BENCHMARK_DIR, "history.jsonl")
+
+# Видео из репозитория и сохранённый для него результат, который служит эталоном
+SAMPLE_VIDEO = os.path.join('media', 'result_video.mp4')
+SAMPLE_BASELINE = os.path.join('media', 'video_results.csv')
+
+# Синтетические видео по умолчанию: (число лиц, ширина, высота, длительность в секундах)
+DEFAULT_SYNTHETIC_CLIPS = ((1, 640, 480, 10), (4, 1280, 720, 10))
+SYNTHETIC_FPS = 25
+# Число лиц, вырезаемых из видео репозитория для синтетических видео
+DEFAULT_SPRITE_COUNT = 8
+
+# Режимы обработки: название -> параметры process_video_one_cell
+MODES = {
+    'full': {},
+    'tracking': {'detect_interval': 5},
+    'sampled': {'frame_stride': 3},
+    'headless': {'output_video_path': None},
+}
+
+# Допустимое относительное падение скорости и абсолютное падение точности по сравнению с прошлым замером
+DEFAULT_MAX_FPS_DROP = 0.10
+DEFAULT_MAX_ACCURACY_DROP = 0.05
+
+
+def collect_face_sprites(video_path=SAMPLE_VIDEO, count=DEFAULT_SPRITE_COUNT, sprites_dir=SPRITES_DIR,
+                         frame_step=25, min_size=48):
+    """
+    Вырезает лица из видео для синтетических видео и сохраняет их в sprites_dir.
+    Если лица уже сохранены, они загружаются с диска, поэтому синтетические видео воспроизводимы.
+
+    Параметры:
+      video_path (str): Видео, из которого вырезаются лица.
+      count (int): Число лиц.
+      sprites_dir (str): Папка для изображений лиц.
+      frame_step (int): Шаг кадров, на которых выполняется детекция.
+      min_size (int): Минимальный размер лица в пикселях.
+
+    Возвращает:
+      list: Изображения лиц (BGR).
+    """
+    paths = sorted(os.path.join(sprites_dir, name) for name in os.listdir(sprites_dir)) if os.path.isdir(sprites_dir) else []
+    if len(paths) >= count:
+        return [cv2.imread(path) for path in paths[:count]]
+
+    from face_analysis import extract_frame_faces, is_full_frame_region
+
+    os.makedirs(sprites_dir, exist_ok=True)
+    sprites = []
+    cap = cv2.VideoCapture(video_path)
+    frame_index = 0
+    try:
+        while len(sprites) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame_index += 1
+            if frame_index % frame_step:
+                continue
+            height, width = frame.shape[:2]
+            for face_obj in extract_frame_faces(frame):
+                region = face_obj['facial_area']
+                if is_full_frame_region(region, width, height) or min(region['w'], region['h']) < min_size:
+                    continue
+                # Одно лицо с кадра: соседние кадры чаще содержат разных людей, чем один кадр
+                sprites.append(frame[region['y']:region['y'] + region['h'], region['x']:region['x'] + region['w']].copy())
+                break
+    finally:
+        cap.release()
+    if not sprites:
+        raise ValueError(f"В видео {video_path} не найдено лиц для синтетических видео")
+    for index, sprite in enumerate(sprites):
+        cv2.imwrite(os.path.join(sprites_dir, f"sprite_{index:02d}.png"), sprite)
+    return sprites
+
+
+def make_synthetic_clip(output_path, sprites, num_faces, width, height, duration_s, fps=SYNTHETIC_FPS, seed=0):
+    """
+    Создаёт синтетическое видео: лица движутся по неподвижному фону и отражаются от краёв кадра.
+    При одинаковых параметрах и лицах видео получается одинаковым.
+
+    Параметры:
+      output_path (str): Путь к видео.
+      sprites (list): Изображения лиц (collect_face_sprites); лица с одинаковым номером повторяются,
+                      если num_faces больше числа изображений.
+      num_faces (int): Число лиц в кадре.
+      width, height (int): Размер кадра.
+      duration_s (float): Длительность (с).
+      fps (int): Частота кадров.
+      seed (int): Начальное значение генератора случайных чисел.
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(60, 160, width, dtype=np.float32)[None, :, None]
+    background = np.clip(gradient + rng.normal(0, 8, (height, width, 3)), 0, 255).astype(np.uint8)
+
+    face_size = max(32, min(width, height) // 5)
+    faces = []
+    for index in range(num_faces):
+        sprite = cv2.resize(sprites[index % len(sprites)], (face_size, face_size))
+        position = rng.uniform([0, 0], [width - face_size, height - face_size])
+        velocity = rng.uniform(-3, 3, size=2) * face_size / 64
+        faces.append([sprite, position, velocity])
+
+    writer = FFmpegVideoWriter(output_path, fps, (width, height), preset='veryfast', crf=18)
+    try:
+        for _ in range(int(duration_s * fps)):
+            frame = background.copy()
+            for face in faces:
+                sprite, position, velocity = face
+                position += velocity
+                for axis, limit in enumerate((width - face_size, height - face_size)):
+                    if not 0 <= position[axis] <= limit:
+                        velocity[axis] = -velocity[axis]
+                        position[axis] = min(max(position[axis], 0), limit)
+                x, y = int(position[0]), int(position[1])
+                frame[y:y + face_size, x:x + face_size] = sprite
+            writer.write(frame)
+    finally:
+        writer.release()
+
+
+def get_synthetic_case(num_faces, width, height, duration_s, sprites):
+    """
+    Возвращает описание синтетического замера, создавая видео, если его ещё нет.
+
+    Возвращает:
+      dict: {'name', 'video_path', 'expected_faces'}.
+    """
+    name = f"synthetic_{num_faces}faces_{width}x{height}_{duration_s}s"
+    video_path = os.path.join(CLIPS_DIR, f"{name}.mp4")
+    if not os.path.exists(video_path):
+        os.makedirs(CLIPS_DIR, exist_ok=True)
+        print(f"Создание синтетического видео {video_path}")
+        make_synthetic_clip(video_path, sprites, num_faces, width, height, duration_s)
+    return {'name': name, 'video_path': video_path, 'expected_faces': min(num_faces, len(sprites))}
+
+
+def compare_with_baseline(df, baseline_df):
+    """
+    Сравнивает video_results.csv с эталоном. В CSV нет идентификаторов лиц, поэтому лица сопоставляются
+    по числу кадров, на которых они распознаны (по убыванию).
+
+    Параметры:
+      df (pandas.DataFrame): Результат замера.
+      baseline_df (pandas.DataFrame): Эталон.
+
+    Возвращает:
+      dict: Число лиц, относительная ошибка числа лиц, средняя ошибка возраста, доли совпадения пола,
+            расы и преобладающей эмоции у сопоставленных лиц и общая точность
+            (среднее долей совпадения с поправкой на ошибку числа лиц).
+    """
+    def order_by_frames(table):
+        return table.assign(_frames=table[EMOTIONS].sum(axis=1)).sort_values('_frames', ascending=False, ignore_index=True)
+
+    result_df = order_by_frames(df)
+    base_df = order_by_frames(baseline_df)
+    matched = min(len(result_df), len(base_df))
+    face_count_error = abs(len(result_df) - len(base_df)) / max(len(base_df), 1)
+    comparison = {'faces': len(result_df), 'baseline_faces': len(base_df), 'face_count_error': face_count_error}
+    if not matched:
+        comparison.update({'age_mae': None, 'gender_accuracy': 0.0, 'race_accuracy': 0.0, 'emotion_accuracy': 0.0,
+                           'accuracy': 0.0})
+        return comparison
+
+    result_df, base_df = result_df.head(matched), base_df.head(matched)
+    comparison['age_mae'] = float((result_df['age'] - base_df['age']).abs().mean())
+    for column in ('gender', 'race'):
+        comparison[f'{column}_accuracy'] = float((result_df[column].astype(str) == base_df[column].astype(str)).mean())
+    comparison['emotion_accuracy'] = float(
+        (result_df[EMOTIONS].idxmax(axis=1) == base_df[EMOTIONS].idxmax(axis=1)).mean()
+    )
+    agreement = np.mean([comparison['gender_accuracy'], comparison['race_accuracy'], comparison['emotion_accuracy']])
+    comparison['accuracy'] = float(agreement * (1 - min(face_count_error, 1.0)))
+    return comparison
+
+
+def run_case(case, mode, process_kwargs):
+    """
+    Выполняет один замер: обрабатывает видео в режиме mode и собирает скорость, память и метрики этапов.
+    Вызывается в отдельном процессе, поэтому пиковая память относится к одному замеру.
+
+    Параметры:
+      case (dict): Описание замера (name, video_path, baseline_path, expected_faces).
+      mode (str): Режим обработки из MODES.
+      process_kwargs (dict): Общие параметры process_video_one_cell.
+
+    Возвращает:
+      dict: Запись истории замеров.
+    """
+    from video_handler import process_video_one_cell, load_deepface_models
+    from model_registry import get_peak_memory_mb, DETECTOR_BACKEND
+
+    load_deepface_models(process_kwargs.get('detector_backend', DETECTOR_BACKEND))
+    run_dir = os.path.join(RUNS_DIR, f"{case['name']}_{mode}")
+    os.makedirs(run_dir, exist_ok=True)
+    csv_path = os.path.join(run_dir, "video_results.csv")
+    kwargs = dict(
+        output_video_path=os.path.join(run_dir, "result_video.mp4"),
+        csv_output_path=csv_path,
+        **process_kwargs
+    )
+    kwargs.update(MODES[mode])
+    pipeline_stats, filter_stats, timing_stats = {}, {}, {}
+    start_time = time.perf_counter()
+    process_video_one_cell(
+        video_path=case['video_path'],
+        faces_dir=os.path.join(run_dir, "faces"),
+        pipeline_stats=pipeline_stats,
+        filter_stats=filter_stats,
+        timing_stats=timing_stats,
+        **kwargs
+    )
+    elapsed = time.perf_counter() - start_time
+    frames = pipeline_stats['decode']['items']
+    analyzed_faces = filter_stats['analyzed']
+
+    record = {
+        'case': case['name'],
+        'mode': mode,
+        'frames': frames,
+        'elapsed_s': elapsed,
+        'fps': frames / elapsed if elapsed else 0.0,
+        'per_face_ms': 1000 * elapsed / analyzed_faces if analyzed_faces else None,
+        'analyzed_faces': analyzed_faces,
+        'peak_memory_mb': get_peak_memory_mb(),
+        'stages_ms': {stage: stage_stats['mean_ms'] for stage, stage_stats in timing_stats['stages'].items()},
+    }
+    df = pd.read_csv(csv_path)
+    record['faces'] = len(df)
+    if case.get('expected_faces') is not None:
+        # В синтетическом видео известно число разных лиц: ошибка идентификации
+        record['expected_faces'] = case['expected_faces']
+        record['identity_error'] = abs(len(df) - case['expected_faces']) / case['expected_faces']
+    if case.get('baseline_path') and os.path.exists(case['baseline_path']):
+        record.update(compare_with_baseline(df, pd.read_csv(case['baseline_path'])))
+    return record
+
+
+def _get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(history_path=HISTORY_PATH):
+    """
+    Загружает историю замеров (по одной записи JSON на строку).
+    """
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, encoding='utf-8') as history_file:
+        return [json.loads(line) for line in history_file if line.strip()]
+
+
+def append_history(records, history_path=HISTORY_PATH):
+    os.makedirs(os.path.dirname(history_path) or '.', exist_ok=True)
+    with open(history_path, 'a', encoding='utf-8') as history_file:
+        for record in records:
+            history_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _get_comparison_key(record):
+    """
+    Ключ сопоставления замеров: видео, режим, компьютер и параметры обработки (например, детектор),
+    чтобы замеры с разными параметрами не сравнивались между собой.
+    """
+    params = json.dumps(record.get('params') or {}, sort_keys=True, ensure_ascii=False)
+    return record['case'], record['mode'], record.get('host'), params
+
+
+def check_regressions(records, history, max_fps_drop=DEFAULT_MAX_FPS_DROP, max_accuracy_drop=DEFAULT_MAX_ACCURACY_DROP):
+    """
+    Сравнивает замеры с последним прошлым замером того же видео и режима с теми же параметрами
+    на этом же компьютере.
+
+    Параметры:
+      records (list): Новые записи.
+      history (list): Прошлые записи.
+      max_fps_drop (float): Допустимое относительное падение частоты кадров.
+      max_accuracy_drop (float): Допустимое падение точности.
+
+    Возвращает:
+      list: Описания регрессий (пустой список, если регрессий нет).
+    """
+    regressions = []
+    for record in records:
+        key = _get_comparison_key(record)
+        previous = [entry for entry in history if _get_comparison_key(entry) == key]
+        if not previous:
+            continue
+        last = previous[-1]
+        if last.get('fps') and record['fps'] < last['fps'] * (1 - max_fps_drop):
+            regressions.append(
+                f"{record['case']}/{record['mode']}: скорость {record['fps']:.1f} кадр/с "
+                f"против {last['fps']:.1f} кадр/с (коммит {last.get('commit')})"
+            )
+        if last.get('accuracy') is not None and record.get('accuracy') is not None \
+                and record['accuracy'] < last['accuracy'] - max_accuracy_drop:
+            regressions.append(
+                f"{record['case']}/{record['mode']}: точность {record['accuracy']:.3f} "
+                f"против {last['accuracy']:.3f} (коммит {last.get('commit')})"
+            )
+    return regressions
+
+
+def run_suite(cases, modes, process_kwargs, update_baseline=False):
+    """
+    Выполняет замеры всех видео во всех режимах, каждый в отдельном процессе.
+
+    Параметры:
+      cases (list): Описания замеров.
+      modes (list): Режимы из MODES.
+      process_kwargs (dict): Общие параметры process_video_one_cell.
+      update_baseline (bool): Сохранить результат режима 'full' как эталон синтетических видео.
+
+    Возвращает:
+      list: Записи истории замеров.
+    """
+    # spawn: каждый замер начинается в чистом процессе без загруженного TensorFlow
+    context = multiprocessing.get_context('spawn')
+    commit = _get_git_commit()
+    records = []
+    for case in cases:
+        for mode in modes:
+            print(f"Замер {case['name']} в режиме {mode}...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                record = executor.submit(run_case, case, mode, process_kwargs).result()
+            record.update({'timestamp': time.time(), 'commit': commit, 'host': socket.gethostname(),
+                           'params': process_kwargs})
+            records.append(record)
+            if update_baseline and mode == 'full' and case['baseline_path'] != SAMPLE_BASELINE:
+                os.makedirs(BASELINES_DIR, exist_ok=True)
+                os.replace(os.path.join(RUNS_DIR, f"{case['name']}_{mode}", "video_results.csv"), case['baseline_path'])
+                print(f"Эталон сохранён в {case['baseline_path']}")
+    return records
+
+
+def format_records(records):
+    """
+    Формирует текстовую таблицу замеров.
+    """
+    columns = ['case', 'mode', 'frames', 'fps', 'per_face_ms', 'peak_memory_mb', 'faces', 'accuracy']
+    df = pd.DataFrame(records)
+    return df[[column for column in columns if column in df.columns]].to_string(
+        index=False, float_format=lambda value: f"{value:.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозные замеры скорости и точности обработки видео")
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES), help="Режимы обработки")
+    parser.add_argument('--no-sample', action='store_true', help=f"Не выполнять замер на {SAMPLE_VIDEO}")
+    parser.add_argument('--synthetic', type=int, nargs=4, action='append', metavar=('FACES', 'WIDTH', 'HEIGHT', 'SECONDS'),
+                        help="Синтетическое видео (можно указать несколько раз)")
+    parser.add_argument('--no-synthetic', action='store_true', help="Не выполнять замеры на синтетических видео")
+    parser.add_argument('--detector', default=None, help="Детектор лиц DeepFace")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="Сохранить результаты режима full как эталоны синтетических видео")
+    parser.add_argument('--max-fps-drop', type=float, default=DEFAULT_MAX_FPS_DROP, help="Допустимое падение скорости (доля)")
+    parser.add_argument('--max-accuracy-drop', type=float, default=DEFAULT_MAX_ACCURACY_DROP, help="Допустимое падение точности")
+    parser.add_argument('--gpu', action='store_true', help="Разрешить использование GPU (по умолчанию замер на CPU)")
+    args = parser.parse_args()
+
+    if not args.gpu:
+        # Переменная наследуется процессами замера до импорта TensorFlow
+        os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    process_kwargs = {'pipeline_queue_size': 8}
+    if args.detector:
+        process_kwargs['detector_backend'] = args.detector
+
+    cases = []
+    if not args.no_sample:
+        cases.append({'name': 'sample', 'video_path': SAMPLE_VIDEO, 'baseline_path': SAMPLE_BASELINE})
+    synthetic_clips = [] if args.no_synthetic else args.synthetic or DEFAULT_SYNTHETIC_CLIPS
+    if synthetic_clips:
+        sprites = collect_face_sprites()
+        for num_faces, width, height, duration_s in synthetic_clips:
+            case = get_synthetic_case(num_faces, width, height, duration_s, sprites)
+            case['baseline_path'] = os.path.join(BASELINES_DIR, f"{case['name']}.csv")
+            cases.append(case)
+
+    history = load_history()
+    records = run_suite(cases, args.modes, process_kwargs, update_baseline=args.update_baseline)
+    print(format_records(records))
+    append_history(records)
+    print(f"История замеров дополнена: {HISTORY_PATH}")
+
+    regressions = check_regressions(records, history, args.max_fps_drop, args.max_accuracy_drop)
+    for regression in regressions:
+        print(f"Регрессия: {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+import glob
+import pickle
+import shutil
+
+# Имя папки контрольных точек в папке результатов и файла состояния в ней
+CHECKPOINT_DIR_NAME = "checkpoint"
+CHECKPOINT_FILE = "checkpoint.pkl"
+# Интервал контрольных точек по умолчанию (кадров)
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+
+
+class ProcessingCheckpoint:
+    """
+    Контрольные точки обработки видео.
+    Видео кодируется сегментами, а журнал детекций пишется частями: на каждой контрольной точке
+    текущий сегмент и часть журнала закрываются, а состояние (FaceMetrics, галерея лиц, номер последнего
+    обработанного кадра) сохраняется атомарно. После перезапуска обработка продолжается с этого кадра,
+    а сегменты и части журнала, записанные после контрольной точки, удаляются.
+    """
+    def __init__(self, checkpoint_dir, video_path, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        Инициализация.
+
+        Параметры:
+          checkpoint_dir (str): Папка для сегментов видео, частей журнала и файла состояния.
+          video_path (str): Путь к исходному видео (контрольная точка другого видео не используется).
+          interval (int): Интервал контрольных точек в кадрах.
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.video_path = video_path
+        self.interval = max(1, int(interval))
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    @property
+    def state_path(self):
+        return os.path.join(self.checkpoint_dir, CHECKPOINT_FILE)
+
+    def segment_path(self, index):
+        return os.path.join(self.checkpoint_dir, f"segment_{index:05d}.mp4")
+
+    def log_part_path(self, index):
+        return os.path.join(self.checkpoint_dir, f"detections_{index:05d}.arrows")
+
+    def is_due(self, frame_count):
+        """
+        True, если после кадра frame_count нужно сохранить контрольную точку.
+        """
+        return frame_count % self.interval == 0
+
+    def _video_signature(self):
+        return os.path.abspath(self.video_path), os.path.getsize(self.video_path)
+
+    def snapshot(self, state):
+        """
+        Фиксирует состояние обработки (сериализует его), чтобы дальнейшие изменения объектов
+        не попали в контрольную точку.
+
+        Параметры:
+          state (dict): Состояние обработки.
+
+        Возвращает:
+          bytes: Сериализованное состояние.
+        """
+        return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def save(self, snapshot, segments):
+        """
+        Атомарно сохраняет контрольную точку.
+
+        Параметры:
+          snapshot (bytes): Состояние из snapshot().
+          segments (int): Число завершённых сегментов видео.
+        """
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, 'wb') as state_file:
+            pickle.dump({'video': self._video_signature(), 'state': snapshot, 'segments': segments}, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temp_path, self.state_path)
+
+    def load(self):
+        """
+        Загружает последнюю контрольную точку и удаляет файлы, записанные после неё.
+
+        Возвращает:
+          dict: Состояние обработки с ключом 'segments' (число завершённых сегментов видео)
+                или None, если контрольной точки нет или она относится к другому видео.
+        """
+        checkpoint = None
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'rb') as state_file:
+                    checkpoint = pickle.load(state_file)
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                print(f"Не удалось прочитать контрольную точку, обработка начнётся заново: {e}")
+        if checkpoint is None or checkpoint['video'] != self._video_signature():
+            self._remove_files(0, 0)
+            return None
+
+        state = pickle.loads(checkpoint['state'])
+        state['segments'] = checkpoint['segments']
+        self._remove_files(state['segments'], state['log_parts'])
+        return state
+
+    def _remove_files(self, segments, log_parts):
+        """
+        Удаляет сегменты видео и части журнала с номерами не меньше заданных.
+        """
+        for pattern, keep, path_for in (("segment_*.mp4", segments, self.segment_path),
+                                        ("detections_*.arrows", log_parts, self.log_part_path)):
+            kept = {path_for(index) for index in range(keep)}
+            for path in glob.glob(os.path.join(self.checkpoint_dir, pattern)):
+                if path not in kept:
+                    os.remove(path)
+
+    def clear(self):
+        """
+        Удаляет папку контрольных точек после успешного завершения обработки.
+        """
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
@@ -0,0 +1,229 @@
+import os
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+import cv2
+from face_gallery import FaceGallery
+from identity_store import IdentityStore
+from detection_log import merge_detection_logs
+from video_encoder import concat_video_segments
+from model_registry import DETECTOR_BACKEND
+from video_handler import process_video_one_cell, conver_and_save_detected_faces, load_deepface_models
+
+
+def get_keyframe_indices(video_path, fps):
+    """
+    Получает номера ключевых кадров видео с помощью ffprobe.
+
+    Параметры:
+      video_path (str): Путь к видеофайлу.
+      fps (float): Частота кадров видео.
+
+    Возвращает:
+      list: Отсортированный список номеров ключевых кадров (пустой, если ffprobe недоступен).
+    """
+    command = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+        '-show_entries', 'frame=pts_time', '-of', 'csv=p=0', video_path
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Не удалось получить ключевые кадры, видео будет разделено равномерно: {e}")
+        return []
+    indices = set()
+    for line in result.stdout.splitlines():
+        try:
+            indices.add(int(round(float(line.strip().rstrip(',')) * fps)))
+        except ValueError:
+            continue
+    return sorted(indices)
+
+
+def split_video_into_chunks(video_path, num_chunks):
+    """
+    Делит видео на диапазоны кадров примерно равной длины, выравнивая границы по ключевым кадрам.
+
+    Параметры:
+      video_path (str): Путь к видеофайлу.
+      num_chunks (int): Желаемое число фрагментов.
+
+    Возвращает:
+      list: Список пар (начальный кадр, конечный кадр); конечный кадр последнего фрагмента равен None
+            (фрагмент читается до конца видео).
+    """
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    if total_frames <= 0 or num_chunks <= 1:
+        return [(0, None)]
+
+    bounds = [round(i * total_frames / num_chunks) for i in range(1, num_chunks)]
+    keyframes = get_keyframe_indices(video_path, fps)
+    if keyframes:
+        # Граница на ключевом кадре позволяет фрагменту начинаться без декодирования предыдущей группы кадров
+        bounds = [min(keyframes, key=lambda keyframe: abs(keyframe - bound)) for bound in bounds]
+    bounds = sorted(set(bound for bound in bounds if 0 < bound < total_frames))
+    return list(zip([0] + bounds, bounds + [None]))
+
+
+def _init_worker(num_threads, detector_backend):
+    """
+    Инициализирует процесс-обработчик: ограничивает число потоков и один раз загружает модели.
+    """
+    cv2.setNumThreads(num_threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    load_deepface_models(detector_backend)
+
+
+def _process_chunk(chunk_index, video_path, faces_dir, segment_path, log_path, start_frame, end_frame, progress, process_kwargs):
+    """
+    Обрабатывает один фрагмент видео в процессе-обработчике.
+
+    Возвращает:
+      tuple: (словарь FaceMetrics фрагмента, галерея лиц фрагмента).
+    """
+    def report_progress(current, total):
+        progress[chunk_index] = current
+
+    gallery = FaceGallery()
+    tracked_faces = process_video_one_cell(
+        video_path=video_path,
+        faces_dir=faces_dir,
+        output_video_path=segment_path,
+        progress_callback=report_progress,
+        csv_output_path=None,
+        gallery=gallery,
+        detection_log_path=log_path,
+        start_frame=start_frame,
+        end_frame=end_frame,
+        **process_kwargs
+    )
+    return tracked_faces, gallery
+
+
+def reconcile_chunk_identities(chunk_results, face_id_map=None, gallery=None):
+    """
+    Объединяет лица, найденные в разных фрагментах, в общий словарь FaceMetrics.
+    Лица сопоставляются по эмбеддингам галерей фрагментов в порядке следования фрагментов,
+    поэтому идентификатор лица — первое его появление в видео (или в общей базе лиц, если она передана).
+
+    Параметры:
+      chunk_results (list): Пары (словарь FaceMetrics, FaceGallery) в порядке фрагментов.
+      face_id_map (dict): Если передан, заполняется заменами идентификаторов лиц фрагментов на общие.
+      gallery (IdentityStore): Общая база лиц между видео; новые лица добавляются в неё. None — только это видео.
+
+    Возвращает:
+      dict: Общий словарь объектов FaceMetrics для каждого уникального лица.
+    """
+    merged_faces = {}
+    global_gallery = gallery if gallery is not None else FaceGallery()
+    for tracked_faces, gallery in chunk_results:
+        embeddings = dict(zip(gallery.identities, gallery.embeddings))
+        for face_id, face_metrics in tracked_faces.items():
+            embedding = embeddings.get(face_id)
+            global_id = global_gallery.match(embedding) if embedding is not None else None
+            if global_id is None:
+                if embedding is not None:
+                    global_gallery.add(face_id, embedding)
+                merged_faces[face_id] = face_metrics
+            else:
+                if global_id in merged_faces:
+                    merged_faces[global_id].merge(face_metrics)
+                else:
+                    # Лицо уже есть в общей базе из другого видео
+                    face_metrics.id = global_id
+                    merged_faces[global_id] = face_metrics
+                if face_id_map is not None:
+                    face_id_map[face_id] = global_id
+    return merged_faces
+
+
+def process_video_chunked(video_path, faces_dir, output_video_path, num_workers=None, progress_callback=None, csv_output_path="video_results.csv", detection_log_path=None, identity_store_dir=None, **process_kwargs):
+    """
+    Обрабатывает длинное видео параллельно: делит его на фрагменты по ключевым кадрам, обрабатывает
+    каждый фрагмент в отдельном процессе (модели загружаются один раз на процесс), затем склеивает
+    аннотированные фрагменты и объединяет лица, найденные на границах фрагментов.
+    Подписи на видео строятся по метрикам, накопленным внутри своего фрагмента.
+
+    Параметры:
+      video_path (str): Путь к исходному видеофайлу.
+      faces_dir (str): Путь для сохранения изображений лиц.
+      output_video_path (str): Путь для сохранения обработанного видео; None — только аналитика, без видео.
+      num_workers (int): Число процессов-обработчиков; по умолчанию — число ядер CPU.
+      progress_callback (function): Функция для обновления прогресса обработки.
+      csv_output_path (str): Путь для сохранения CSV с результатами; None — CSV не сохраняется.
+      detection_log_path (str): Путь к покадровому журналу детекций; журналы фрагментов объединяются в него
+                                с общими идентификаторами лиц. None — журнал не создаётся.
+      identity_store_dir (str): Папка общей базы лиц между видео: лица фрагментов сопоставляются с ней при объединении,
+                                новые лица добавляются в неё. None — сопоставление только внутри видео.
+      process_kwargs: Дополнительные параметры process_video_one_cell (порог, align, режим трекинга и т.д.).
+
+    Возвращает:
+      dict: Словарь объектов FaceMetrics для каждого уникального лица.
+    """
+    cpu_count = os.cpu_count() or 1
+    num_workers = num_workers or cpu_count
+    chunks = split_video_into_chunks(video_path, num_workers)
+    os.makedirs(faces_dir, exist_ok=True)
+
+    cap = cv2.VideoCapture(video_path)
+    total_frames = max(1, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    cap.release()
+
+    if output_video_path is not None:
+        root, ext = os.path.splitext(output_video_path)
+        segment_paths = [f"{root}.part{index:03d}{ext}" for index in range(len(chunks))]
+    else:
+        segment_paths = [None] * len(chunks)
+    if detection_log_path is not None:
+        log_root, log_ext = os.path.splitext(detection_log_path)
+        log_paths = [f"{log_root}.part{index:03d}{log_ext}" for index in range(len(chunks))]
+    else:
+        log_paths = [None] * len(chunks)
+    # Потоки CPU делятся между процессами, чтобы они не конкурировали друг с другом
+    threads_per_worker = max(1, cpu_count // num_workers)
+
+    # spawn вместо fork: TensorFlow в родительском процессе может быть уже инициализирован
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        progress = manager.dict()
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(threads_per_worker, process_kwargs.get('detector_backend', DETECTOR_BACKEND))) as executor:
+            futures = [
+                executor.submit(_process_chunk, index, video_path, faces_dir, segment_paths[index], log_paths[index],
+                                start_frame, end_frame, progress, process_kwargs)
+                for index, (start_frame, end_frame) in enumerate(chunks)
+            ]
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=0.5)
+                if progress_callback is not None:
+                    progress_callback(min(sum(progress.values()), total_frames), total_frames)
+            chunk_results = [future.result() for future in futures]
+
+    face_id_map = {}
+    identity_store = IdentityStore(identity_store_dir, source=video_path) if identity_store_dir is not None else None
+    try:
+        tracked_faces = reconcile_chunk_identities(chunk_results, face_id_map, identity_store)
+        if identity_store is not None:
+            identity_store.update_index()
+    finally:
+        if identity_store is not None:
+            identity_store.close()
+    if output_video_path is not None:
+        concat_video_segments(segment_paths, output_video_path)
+        for segment_path in segment_paths:
+            os.remove(segment_path)
+    if detection_log_path is not None:
+        merge_detection_logs(log_paths, detection_log_path, face_id_map)
+        for log_path in log_paths:
+            os.remove(log_path)
+    print(f"Видео обработано {len(chunks)} фрагментами в {num_workers} процессах")
+
+    if csv_output_path is not None:
+        conver_and_save_detected_faces(tracked_faces, csv_output_path)
+    return tracked_faces
@@ -0,0 +1,242 @@
+from bisect import bisect_left, bisect_right
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Имя файла журнала детекций в папке результатов
+DETECTION_LOG_NAME = "detections.arrows"
+# Число строк в одном блоке (record batch) журнала
+DEFAULT_CHUNK_SIZE = 4096
+
+_DICTIONARY_STRING = pa.dictionary(pa.int32(), pa.string())
+
+DETECTION_LOG_SCHEMA = pa.schema([
+    ('frame', pa.int32()),
+    ('timestamp', pa.float64()),
+    ('track_id', pa.int32()),
+    ('face_id', _DICTIONARY_STRING),
+    ('x', pa.int32()),
+    ('y', pa.int32()),
+    ('w', pa.int32()),
+    ('h', pa.int32()),
+    ('confidence', pa.float32()),
+    ('age', pa.int16()),
+    ('gender', _DICTIONARY_STRING),
+    ('race', _DICTIONARY_STRING),
+    ('emotion', _DICTIONARY_STRING),
+    ('weight', pa.int32()),
+])
+_DICTIONARY_COLUMNS = {'face_id', 'gender', 'race', 'emotion'}
+
+
+class DetectionLogWriter:
+    """
+    Покадровый журнал детекций в формате потока Arrow IPC.
+    Строки накапливаются в буфере и записываются блоками по chunk_size строк; файл только дописывается,
+    поэтому уже записанные блоки остаются читаемыми, даже если обработка прервалась.
+    Строки должны добавляться в порядке кадров: на этом основан индекс времени DetectionLog.
+    """
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Открывает журнал для записи.
+
+        Параметры:
+          path (str): Путь к файлу журнала.
+          chunk_size (int): Число строк в одном блоке.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._rows = {name: [] for name in DETECTION_LOG_SCHEMA.names}
+        self._size = 0
+        self._sink = pa.OSFile(path, 'wb')
+        self._writer = pa.ipc.new_stream(self._sink, DETECTION_LOG_SCHEMA)
+
+    def append(self, frame, timestamp, face_id, x, y, w, h, age=None, gender=None, race=None, emotion=None,
+               confidence=None, track_id=None, weight=1):
+        """
+        Добавляет детекцию лица на кадре.
+
+        Параметры:
+          frame (int): Номер кадра.
+          timestamp (float): Время кадра от начала видео (с).
+          face_id (str): Идентификатор лица.
+          x, y, w, h (int): Регион лица.
+          age, gender, race, emotion: Атрибуты лица на этом кадре.
+          confidence (float): Уверенность детектора.
+          track_id (int): Номер трека (если используется трекинг).
+          weight (int): Число кадров, которое представляет этот кадр при выборочном анализе.
+        """
+        row = (frame, timestamp, track_id, face_id, x, y, w, h, confidence, age, gender, race, emotion, weight)
+        for name, value in zip(DETECTION_LOG_SCHEMA.names, row):
+            self._rows[name].append(value)
+        self._size += 1
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def write_batch(self, batch):
+        """
+        Записывает готовый блок (record batch со схемой DETECTION_LOG_SCHEMA) после накопленных строк.
+        """
+        self.flush()
+        self._writer.write_batch(batch)
+
+    def flush(self):
+        """
+        Записывает накопленные строки отдельным блоком.
+        """
+        if not self._size:
+            return
+        self._writer.write_batch(_make_batch(self._rows))
+        self._rows = {name: [] for name in DETECTION_LOG_SCHEMA.names}
+        self._size = 0
+
+    def close(self):
+        if self._writer is None:
+            return
+        self.flush()
+        self._writer.close()
+        self._sink.close()
+        self._writer = None
+
+
+def _make_batch(columns):
+    arrays = []
+    for field in DETECTION_LOG_SCHEMA:
+        if field.name in _DICTIONARY_COLUMNS:
+            arrays.append(pa.array(columns[field.name], type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    return pa.record_batch(arrays, schema=DETECTION_LOG_SCHEMA)
+
+
+class DetectionLog:
+    """
+    Чтение журнала детекций с запросами по диапазону времени или кадров.
+    Файл отображается в память, а индекс строится по первому и последнему значению времени
+    и номера кадра каждого блока, поэтому запрос читает только блоки, пересекающие диапазон.
+    """
+    def __init__(self, path):
+        """
+        Открывает журнал. Неполный последний блок (обработка прервана во время записи) пропускается.
+
+        Параметры:
+          path (str): Путь к файлу журнала.
+        """
+        self.path = path
+        self._source = pa.memory_map(path)
+        self._batches = []
+        reader = pa.ipc.open_stream(self._source)
+        while True:
+            try:
+                batch = reader.read_next_batch()
+            except StopIteration:
+                break
+            except (pa.ArrowInvalid, OSError):
+                break
+            if batch.num_rows:
+                self._batches.append(batch)
+
+        self._first_times = [batch.column('timestamp')[0].as_py() for batch in self._batches]
+        self._last_times = [batch.column('timestamp')[-1].as_py() for batch in self._batches]
+        self._first_frames = [batch.column('frame')[0].as_py() for batch in self._batches]
+        self._last_frames = [batch.column('frame')[-1].as_py() for batch in self._batches]
+
+    def __len__(self):
+        return sum(batch.num_rows for batch in self._batches)
+
+    def iter_batches(self):
+        """
+        Возвращает блоки журнала (pyarrow.RecordBatch) в порядке записи.
+        """
+        return iter(self._batches)
+
+    def time_range(self):
+        """
+        Возвращает (время первой, время последней детекции) или (None, None) для пустого журнала.
+        """
+        if not self._batches:
+            return None, None
+        return self._first_times[0], self._last_times[-1]
+
+    def _select(self, column, first_values, last_values, start, end, face_ids):
+        low = 0 if start is None else bisect_left(last_values, start)
+        high = len(self._batches) if end is None else bisect_right(first_values, end)
+        table = pa.Table.from_batches(self._batches[low:high], schema=DETECTION_LOG_SCHEMA)
+        if start is not None:
+            table = table.filter(pc.greater_equal(table[column], start))
+        if end is not None:
+            table = table.filter(pc.less_equal(table[column], end))
+        df = table.to_pandas()
+        if face_ids is not None:
+            df = df[df['face_id'].isin(face_ids)].reset_index(drop=True)
+        return df
+
+    def query(self, start_time=None, end_time=None, face_ids=None):
+        """
+        Возвращает детекции в диапазоне времени (границы включаются).
+
+        Параметры:
+          start_time (float): Начало диапазона (с); None — с начала видео.
+          end_time (float): Конец диапазона (с); None — до конца видео.
+          face_ids (list): Оставить только эти лица; None — все лица.
+
+        Возвращает:
+          pandas.DataFrame: Строки журнала (столбцы DETECTION_LOG_SCHEMA).
+        """
+        return self._select('timestamp', self._first_times, self._last_times, start_time, end_time, face_ids)
+
+    def query_frames(self, start_frame=None, end_frame=None, face_ids=None):
+        """
+        Возвращает детекции в диапазоне номеров кадров (границы включаются).
+        """
+        return self._select('frame', self._first_frames, self._last_frames, start_frame, end_frame, face_ids)
+
+    def summarize(self, start_time=None, end_time=None):
+        """
+        Сводка по лицам в диапазоне времени: кто был в кадре и сколько.
+
+        Возвращает:
+          pandas.DataFrame: Для каждого лица — время первого и последнего появления и число кадров
+                            (с учётом веса кадров при выборочном анализе).
+        """
+        df = self.query(start_time, end_time)
+        return df.groupby('face_id', observed=True).agg(
+            first_seen=('timestamp', 'min'),
+            last_seen=('timestamp', 'max'),
+            frames=('weight', 'sum'),
+        ).reset_index().sort_values('first_seen', ignore_index=True)
+
+    def close(self):
+        self._batches = []
+        self._source.close()
+
+
+def get_frame_timestamp(frame_count, fps):
+    """
+    Возвращает время кадра (с) по его номеру (нумерация с 1), как в CSV с детекциями.
+    Если частота кадров неизвестна, используется 25 кадров/с, как при кодировании видео.
+    """
+    return (frame_count - 1) / (fps or 25)
+
+
+def merge_detection_logs(part_paths, output_path, face_id_map=None):
+    """
+    Объединяет журналы фрагментов видео (в порядке следования) в один журнал.
+
+    Параметры:
+      part_paths (list): Пути к журналам фрагментов.
+      output_path (str): Путь к итоговому журналу.
+      face_id_map (dict): Замена идентификаторов лиц фрагментов на общие идентификаторы.
+    """
+    writer = DetectionLogWriter(output_path)
+    try:
+        for part_path in part_paths:
+            log = DetectionLog(part_path)
+            for batch in log.iter_batches():
+                if face_id_map:
+                    columns = batch.to_pydict()
+                    columns['face_id'] = [face_id_map.get(face_id, face_id) for face_id in columns['face_id']]
+                    batch = _make_batch(columns)
+                writer.write_batch(batch)
+            log.close()
+    finally:
+        writer.close()
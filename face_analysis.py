@@ -0,0 +1,306 @@
+import time
+import cv2
+import numpy as np
+from deepface import DeepFace
+from deepface.modules import preprocessing
+from deepface.models.demography import Emotion, Gender, Race
+from deepface.models.demography.Age import find_apparent_age
+from model_registry import model_registry, DETECTOR_BACKEND
+
+# Действия анализа атрибутов лица, которые поддерживает пакетный этап
+ATTRIBUTE_ACTIONS = ['age', 'gender', 'race', 'emotion']
+# Названия моделей DeepFace для каждого действия
+ATTRIBUTE_MODELS = {'age': 'Age', 'gender': 'Gender', 'race': 'Race', 'emotion': 'Emotion'}
+# Размер входа моделей возраста, пола и расы
+ATTRIBUTE_INPUT_SIZE = (224, 224)
+# Размер входа модели эмоций (изображение в оттенках серого)
+EMOTION_INPUT_SIZE = (48, 48)
+# Меньшая сторона лица (пикселей), начиная с которой детекторы DeepFace надёжно находят лица
+DETECTOR_MIN_FACE_SIZE = 24
+# Нижняя граница масштаба кадра для детекции
+MIN_DETECTION_SCALE = 0.1
+
+
+def get_detection_scale(frame_w, frame_h, detection_scale=None, detection_short_side=None, min_face_size=0):
+    """
+    Определяет масштаб кадра для детекции лиц. Кадр только уменьшается: масштаб не больше 1.
+
+    Параметры:
+      frame_w (int): Ширина кадра.
+      frame_h (int): Высота кадра.
+      detection_scale (float | str): Множитель размера кадра (например, 0.5) или 'auto' — масштаб, при котором
+                                     лицо размером min_face_size уменьшается до DETECTOR_MIN_FACE_SIZE.
+                                     None — без уменьшения.
+      detection_short_side (int): Меньшая сторона кадра для детекции в пикселях (задаёт масштаб вместо detection_scale).
+      min_face_size (int): Минимальный размер нужных лиц в пикселях исходного кадра (для режима 'auto').
+
+    Возвращает:
+      float: Масштаб кадра для детекции (0 < масштаб <= 1).
+    """
+    if detection_short_side:
+        scale = detection_short_side / min(frame_w, frame_h)
+    elif detection_scale == 'auto':
+        # Без минимального размера лица уменьшение может потерять мелкие лица, поэтому кадр не уменьшается
+        scale = DETECTOR_MIN_FACE_SIZE / min_face_size if min_face_size else 1.0
+    elif detection_scale:
+        scale = float(detection_scale)
+    else:
+        scale = 1.0
+    return min(max(scale, MIN_DETECTION_SCALE), 1.0)
+
+
+def _align_face(frame, region):
+    """
+    Вырезает лицо из кадра с поворотом, выравнивающим глаза по горизонтали (как align в DeepFace).
+    Поворачивается только окрестность лица, а не весь кадр.
+    """
+    x, y, w, h = region['x'], region['y'], region['w'], region['h']
+    left_eye, right_eye = region['left_eye'], region['right_eye']
+    angle = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+    frame_h, frame_w = frame.shape[:2]
+    # Окрестность с запасом в половину размера лица, чтобы после поворота в углах не оставалось пустоты
+    left, top = max(x - w // 2, 0), max(y - h // 2, 0)
+    right, bottom = min(x + w + w // 2, frame_w), min(y + h + h // 2, frame_h)
+    area = frame[top:bottom, left:right]
+    center = (x + w / 2 - left, y + h / 2 - top)
+    rotation = cv2.getRotationMatrix2D(center, angle, 1.0)
+    rotated = cv2.warpAffine(area, rotation, (area.shape[1], area.shape[0]))
+    return rotated[y - top:y - top + h, x - left:x - left + w]
+
+
+def _scale_region(region, scale, frame_w, frame_h):
+    """
+    Переводит регион лица из координат уменьшенного кадра в координаты исходного кадра.
+    """
+    x = min(int(round(region['x'] / scale)), frame_w - 1)
+    y = min(int(round(region['y'] / scale)), frame_h - 1)
+    scaled = {
+        'x': x,
+        'y': y,
+        'w': max(min(int(round(region['w'] / scale)), frame_w - x), 1),
+        'h': max(min(int(round(region['h'] / scale)), frame_h - y), 1),
+    }
+    for eye in ('left_eye', 'right_eye'):
+        point = region.get(eye)
+        scaled[eye] = None if point is None else (int(round(point[0] / scale)), int(round(point[1] / scale)))
+    return scaled
+
+
+def extract_frame_faces(frame, detector_backend=DETECTOR_BACKEND, align=False, scale=1.0):
+    """
+    Выполняет детекцию лиц на кадре без анализа атрибутов.
+    При масштабе меньше 1 детектор работает на уменьшенной копии кадра, регионы переводятся в координаты
+    исходного кадра, а лица для анализа атрибутов и эмбеддингов вырезаются из кадра в полном разрешении.
+
+    Параметры:
+      frame (numpy.ndarray): Кадр видео.
+      detector_backend (str): Детектор лиц DeepFace.
+      align (bool): Флаг выравнивания лиц по глазам.
+      scale (float): Масштаб кадра для детекции (см. get_detection_scale).
+
+    Возвращает:
+      list: Список словарей DeepFace.extract_faces с ключами 'face', 'facial_area', 'confidence'.
+    """
+    if scale >= 1.0:
+        return DeepFace.extract_faces(
+            img_path=frame,
+            detector_backend=detector_backend,
+            enforce_detection=False,
+            align=align
+        )
+    frame_h, frame_w = frame.shape[:2]
+    small_frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_h, small_w = small_frame.shape[:2]
+    face_objs = DeepFace.extract_faces(
+        img_path=small_frame,
+        detector_backend=detector_backend,
+        enforce_detection=False,
+        align=align
+    )
+    for face_obj in face_objs:
+        region = face_obj['facial_area']
+        if is_full_frame_region(region, small_w, small_h):
+            # Лицо не найдено: регион во весь кадр сохраняет свой вид и в координатах исходного кадра
+            face_obj['facial_area'] = {'x': 0, 'y': 0, 'w': frame_w - 1, 'h': frame_h - 1, 'left_eye': None, 'right_eye': None}
+            continue
+        region = _scale_region(region, scale, frame_w, frame_h)
+        if align and region['left_eye'] is not None and region['right_eye'] is not None:
+            face_img = _align_face(frame, region)
+        else:
+            face_img = frame[region['y']:region['y'] + region['h'], region['x']:region['x'] + region['w']]
+        face_obj['facial_area'] = region
+        # Тот же формат, что у DeepFace.extract_faces: RGB со значениями 0..1
+        face_obj['face'] = face_img[:, :, ::-1] / 255
+    return face_objs
+
+
+def is_full_frame_region(region, frame_w, frame_h):
+    """
+    Проверяет, что регион — это весь кадр, который DeepFace возвращает, если лицо не найдено
+    (при enforce_detection=False).
+
+    Параметры:
+      region (dict): Регион лица с ключами 'x', 'y', 'w', 'h'.
+      frame_w (int): Ширина кадра.
+      frame_h (int): Высота кадра.
+
+    Возвращает:
+      bool: True, если регион занимает весь кадр.
+    """
+    return region['w'] == frame_w - 1 and region['h'] == frame_h - 1
+
+
+def _preprocess_face(face):
+    """
+    Подготавливает лицо из DeepFace.extract_faces ко входу моделей атрибутов так же, как DeepFace.analyze.
+
+    Параметры:
+      face (numpy.ndarray): Лицо в формате RGB (значения 0..1).
+
+    Возвращает:
+      numpy.ndarray: Тензор формы (1, 224, 224, 3) в формате BGR.
+    """
+    return preprocessing.resize_image(img=face[:, :, ::-1], target_size=ATTRIBUTE_INPUT_SIZE)
+
+
+def _predict(model_name, batch):
+    """
+    Выполняет один прямой проход модели атрибута DeepFace по всему пакету.
+    """
+    model = model_registry.get('facial_attribute', model_name).model
+    # model.predict в цикле приводит к утечкам памяти, поэтому модель вызывается напрямую
+    return np.asarray(model(batch, training=False))
+
+
+def analyze_faces_batch(face_objs, actions=ATTRIBUTE_ACTIONS):
+    """
+    Анализирует атрибуты всех переданных лиц: каждая модель запускается один раз на весь пакет.
+
+    Параметры:
+      face_objs (list): Список словарей DeepFace.extract_faces (возможно, с разных кадров).
+      actions (list): Список действий анализа ('age', 'gender', 'race', 'emotion').
+
+    Возвращает:
+      list: Список словарей того же формата, что и у DeepFace.analyze (по одному на лицо).
+    """
+    if not face_objs:
+        return []
+    batch = np.concatenate([_preprocess_face(face_obj['face']) for face_obj in face_objs], axis=0)
+    results = [{} for _ in face_objs]
+
+    for action in actions:
+        if action == 'emotion':
+            gray = np.stack([
+                cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), EMOTION_INPUT_SIZE) for img in batch
+            ])[..., np.newaxis]
+            predictions = _predict(ATTRIBUTE_MODELS[action], gray)
+            for obj, emotion_predictions in zip(results, predictions):
+                sum_of_predictions = emotion_predictions.sum()
+                obj['emotion'] = {
+                    label: 100 * emotion_predictions[i] / sum_of_predictions
+                    for i, label in enumerate(Emotion.labels)
+                }
+                obj['dominant_emotion'] = Emotion.labels[np.argmax(emotion_predictions)]
+        elif action == 'age':
+            predictions = _predict(ATTRIBUTE_MODELS[action], batch)
+            for obj, age_predictions in zip(results, predictions):
+                obj['age'] = int(find_apparent_age(age_predictions))
+        elif action == 'gender':
+            predictions = _predict(ATTRIBUTE_MODELS[action], batch)
+            for obj, gender_predictions in zip(results, predictions):
+                obj['gender'] = {
+                    label: 100 * gender_predictions[i] for i, label in enumerate(Gender.labels)
+                }
+                obj['dominant_gender'] = Gender.labels[np.argmax(gender_predictions)]
+        elif action == 'race':
+            predictions = _predict(ATTRIBUTE_MODELS[action], batch)
+            for obj, race_predictions in zip(results, predictions):
+                sum_of_predictions = race_predictions.sum()
+                obj['race'] = {
+                    label: 100 * race_predictions[i] / sum_of_predictions
+                    for i, label in enumerate(Race.labels)
+                }
+                obj['dominant_race'] = Race.labels[np.argmax(race_predictions)]
+        else:
+            raise ValueError(f"Неизвестное действие анализа: {action}")
+
+    for obj, face_obj in zip(results, face_objs):
+        obj['region'] = face_obj['facial_area']
+        obj['face_confidence'] = face_obj['confidence']
+    return results
+
+
+class FaceBatcher:
+    """
+    Накапливает кадры с найденными лицами и запускает пакетный анализ атрибутов.
+    Пакет может охватывать несколько кадров: он отправляется на анализ, когда набрано
+    max_batch_size лиц или с момента поступления первого кадра прошло max_delay_ms миллисекунд.
+    Кадры возвращаются строго в порядке поступления.
+    """
+    def __init__(self, max_batch_size=32, max_delay_ms=500, actions=ATTRIBUTE_ACTIONS, metrics=None):
+        """
+        Инициализация накопителя.
+
+        Параметры:
+          max_batch_size (int): Максимальное число лиц в пакете.
+          max_delay_ms (float): Максимальное время ожидания кадра в пакете, мс.
+          actions (list): Список действий анализа.
+          metrics (ProcessingMetrics): Сборщик метрик; время анализа каждого пакета записывается
+                                       в этап 'attribute_inference'.
+        """
+        self.max_batch_size = max_batch_size
+        self.max_delay_ms = max_delay_ms
+        self.actions = actions
+        self.metrics = metrics
+        self._pending = []  # кадры, ожидающие анализа
+        self._pending_faces = 0
+        self._started_at = None
+
+    def submit(self, item):
+        """
+        Добавляет кадр в пакет.
+
+        Параметры:
+          item (dict): Данные кадра; ключ 'faces' содержит список лиц из extract_frame_faces.
+
+        Возвращает:
+          list: Кадры, анализ которых завершён (с ключом 'face_results'); может быть пустым.
+        """
+        if not self._pending and not item['faces']:
+            # Кадр без лиц не нужно задерживать, если перед ним нет ожидающих кадров
+            item['face_results'] = []
+            return [item]
+        if not self._pending:
+            self._started_at = time.perf_counter()
+        self._pending.append(item)
+        self._pending_faces += len(item['faces'])
+
+        elapsed_ms = (time.perf_counter() - self._started_at) * 1000
+        if self._pending_faces >= self.max_batch_size or elapsed_ms >= self.max_delay_ms:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Анализирует все накопленные лица одним пакетом.
+
+        Возвращает:
+          list: Все ожидавшие кадры с заполненным ключом 'face_results'.
+        """
+        items, self._pending, self._pending_faces = self._pending, [], 0
+        face_objs = [face_obj for item in items for face_obj in item['faces']]
+        start_time = time.perf_counter()
+        try:
+            face_results = analyze_faces_batch(face_objs, self.actions)
+        except Exception as e:
+            print(f"Ошибка при пакетном анализе {len(face_objs)} лиц: {e}")
+            face_results = None
+        if self.metrics is not None and face_objs:
+            self.metrics.add_time('attribute_inference', time.perf_counter() - start_time)
+
+        offset = 0
+        for item in items:
+            count = len(item['faces'])
+            item['face_results'] = face_results[offset:offset + count] if face_results is not None else []
+            offset += count
+        return items
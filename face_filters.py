@@ -0,0 +1,94 @@
+from face_analysis import is_full_frame_region
+
+# Счётчики фильтрации лиц по этапам: название -> описание для сводки
+FILTER_COUNTERS = {
+    'detected': "найдено детектором",
+    'fallback': "отброшено: весь кадр (лицо не найдено)",
+    'low_confidence': "отброшено: низкая уверенность",
+    'too_small': "отброшено: слишком маленькое лицо",
+    'outside_roi': "отброшено: вне области интереса",
+    'analyzed': "передано на анализ атрибутов",
+    'gallery_search': "поиск в галерее лиц",
+}
+
+
+class DetectionFilter:
+    """
+    Фильтр детекций, применяемый сразу после детектора: отброшенные лица не попадают
+    в анализ атрибутов и поиск в галерее. Отбрасываются регион во весь кадр (DeepFace возвращает его,
+    если лицо не найдено), лица с уверенностью ниже порога, слишком маленькие лица и лица вне
+    области интереса. Для каждой причины считается число отброшенных лиц.
+    """
+    def __init__(self, min_confidence=0.0, min_face_size=0, roi=None):
+        """
+        Инициализация фильтра.
+
+        Параметры:
+          min_confidence (float): Минимальная уверенность детектора.
+          min_face_size (int): Минимальный размер меньшей стороны лица в пикселях.
+          roi (tuple): Область интереса (left, top, right, bottom) в долях ширины и высоты кадра;
+                       лицо остаётся, если его центр лежит в области. None — весь кадр.
+        """
+        self.min_confidence = min_confidence
+        self.min_face_size = min_face_size
+        self.roi = roi
+        self.counts = dict.fromkeys(FILTER_COUNTERS, 0)
+
+    def _reject_reason(self, face_obj, frame_w, frame_h):
+        region = face_obj['facial_area']
+        if is_full_frame_region(region, frame_w, frame_h):
+            return 'fallback'
+        if face_obj.get('confidence', 1.0) < self.min_confidence:
+            return 'low_confidence'
+        if min(region['w'], region['h']) < self.min_face_size:
+            return 'too_small'
+        if self.roi is not None:
+            left, top, right, bottom = self.roi
+            center_x = (region['x'] + region['w'] / 2) / frame_w
+            center_y = (region['y'] + region['h'] / 2) / frame_h
+            if not (left <= center_x <= right and top <= center_y <= bottom):
+                return 'outside_roi'
+        return None
+
+    def filter(self, face_objs, frame_w, frame_h):
+        """
+        Отбрасывает детекции, не прошедшие фильтры.
+
+        Параметры:
+          face_objs (list): Лица из extract_frame_faces.
+          frame_w (int): Ширина кадра.
+          frame_h (int): Высота кадра.
+
+        Возвращает:
+          list: Оставшиеся лица.
+        """
+        kept = []
+        for face_obj in face_objs:
+            reason = self._reject_reason(face_obj, frame_w, frame_h)
+            if reason != 'fallback':
+                # Регион во весь кадр — не детекция, поэтому в число найденных лиц он не входит
+                self.counts['detected'] += 1
+            if reason is None:
+                kept.append(face_obj)
+            else:
+                self.counts[reason] += 1
+        return kept
+
+    def count(self, counter, value=1):
+        """
+        Увеличивает счётчик последующего этапа ('analyzed', 'gallery_search').
+        """
+        self.counts[counter] += value
+
+
+def format_filter_stats(counts):
+    """
+    Формирует текстовую сводку фильтрации лиц.
+
+    Параметры:
+      counts (dict): Счётчики DetectionFilter.counts.
+
+    Возвращает:
+      str: Строка на каждый счётчик.
+    """
+    return "\n".join(f"{description}: {counts.get(counter, 0)}" for counter, description in FILTER_COUNTERS.items())
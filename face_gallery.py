@@ -0,0 +1,112 @@
+import numpy as np
+from deepface import DeepFace
+
+# Порог косинусного расстояния для Facenet, который DeepFace.find использует по умолчанию
+FACENET_COSINE_THRESHOLD = 0.40
+# Размерность эмбеддинга модели Facenet
+FACENET_EMBEDDING_DIM = 128
+
+
+def get_face_embedding(face_img, model_name="Facenet"):
+    """
+    Вычисляет эмбеддинг лица моделью распознавания DeepFace.
+
+    Параметры:
+      face_img (numpy.ndarray): Изображение лица (уже вырезанное из кадра).
+      model_name (str): Название модели распознавания DeepFace.
+
+    Возвращает:
+      numpy.ndarray: Вектор эмбеддинга (float32).
+    """
+    # Лицо уже вырезано детектором, поэтому повторная детекция не нужна
+    representation = DeepFace.represent(
+        img_path=face_img,
+        model_name=model_name,
+        detector_backend='skip',
+        enforce_detection=False
+    )
+    return np.asarray(representation[0]['embedding'], dtype=np.float32)
+
+
+class FaceGallery:
+    """
+    Галерея известных лиц в памяти процесса.
+    Эмбеддинги хранятся в непрерывной матрице NumPy, новые лица добавляются инкрементально,
+    а поиск выполняется векторизованно по косинусному расстоянию (ближайший сосед).
+    """
+    def __init__(self, dim=FACENET_EMBEDDING_DIM, threshold=FACENET_COSINE_THRESHOLD, initial_capacity=64):
+        """
+        Инициализация галереи.
+
+        Параметры:
+          dim (int): Размерность эмбеддинга.
+          threshold (float): Максимальное косинусное расстояние, при котором лица считаются совпадающими.
+          initial_capacity (int): Начальное число строк матрицы эмбеддингов.
+        """
+        self.dim = dim
+        self.threshold = threshold
+        self.identities = []  # идентификаторы лиц в порядке строк матрицы
+        self._embeddings = np.empty((max(1, initial_capacity), dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def embeddings(self):
+        """
+        Возвращает представление (view) заполненной части матрицы нормированных эмбеддингов.
+        """
+        return self._embeddings[:self._size]
+
+    def _normalize(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def add(self, identity, embedding):
+        """
+        Добавляет лицо в галерею. При нехватке места матрица увеличивается вдвое.
+
+        Параметры:
+          identity (str): Идентификатор лица (например, путь к сохранённому изображению).
+          embedding (numpy.ndarray): Эмбеддинг лица.
+        """
+        if self._size == len(self._embeddings):
+            grown = np.empty((2 * len(self._embeddings), self.dim), dtype=np.float32)
+            grown[:self._size] = self._embeddings[:self._size]
+            self._embeddings = grown
+        self._embeddings[self._size] = self._normalize(embedding)
+        self.identities.append(identity)
+        self._size += 1
+
+    def search(self, embedding):
+        """
+        Находит ближайшее лицо галереи по косинусному расстоянию.
+
+        Параметры:
+          embedding (numpy.ndarray): Эмбеддинг искомого лица.
+
+        Возвращает:
+          tuple: (идентификатор, расстояние) или (None, None), если галерея пуста.
+        """
+        if self._size == 0:
+            return None, None
+        distances = 1.0 - self.embeddings @ self._normalize(embedding)
+        index = int(np.argmin(distances))
+        return self.identities[index], float(distances[index])
+
+    def match(self, embedding):
+        """
+        Возвращает идентификатор ближайшего лица, если расстояние не превышает порог.
+
+        Параметры:
+          embedding (numpy.ndarray): Эмбеддинг искомого лица.
+
+        Возвращает:
+          str или None: Идентификатор найденного лица или None, если совпадений нет.
+        """
+        identity, distance = self.search(embedding)
+        if identity is None or distance > self.threshold:
+            return None
+        return identity
@@ -0,0 +1,198 @@
+import cv2
+import numpy as np
+
+# Размер уменьшенного кадра для определения смены сцены
+SCENE_THUMBNAIL_SIZE = (64, 36)
+
+
+def box_iou(box_a, box_b):
+    """
+    Вычисляет отношение площади пересечения к площади объединения двух прямоугольников.
+
+    Параметры:
+      box_a (tuple): Прямоугольник (x, y, w, h).
+      box_b (tuple): Прямоугольник (x, y, w, h).
+
+    Возвращает:
+      float: Значение IoU от 0 до 1.
+    """
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    inter_w = min(ax + aw, bx + bw) - max(ax, bx)
+    inter_h = min(ay + ah, by + bh) - max(ay, by)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    intersection = inter_w * inter_h
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class Track:
+    """
+    Трек одного лица между кадрами полной детекции.
+    """
+    def __init__(self, track_id, box):
+        """
+        Инициализация трека.
+
+        Параметры:
+          track_id (int): Номер трека.
+          box (tuple): Прямоугольник лица (x, y, w, h).
+        """
+        self.track_id = track_id
+        self.box = box
+        self.confidence = 1.0    # уверенность трекера, сбрасывается в 1 при каждой детекции
+        self.face_id = None      # идентификатор лица в галерее (ключ FaceMetrics)
+        self.face_result = None  # последний результат анализа атрибутов
+
+    def region(self):
+        """
+        Возвращает прямоугольник трека в формате региона DeepFace.
+        """
+        x, y, w, h = self.box
+        return {'x': int(round(x)), 'y': int(round(y)), 'w': int(round(w)), 'h': int(round(h))}
+
+
+class FaceTracker:
+    """
+    Трекер лиц для режима «детекция + трекинг».
+    Полная детекция выполняется каждые detect_interval кадров, при смене сцены или при падении
+    уверенности трека, а на промежуточных кадрах прямоугольники переносятся оптическим потоком
+    (Lucas-Kanade). Детекции сопоставляются с треками по IoU.
+    """
+    def __init__(self, detect_interval=5, iou_threshold=0.3, min_track_confidence=0.5, scene_change_threshold=0.25):
+        """
+        Инициализация трекера.
+
+        Параметры:
+          detect_interval (int): Максимальное число кадров между полными детекциями.
+          iou_threshold (float): Минимальный IoU для сопоставления детекции с треком.
+          min_track_confidence (float): Уверенность трека, ниже которой выполняется повторная детекция
+                                        и повторный анализ атрибутов.
+          scene_change_threshold (float): Средняя разница яркости уменьшенных кадров (0..1),
+                                          выше которой кадр считается сменой сцены.
+        """
+        self.detect_interval = detect_interval
+        self.iou_threshold = iou_threshold
+        self.min_track_confidence = min_track_confidence
+        self.scene_change_threshold = scene_change_threshold
+        self.tracks = []
+        self._next_track_id = 1
+        self._prev_gray = None
+        self._prev_thumbnail = None
+        self._frames_since_detection = 0
+
+    def _is_scene_change(self, gray):
+        thumbnail = cv2.resize(gray, SCENE_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+        changed = (
+            self._prev_thumbnail is not None
+            and np.mean(np.abs(thumbnail - self._prev_thumbnail)) / 255.0 > self.scene_change_threshold
+        )
+        self._prev_thumbnail = thumbnail
+        return changed
+
+    def _propagate(self, gray):
+        """
+        Переносит прямоугольники треков на новый кадр по медианному смещению оптического потока.
+        Уверенность трека — доля точек, прошедших прямую и обратную проверку потока.
+        """
+        frame_h, frame_w = gray.shape[:2]
+        for track in self.tracks:
+            x, y, w, h = (int(round(v)) for v in track.box)
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(frame_w, x + w), min(frame_h, y + h)
+            if x1 - x0 < 2 or y1 - y0 < 2:
+                track.confidence = 0.0
+                continue
+            points = cv2.goodFeaturesToTrack(self._prev_gray[y0:y1, x0:x1], maxCorners=30, qualityLevel=0.01, minDistance=3)
+            if points is None:
+                track.confidence = 0.0
+                continue
+            points = points.astype(np.float32) + np.array([x0, y0], dtype=np.float32)
+            next_points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, points, None)
+            back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, next_points, None)
+            fb_error = np.linalg.norm((points - back_points).reshape(-1, 2), axis=1)
+            good = (status.reshape(-1) == 1) & (back_status.reshape(-1) == 1) & (fb_error < 1.0)
+            track.confidence = min(track.confidence, float(good.mean()))
+            if good.any():
+                dx, dy = np.median((next_points - points).reshape(-1, 2)[good], axis=0)
+                track.box = (track.box[0] + float(dx), track.box[1] + float(dy), track.box[2], track.box[3])
+
+    def _associate(self, detections):
+        """
+        Жадно сопоставляет детекции с треками по убыванию IoU.
+
+        Возвращает:
+          dict: Индекс детекции -> трек.
+        """
+        pairs = []
+        for track in self.tracks:
+            for index, face_obj in enumerate(detections):
+                area = face_obj['facial_area']
+                iou = box_iou(track.box, (area['x'], area['y'], area['w'], area['h']))
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, index, track))
+        pairs.sort(key=lambda pair: pair[0], reverse=True)
+
+        matches, used_tracks = {}, set()
+        for _, index, track in pairs:
+            if index in matches or track.track_id in used_tracks:
+                continue
+            matches[index] = track
+            used_tracks.add(track.track_id)
+        return matches
+
+    def _update_with_detections(self, detections):
+        matches = self._associate(detections)
+        tracks, result = [], []
+        for index, face_obj in enumerate(detections):
+            area = face_obj['facial_area']
+            box = (area['x'], area['y'], area['w'], area['h'])
+            track = matches.get(index)
+            if track is None:
+                track = Track(self._next_track_id, box)
+                self._next_track_id += 1
+                needs_analysis = True
+            else:
+                # Атрибуты и идентичность пересчитываются, только если трек потерял уверенность
+                needs_analysis = track.confidence < self.min_track_confidence
+                track.box = box
+            track.confidence = 1.0
+            tracks.append(track)
+            result.append((track, track.region(), face_obj if needs_analysis else None))
+        self.tracks = tracks
+        self._frames_since_detection = 0
+        return result
+
+    def step(self, frame, detect):
+        """
+        Обрабатывает очередной кадр.
+
+        Параметры:
+          frame (numpy.ndarray): Кадр видео (3 канала).
+          detect (function): Функция без аргументов, выполняющая полную детекцию на этом кадре
+                             и возвращающая список словарей DeepFace.extract_faces.
+
+        Возвращает:
+          list: Тройки (трек, регион лица на этом кадре, словарь лица из детекции или None).
+                Словарь передаётся только для треков, которым нужен анализ атрибутов и повторная
+                идентификация (новый трек или потеря уверенности).
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scene_change = self._is_scene_change(gray)
+        self._frames_since_detection += 1
+        needs_detection = (
+            self._prev_gray is None
+            or scene_change
+            or self._frames_since_detection >= self.detect_interval
+        )
+        if not needs_detection:
+            self._propagate(gray)
+            needs_detection = any(track.confidence < self.min_track_confidence for track in self.tracks)
+
+        if needs_detection:
+            result = self._update_with_detections(detect())
+        else:
+            result = [(track, track.region(), None) for track in self.tracks]
+        self._prev_gray = gray
+        return result
@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+FONT_PATH = "fonts/LiberationMono-Regular.ttf"
+# Цвета в порядке каналов BGR (как у кадров OpenCV)
+BOX_COLOR = (0, 0, 255)      # красный
+TEXT_COLOR = (0, 255, 255)   # жёлтый
+FILL_COLOR = (0, 0, 0)       # чёрный
+BOX_WIDTH = 2
+
+
+@lru_cache(maxsize=None)
+def get_font(font_size):
+    """
+    Загружает шрифт подписей один раз для каждого размера.
+
+    Параметры:
+      font_size (int): Размер шрифта.
+
+    Возвращает:
+      PIL.ImageFont: Шрифт LiberationMono или шрифт по умолчанию, если файл не найден.
+    """
+    try:
+        return ImageFont.truetype(FONT_PATH, size=font_size)
+    except Exception:
+        return ImageFont.load_default()
+
+
+def _fill_rect(frame, x0, y0, x1, y1, color):
+    """
+    Заливает прямоугольник с включёнными границами (как ImageDraw.rectangle) с обрезкой по кадру.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, frame_w - 1), min(y1, frame_h - 1)
+    if x0 <= x1 and y0 <= y1:
+        frame[y0:y1 + 1, x0:x1 + 1] = color
+
+
+def _blend_mask(frame, mask, x, y, color):
+    """
+    Накладывает цвет по маске сглаживания с той же целочисленной формулой смешивания, что и Pillow,
+    поэтому результат совпадает с ImageDraw.text попиксельно.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    mask_h, mask_w = mask.shape
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + mask_w, frame_w), min(y + mask_h, frame_h)
+    if x0 >= x1 or y0 >= y1:
+        return
+    region = frame[y0:y1, x0:x1]
+    alpha = mask[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.int32)[..., np.newaxis]
+    blended = region.astype(np.int32) * (255 - alpha) + np.array(color, dtype=np.int32) * alpha + 128
+    region[...] = ((blended >> 8) + blended) >> 8
+
+
+class FrameAnnotator:
+    """
+    Рисует прямоугольники лиц и подписи прямо в буфере кадра BGR без преобразования в PIL.
+    Шрифт загружается один раз для каждого размера кадра, а растр каждой подписи
+    кэшируется по тексту и размеру шрифта.
+    """
+    def __init__(self, max_cached_labels=4096):
+        """
+        Инициализация.
+
+        Параметры:
+          max_cached_labels (int): Максимальное число подписей в кэше растров.
+        """
+        self.max_cached_labels = max_cached_labels
+        self._labels = OrderedDict()
+
+    def _get_label(self, text, font_size):
+        """
+        Возвращает растр подписи: маску сглаживания, сдвиг маски и рамку текста font.getbbox.
+        """
+        key = (text, font_size)
+        label = self._labels.get(key)
+        if label is not None:
+            self._labels.move_to_end(key)
+            return label
+
+        font = get_font(font_size)
+        bbox = font.getbbox(text)
+        # Маска рисуется той же функцией Pillow, поэтому сглаживание совпадает с прежней отрисовкой
+        shift_x, shift_y = max(0, -bbox[0]), max(0, -bbox[1])
+        mask_image = Image.new("L", (max(1, bbox[2] + shift_x), max(1, bbox[3] + shift_y)), 0)
+        ImageDraw.Draw(mask_image).text((shift_x, shift_y), text, font=font, fill=255)
+        label = (np.asarray(mask_image), shift_x, shift_y, bbox)
+
+        self._labels[key] = label
+        if len(self._labels) > self.max_cached_labels:
+            self._labels.popitem(last=False)
+        return label
+
+    def draw(self, frame, annotations):
+        """
+        Рисует аннотации на кадре (кадр изменяется на месте).
+
+        Параметры:
+          frame (numpy.ndarray): Кадр BGR.
+          annotations (list): Список (x, y, w, h, подпись) для каждого лица.
+
+        Возвращает:
+          numpy.ndarray: Тот же кадр с аннотациями.
+        """
+        frame_h, frame_w = frame.shape[:2]
+        font_size = frame_h // 40  # динамический размер шрифта
+        for x, y, w_face, h_face, text in annotations:
+            x1, y1 = x + w_face, y + h_face
+            # Рамка толщиной BOX_WIDTH внутрь прямоугольника, как у ImageDraw.rectangle(width=...)
+            _fill_rect(frame, x, y, x1, y + BOX_WIDTH - 1, BOX_COLOR)
+            _fill_rect(frame, x, y1 - BOX_WIDTH + 1, x1, y1, BOX_COLOR)
+            _fill_rect(frame, x, y, x + BOX_WIDTH - 1, y1, BOX_COLOR)
+            _fill_rect(frame, x1 - BOX_WIDTH + 1, y, x1, y1, BOX_COLOR)
+
+            mask, shift_x, shift_y, bbox = self._get_label(text, font_size)
+            text_width = bbox[2] - bbox[0]
+            text_height = bbox[3] - bbox[1]
+            text_x = x if (x + text_width) <= frame_w else x - text_width // 2
+            _fill_rect(frame, text_x, y - text_height, text_x + text_width, y, FILL_COLOR)
+            _blend_mask(frame, mask, text_x - shift_x, y - text_height - shift_y, TEXT_COLOR)
+        return frame
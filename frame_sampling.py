@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+
+# Размер уменьшенного кадра для оценки движения
+MOTION_THUMBNAIL_SIZE = (64, 36)
+
+
+class FrameSampler:
+    """
+    Выбирает кадры для анализа.
+
+    Режимы:
+      - фиксированный шаг: анализируется каждый stride-й кадр;
+      - целевая частота анализа: шаг вычисляется из частоты кадров видео (target_fps);
+      - по движению: кадр анализируется, если средняя разница яркости с последним
+        проанализированным кадром превышает motion_threshold, но не реже, чем раз в max_interval кадров.
+
+    Каждому проанализированному кадру назначается вес — число кадров, которое он представляет
+    (шаг анализа или интервал от предыдущего проанализированного кадра в режиме движения),
+    чтобы счётчики оставались сопоставимыми с покадровой обработкой.
+    """
+    def __init__(self, video_fps, stride=1, target_fps=None, motion_threshold=None):
+        """
+        Инициализация.
+
+        Параметры:
+          video_fps (float): Частота кадров видео.
+          stride (int): Шаг анализа кадров; в режиме движения — максимальный интервал между анализами.
+          target_fps (float): Целевая частота анализа кадров (кадров в секунду); задаёт шаг вместо stride.
+          motion_threshold (float): Порог движения (0..1) для режима анализа по движению.
+        """
+        if target_fps:
+            stride = max(1, int(round((video_fps or target_fps) / target_fps)))
+        self.stride = max(1, int(stride))
+        self.motion_threshold = motion_threshold
+        # В режиме движения кадр анализируется хотя бы раз в max_interval кадров (по умолчанию раз в секунду)
+        self.max_interval = self.stride if self.stride > 1 else max(1, int(round(video_fps or 1)))
+        self._last_index = None
+        self._last_thumbnail = None
+
+    @property
+    def is_enabled(self):
+        return self.stride > 1 or self.motion_threshold is not None
+
+    @property
+    def needs_frame(self):
+        """
+        True, если для решения об анализе нужно декодировать кадр (режим по движению).
+        """
+        return self.motion_threshold is not None
+
+    def should_analyze(self, frame_index, frame=None):
+        """
+        Решает, анализировать ли кадр, и запоминает его как последний проанализированный.
+
+        Параметры:
+          frame_index (int): Номер кадра.
+          frame (numpy.ndarray): Декодированный кадр (нужен только в режиме по движению).
+
+        Возвращает:
+          int: Вес кадра (число представляемых кадров) или 0, если кадр пропускается.
+        """
+        if self._last_index is None:
+            analyze = True
+        elif self.motion_threshold is None:
+            analyze = frame_index - self._last_index >= self.stride
+        else:
+            analyze = frame_index - self._last_index >= self.max_interval or self._motion(frame) > self.motion_threshold
+
+        if not analyze:
+            return 0
+        if self.motion_threshold is None:
+            # При фиксированном шаге кадр представляет себя и stride - 1 следующих пропущенных кадров
+            weight = self.stride
+        else:
+            weight = 1 if self._last_index is None else frame_index - self._last_index
+        self._last_index = frame_index
+        if self.motion_threshold is not None:
+            self._last_thumbnail = self._thumbnail(frame)
+        return weight
+
+    @staticmethod
+    def _thumbnail(frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, MOTION_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def _motion(self, frame):
+        return float(np.mean(np.abs(self._thumbnail(frame) - self._last_thumbnail))) / 255.0
@@ -0,0 +1,493 @@
+import os
+import glob
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import contextlib
+import numpy as np
+from face_gallery import FaceGallery, FACENET_COSINE_THRESHOLD, FACENET_EMBEDDING_DIM
+
+# Папка с результатами обработки и папка общей базы лиц (между видео)
+RESULTS_FOLDER = "results_folder"
+IDENTITY_STORE_DIR = os.path.join(RESULTS_FOLDER, "identities")
+# Файл базы SQLite с эмбеддингами и метаданными лиц и файл с описанием текущей версии индекса
+IDENTITY_DB_NAME = "identities.db"
+INDEX_MANIFEST_NAME = "index.json"
+# Префикс папок версий индекса IVF
+INDEX_DIR_PREFIX = "ivf_"
+# Файл межпроцессной блокировки перестроения индекса и максимальное время ожидания блокировки (с)
+INDEX_LOCK_NAME = "index.lock"
+INDEX_LOCK_TIMEOUT = 600
+# Число лиц, начиная с которого строится индекс IVF (меньшая база просматривается полностью)
+IVF_MIN_SIZE = 4096
+# Число кластеров IVF на корень из числа лиц
+IVF_LISTS_PER_SQRT = 4
+# Число просматриваемых кластеров при поиске
+DEFAULT_NPROBE = 16
+# Кластеры обучаются заново, когда число лиц выросло во столько раз с последнего обучения;
+# до этого новые лица только распределяются по существующим кластерам
+RETRAIN_GROWTH = 4
+# Число итераций k-means и максимальный размер обучающей выборки
+KMEANS_ITERATIONS = 10
+KMEANS_MAX_SAMPLES = 65536
+# Размер блока векторов при распределении по кластерам
+ASSIGN_CHUNK_SIZE = 16384
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS identities (
+    id INTEGER PRIMARY KEY,
+    identity TEXT NOT NULL UNIQUE,
+    source TEXT,
+    created_at REAL NOT NULL,
+    embedding BLOB NOT NULL
+)
+"""
+
+
+def _assign(vectors, centroids):
+    """
+    Возвращает номер ближайшего (по косинусу) кластера для каждого нормированного вектора.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        block = np.asarray(vectors[start:start + ASSIGN_CHUNK_SIZE])
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Обучает кластеры IVF сферическим k-means (по косинусному сходству) на выборке векторов.
+
+    Параметры:
+      vectors (numpy.ndarray): Нормированные эмбеддинги.
+      nlist (int): Число кластеров.
+      iterations (int): Число итераций.
+      seed (int): Начальное значение генератора случайных чисел.
+
+    Возвращает:
+      numpy.ndarray: Нормированные центры кластеров формы (nlist, dim).
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_MAX_SAMPLES:
+        vectors = vectors[np.sort(rng.choice(len(vectors), KMEANS_MAX_SAMPLES, replace=False))]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=nlist)
+        # Пустой кластер получает случайный вектор выборки
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+def get_nlist(count):
+    """
+    Возвращает число кластеров IVF для базы из count лиц.
+    """
+    return max(1, min(count, int(IVF_LISTS_PER_SQRT * np.sqrt(count))))
+
+
+class IdentityStore:
+    """
+    Общая база лиц между видео: эмбеддинги и метаданные (идентификатор, видео-источник, время добавления)
+    хранятся в SQLite, поиск выполняется по индексу IVF (кластеры k-means и списки векторов по кластерам).
+    Файлы индекса открываются через отображение в память, поэтому база открывается сразу при любом размере.
+    Новые лица добавляются инкрементально: они сразу доступны для поиска из небольшой галереи в памяти,
+    а в индекс переносятся методом update_index (после обработки видео).
+    Интерфейс поиска совпадает с FaceGallery, поэтому база передаётся в обработку вместо галереи.
+    """
+    def __init__(self, store_dir=IDENTITY_STORE_DIR, dim=FACENET_EMBEDDING_DIM, threshold=FACENET_COSINE_THRESHOLD,
+                 nprobe=DEFAULT_NPROBE, source=None):
+        """
+        Открывает базу (создаёт её при отсутствии).
+
+        Параметры:
+          store_dir (str): Папка базы.
+          dim (int): Размерность эмбеддинга.
+          threshold (float): Максимальное косинусное расстояние, при котором лица считаются совпадающими.
+          nprobe (int): Число просматриваемых кластеров при поиске (больше — точнее, но медленнее).
+          source (str): Видео, лица которого добавляются в базу (сохраняется в метаданных).
+        """
+        self.store_dir = store_dir
+        self.dim = dim
+        self.threshold = threshold
+        self.nprobe = nprobe
+        self.source = source
+        os.makedirs(store_dir, exist_ok=True)
+        # Соединение используется из потока инференса, поэтому обращения к нему защищены блокировкой
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(store_dir, IDENTITY_DB_NAME), timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+        self._identity_cache = {}
+        self._load_index()
+        self._load_delta()
+
+    def __getstate__(self):
+        # В контрольную точку попадают только настройки: лица уже сохранены в базе
+        return {'store_dir': self.store_dir, 'dim': self.dim, 'threshold': self.threshold,
+                'nprobe': self.nprobe, 'source': self.source}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return self._index_count + len(self._delta)
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.store_dir, INDEX_MANIFEST_NAME)
+
+    def _load_index(self):
+        """
+        Открывает текущую версию индекса IVF через отображение файлов в память.
+        """
+        self._index = None
+        self._index_count = 0
+        self._manifest = {'max_id': 0, 'trained_size': 0}
+        if not os.path.exists(self._manifest_path):
+            return
+        with open(self._manifest_path, encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+        index_dir = os.path.join(self.store_dir, manifest['version'])
+
+        def load(name):
+            return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r')
+
+        self._index = {
+            # Центры и границы списков малы и нужны на каждый запрос, поэтому читаются в память
+            'centroids': np.array(load('centroids')),
+            'offsets': np.array(load('offsets')),
+            'vectors': load('vectors'),
+            'ids': load('ids'),
+        }
+        self._index_count = manifest['count']
+        self._manifest = manifest
+
+    def _load_delta(self):
+        """
+        Загружает в галерею в памяти лица, добавленные после построения индекса.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT identity, embedding FROM identities WHERE id > ? ORDER BY id", (self._manifest['max_id'],)
+            ).fetchall()
+        self._delta = FaceGallery(dim=self.dim, threshold=self.threshold, initial_capacity=max(64, len(rows)))
+        for identity, embedding in rows:
+            self._delta.add(identity, np.frombuffer(embedding, dtype=np.float32))
+
+    def _normalize(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _get_identity(self, row_id):
+        identity = self._identity_cache.get(row_id)
+        if identity is None:
+            with self._lock:
+                identity = self._conn.execute("SELECT identity FROM identities WHERE id = ?", (row_id,)).fetchone()[0]
+            self._identity_cache[row_id] = identity
+        return identity
+
+    def _search_index(self, query):
+        """
+        Ищет ближайшее лицо индекса в nprobe ближайших кластерах.
+
+        Возвращает:
+          tuple: (номер строки базы, косинусное расстояние) или (None, None).
+        """
+        index = self._index
+        centroid_scores = index['centroids'] @ query
+        nprobe = min(self.nprobe, len(centroid_scores))
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        offsets = index['offsets']
+        best_score = -np.inf
+        best_position = None
+        for cluster in probes:
+            start, end = offsets[cluster], offsets[cluster + 1]
+            if start == end:
+                continue
+            scores = index['vectors'][start:end] @ query
+            position = int(np.argmax(scores))
+            if scores[position] > best_score:
+                best_score = scores[position]
+                best_position = start + position
+        if best_position is None:
+            return None, None
+        return int(index['ids'][best_position]), 1.0 - float(best_score)
+
+    def search(self, embedding):
+        """
+        Находит ближайшее лицо базы по косинусному расстоянию (приближённо для лиц в индексе IVF).
+
+        Параметры:
+          embedding (numpy.ndarray): Эмбеддинг искомого лица.
+
+        Возвращает:
+          tuple: (идентификатор, расстояние) или (None, None), если база пуста.
+        """
+        query = self._normalize(embedding)
+        identity, distance = self._delta.search(query)
+        if self._index is not None:
+            row_id, index_distance = self._search_index(query)
+            if row_id is not None and (distance is None or index_distance < distance):
+                identity, distance = self._get_identity(row_id), index_distance
+        return identity, distance
+
+    def match(self, embedding):
+        """
+        Возвращает идентификатор ближайшего лица, если расстояние не превышает порог.
+
+        Параметры:
+          embedding (numpy.ndarray): Эмбеддинг искомого лица.
+
+        Возвращает:
+          str или None: Идентификатор найденного лица или None, если совпадений нет.
+        """
+        identity, distance = self.search(embedding)
+        if identity is None or distance > self.threshold:
+            return None
+        return identity
+
+    def add(self, identity, embedding):
+        """
+        Добавляет лицо в базу; лицо сразу доступно для поиска.
+
+        Параметры:
+          identity (str): Идентификатор лица (путь к сохранённому изображению).
+          embedding (numpy.ndarray): Эмбеддинг лица.
+        """
+        self.add_many([identity], [embedding])
+
+    def add_many(self, identities, embeddings):
+        """
+        Добавляет несколько лиц одной транзакцией (например, при импорте). Уже известные идентификаторы пропускаются.
+
+        Параметры:
+          identities (list): Идентификаторы лиц.
+          embeddings (list): Эмбеддинги лиц.
+        """
+        vectors = [self._normalize(embedding) for embedding in embeddings]
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO identities (identity, source, created_at, embedding) VALUES (?, ?, ?, ?)",
+                [(identity, self.source, now, vector.tobytes()) for identity, vector in zip(identities, vectors)]
+            )
+        for identity, vector in zip(identities, vectors):
+            self._delta.add(identity, vector)
+
+    @contextlib.contextmanager
+    def _index_lock(self):
+        """
+        Межпроцессная блокировка перестроения индекса: транзакция BEGIN IMMEDIATE в отдельном файле SQLite.
+        База лиц при этом не блокируется, поэтому другие процессы продолжают добавлять в неё лица.
+        """
+        conn = sqlite3.connect(os.path.join(self.store_dir, INDEX_LOCK_NAME), timeout=INDEX_LOCK_TIMEOUT,
+                               isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield
+        finally:
+            # Закрытие соединения откатывает транзакцию и снимает блокировку
+            conn.close()
+
+    def get_max_id(self):
+        """
+        Возвращает номер последней добавленной строки базы (0 для пустой базы).
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM identities").fetchone()[0]
+
+    def rollback(self, max_id):
+        """
+        Удаляет лица этого видео (source), добавленные после строки max_id, например после контрольной точки,
+        с которой продолжается прерванная обработка. Лица, которые уже перенёс в индекс другой процесс, остаются в базе.
+
+        Параметры:
+          max_id (int): Номер последней строки базы на момент контрольной точки (get_max_id).
+
+        Возвращает:
+          int: Число удалённых лиц.
+        """
+        with self._index_lock():
+            # Лица, вошедшие в текущую версию индекса, не удаляются: индекс ссылается на их строки
+            self._load_index()
+            with self._lock, self._conn:
+                deleted = self._conn.execute(
+                    "DELETE FROM identities WHERE source = ? AND id > ?", (self.source, max(max_id, self._manifest['max_id']))
+                ).rowcount
+        self._load_delta()
+        return deleted
+
+    def update_index(self, retrain=False):
+        """
+        Переносит лица, добавленные после построения индекса (в том числе другими процессами), в индекс IVF.
+        Новая версия индекса записывается в отдельную папку и подменяется атомарной записью index.json,
+        поэтому процессы, открывшие предыдущую версию, продолжают работать с ней.
+        Перестроение выполняется под межпроцессной блокировкой, поэтому процессы, одновременно закончившие
+        обработку видео, перестраивают индекс по очереди, каждый — от последней записанной версии.
+
+        Параметры:
+          retrain (bool): Обучить кластеры заново, даже если база выросла незначительно.
+
+        Возвращает:
+          bool: True, если индекс перестроен.
+        """
+        with self._index_lock():
+            # Индекс мог перестроить другой процесс: новые лица отбираются относительно его текущей версии
+            self._load_index()
+            updated = self._rebuild_index(retrain)
+        self._load_delta()
+        return updated
+
+    def _rebuild_index(self, retrain):
+        """
+        Строит и записывает новую версию индекса из текущей версии и новых лиц (вызывается под блокировкой).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embedding FROM identities WHERE id > ? ORDER BY id", (self._manifest['max_id'],)
+            ).fetchall()
+        if not rows and not retrain:
+            return False
+        new_ids = np.array([row_id for row_id, _ in rows], dtype=np.int64)
+        new_vectors = np.frombuffer(b''.join(embedding for _, embedding in rows), dtype=np.float32).reshape(-1, self.dim)
+        if self._index is not None:
+            ids = np.concatenate([self._index['ids'], new_ids])
+            vectors = np.concatenate([self._index['vectors'], new_vectors])
+        else:
+            ids, vectors = new_ids, new_vectors
+        count = len(ids)
+        if count < IVF_MIN_SIZE:
+            # Небольшая база быстрее просматривается полностью
+            return False
+
+        trained_size = self._manifest['trained_size']
+        if self._index is None or retrain or count >= RETRAIN_GROWTH * trained_size:
+            start_time = time.perf_counter()
+            centroids = train_centroids(vectors, get_nlist(count))
+            trained_size = count
+            print(f"Кластеры индекса лиц обучены: {len(centroids)} кластеров за {time.perf_counter() - start_time:.1f} с")
+        else:
+            centroids = self._index['centroids']
+        self._write_index(centroids, vectors, ids, trained_size)
+        self._load_index()
+        print(f"Индекс лиц обновлён: {count} лиц")
+        return True
+
+    def _write_index(self, centroids, vectors, ids, trained_size):
+        """
+        Записывает новую версию индекса: векторы упорядочены по кластерам, границы списков — в offsets.
+        """
+        assignments = _assign(vectors, centroids)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+
+        version = f"{INDEX_DIR_PREFIX}{int(time.time() * 1000)}_{os.getpid()}"
+        index_dir = os.path.join(self.store_dir, version)
+        os.makedirs(index_dir)
+        np.save(os.path.join(index_dir, "centroids.npy"), centroids)
+        np.save(os.path.join(index_dir, "offsets.npy"), offsets)
+        np.save(os.path.join(index_dir, "vectors.npy"), np.ascontiguousarray(vectors[order], dtype=np.float32))
+        np.save(os.path.join(index_dir, "ids.npy"), ids[order])
+        manifest = {'version': version, 'count': int(len(ids)), 'max_id': int(ids.max()),
+                    'trained_size': int(trained_size), 'dim': self.dim}
+        replaced_version = self._manifest.get('version')
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.store_dir, prefix=INDEX_MANIFEST_NAME + ".", suffix=".tmp")
+        with os.fdopen(temp_fd, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_path, self._manifest_path)
+        # Удаляются только версии старше заменённой (и папки прерванных перестроений): заменённую версию
+        # процессы могли прочитать из index.json, но ещё не открыть; открытые через отображение в память
+        # файлы остаются доступны открывшим их процессам
+        for old_dir in glob.glob(os.path.join(self.store_dir, f"{INDEX_DIR_PREFIX}*")):
+            if os.path.basename(old_dir) not in (version, replaced_version):
+                shutil.rmtree(old_dir, ignore_errors=True)
+
+    def close(self):
+        self._conn.close()
+
+
+def benchmark_store(count, queries=1000, nprobe=DEFAULT_NPROBE, noise=0.02, seed=0):
+    """
+    Замеряет поиск по базе из count синтетических лиц: задержку запроса и долю запросов,
+    для которых найдено исходное лицо (запрос — эмбеддинг лица базы с небольшим шумом).
+
+    Возвращает:
+      dict: Время построения индекса, процентили задержки поиска (мс) и полнота.
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((count, FACENET_EMBEDDING_DIM)).astype(np.float32)
+    store_dir = tempfile.mkdtemp(prefix="identity_store_")
+    try:
+        store = IdentityStore(store_dir, nprobe=nprobe)
+        store.add_many([f"face_{index}" for index in range(count)], embeddings)
+        start_time = time.perf_counter()
+        store.update_index()
+        build_time = time.perf_counter() - start_time
+        store.close()
+
+        start_time = time.perf_counter()
+        store = IdentityStore(store_dir, nprobe=nprobe)
+        open_time = time.perf_counter() - start_time
+        targets = rng.choice(count, queries)
+        latencies = []
+        found = 0
+        for target in targets:
+            query = embeddings[target] + noise * rng.standard_normal(FACENET_EMBEDDING_DIM).astype(np.float32) * np.linalg.norm(embeddings[target])
+            start_time = time.perf_counter()
+            identity = store.match(query)
+            latencies.append(time.perf_counter() - start_time)
+            found += identity == f"face_{target}"
+        store.close()
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'count': count,
+        'build_s': build_time,
+        'open_ms': open_time * 1000,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'recall': found / queries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Общая база лиц между видео")
+    parser.add_argument('--store-dir', default=IDENTITY_STORE_DIR, help="Папка базы")
+    parser.add_argument('--rebuild', action='store_true', help="Перестроить индекс с обучением кластеров заново")
+    parser.add_argument('--benchmark', type=int, default=None, metavar='COUNT',
+                        help="Замерить поиск на синтетической базе из COUNT лиц")
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE, help="Число просматриваемых кластеров")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        result = benchmark_store(args.benchmark, nprobe=args.nprobe)
+        print(
+            f"{result['count']} лиц: индекс построен за {result['build_s']:.1f} с, открытие {result['open_ms']:.1f} мс, "
+            f"поиск p50 {result['p50_ms']:.3f} мс, p99 {result['p99_ms']:.3f} мс, полнота {result['recall']:.3f}"
+        )
+        return
+    store = IdentityStore(args.store_dir, nprobe=args.nprobe)
+    if args.rebuild:
+        store.update_index(retrain=True)
+    print(f"Лиц в базе: {len(store)}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import multiprocessing
+import traceback
+from detection_log import DETECTION_LOG_NAME
+from checkpointing import CHECKPOINT_DIR_NAME
+from result_cache import ResultCache
+
+# Папка с результатами обработки и файл очереди заданий
+RESULTS_FOLDER = "results_folder"
+JOBS_DB_PATH = os.path.join(RESULTS_FOLDER, "jobs.db")
+# Папка для загруженных видео, ожидающих обработки
+UPLOADS_FOLDER = os.path.join(RESULTS_FOLDER, "uploads")
+
+# Состояния задания
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Число одновременно обрабатываемых видео по умолчанию
+DEFAULT_MAX_WORKERS = 1
+
+# Минимальный интервал между записями прогресса в базу (с)
+PROGRESS_UPDATE_INTERVAL = 0.5
+# Загрузки без задания старше этого возраста считаются брошенными (с)
+ORPHANED_UPLOAD_AGE = 3600
+# Файл метрик обработки в папке результатов задания
+METRICS_FILE_NAME = "metrics.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,
+    video_path TEXT NOT NULL,
+    result_folder TEXT NOT NULL,
+    params TEXT NOT NULL,
+    progress_current INTEGER NOT NULL DEFAULT 0,
+    progress_total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker_pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+)
+"""
+
+
+def allocate_result_folder(base_results_folder=RESULTS_FOLDER):
+    """
+    Создаёт новую папку результатов с очередным числовым названием.
+    Папка создаётся без exist_ok, поэтому два одновременных задания не получат одну и ту же папку.
+
+    Параметры:
+      base_results_folder (str): Папка со всеми результатами.
+
+    Возвращает:
+      str: Путь к созданной папке.
+    """
+    os.makedirs(base_results_folder, exist_ok=True)
+    existing = [int(d) for d in os.listdir(base_results_folder) if d.isdigit()]
+    next_num = max(existing) + 1 if existing else 1
+    while True:
+        new_folder = os.path.join(base_results_folder, str(next_num))
+        try:
+            os.makedirs(new_folder)
+            return new_folder
+        except FileExistsError:
+            next_num += 1
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class _ClosingConnection:
+    """
+    Контекстный менеджер, закрывающий соединение SQLite при выходе
+    (sqlite3.Connection в with только завершает транзакцию).
+    """
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._conn.close()
+
+
+class JobQueue:
+    """
+    Постоянная очередь заданий обработки видео в SQLite.
+    Состояние и прогресс заданий хранятся вне сессии Streamlit, поэтому переживают перезагрузку страницы;
+    задания выполняют отдельные процессы-обработчики (run_worker).
+    """
+    def __init__(self, db_path=JOBS_DB_PATH):
+        """
+        Инициализация и создание таблицы заданий.
+
+        Параметры:
+          db_path (str): Путь к файлу базы SQLite.
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            # WAL позволяет странице читать прогресс, пока обработчик пишет
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    def _connect(self):
+        # isolation_level=None: транзакции открываются явно (BEGIN IMMEDIATE при захвате задания)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _ClosingConnection(conn)
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def submit(self, video_path, result_folder, params=None):
+        """
+        Ставит задание в очередь.
+
+        Параметры:
+          video_path (str): Путь к исходному видео.
+          result_folder (str): Папка для результатов задания.
+          params (dict): Параметры обработки (face_conf_threshold, align, num_workers и т.д.).
+
+        Возвращает:
+          int: Идентификатор задания.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (status, video_path, result_folder, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                (JOB_QUEUED, video_path, result_folder, json.dumps(params or {}), time.time())
+            )
+            return cursor.lastrowid
+
+    def add_completed(self, video_path, result_folder, params=None):
+        """
+        Добавляет уже выполненное задание с готовыми результатами (например, найденными в кэше результатов).
+
+        Параметры:
+          video_path (str): Путь к исходному видео.
+          result_folder (str): Папка с готовыми результатами.
+          params (dict): Параметры обработки.
+
+        Возвращает:
+          int: Идентификатор задания.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (status, video_path, result_folder, params, created_at, started_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (JOB_DONE, video_path, result_folder, json.dumps(params or {}), now, now, now)
+            )
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        """
+        Возвращает задание в виде словаря или None, если задание не найдено.
+        """
+        with self._connect() as conn:
+            return self._to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list_jobs(self, status=None, limit=50):
+        """
+        Возвращает последние задания (новые первыми), при необходимости только с заданным состоянием.
+        """
+        with self._connect() as conn:
+            if status is None:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)
+                ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def queue_position(self, job_id):
+        """
+        Возвращает число заданий в очереди перед данным (0 — задание следующее).
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND id < ?", (JOB_QUEUED, job_id)
+            ).fetchone()[0]
+
+    def claim_next(self, worker_pid):
+        """
+        Атомарно забирает самое старое задание из очереди.
+
+        Параметры:
+          worker_pid (int): PID процесса-обработчика.
+
+        Возвращает:
+          dict: Задание или None, если очередь пуста.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (JOB_QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker_pid = ?, started_at = ? WHERE id = ?",
+                        (JOB_RUNNING, worker_pid, time.time(), row['id'])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        job['status'] = JOB_RUNNING
+        return job
+
+    def update_progress(self, job_id, current, total):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET progress_current = ?, progress_total = ? WHERE id = ?", (current, total, job_id)
+            )
+
+    def finish(self, job_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress_current = progress_total, finished_at = ? WHERE id = ?",
+                (JOB_DONE, time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (JOB_FAILED, error, time.time(), job_id)
+            )
+
+    def active_video_paths(self):
+        """
+        Возвращает пути к видео заданий, которые ещё не выполнены (в очереди или выполняются).
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT video_path FROM jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        return {row['video_path'] for row in rows}
+
+    def requeue_stale(self):
+        """
+        Возвращает в очередь задания, обработчик которых завершился, не закончив их
+        (например, при перезапуске сервера).
+
+        Возвращает:
+          int: Число возвращённых в очередь заданий.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, worker_pid FROM jobs WHERE status = ?", (JOB_RUNNING,)).fetchall()
+            stale = [row['id'] for row in rows if row['worker_pid'] is None or not _pid_alive(row['worker_pid'])]
+            for job_id in stale:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_pid = NULL, progress_current = 0 WHERE id = ? AND status = ?",
+                    (JOB_QUEUED, job_id, JOB_RUNNING)
+                )
+        return len(stale)
+
+
+def run_job(job, queue):
+    """
+    Выполняет одно задание: обрабатывает видео и сохраняет результаты в папку задания.
+    При обработке в одном процессе сохраняются контрольные точки, поэтому повторный запуск
+    прерванного задания продолжается с последней из них.
+
+    Параметры:
+      job (dict): Задание из очереди.
+      queue (JobQueue): Очередь для записи прогресса.
+    """
+    from video_handler import process_video_one_cell
+    from chunked_processing import process_video_chunked
+    from model_registry import model_registry, configure_inference_engine
+
+    result_folder = job['result_folder']
+    params = dict(job['params'])
+    num_workers = params.pop('num_workers', 1)
+    params.pop('delete_video', None)
+    params.pop('cache_key', None)
+    engine = params.pop('inference_engine', None)
+    quantization = params.pop('quantization', 'int8')
+    if engine is not None:
+        # Задание выполняется движком, указанным в его параметрах (он же входит в ключ кэша).
+        # Модели обработчика уже загружены его движком, поэтому задание с другим движком
+        # завершается ошибкой, а не обрабатывается другим движком; настройка передаётся и процессам фрагментов
+        configure_inference_engine(engine, quantization, model_registry.num_threads)
+    faces_dir = os.path.join(result_folder, "faces")
+    os.makedirs(faces_dir, exist_ok=True)
+
+    last_update = 0.0
+
+    def update_progress(current, total):
+        nonlocal last_update
+        now = time.monotonic()
+        if now - last_update >= PROGRESS_UPDATE_INTERVAL or current >= total:
+            last_update = now
+            queue.update_progress(job['id'], current, total)
+
+    process_kwargs = dict(
+        video_path=job['video_path'],
+        faces_dir=faces_dir,
+        output_video_path=os.path.join(result_folder, "result_video.mp4"),
+        progress_callback=update_progress,
+        csv_output_path=os.path.join(result_folder, "video_results.csv"),
+        detection_log_path=os.path.join(result_folder, DETECTION_LOG_NAME),
+        **params
+    )
+    if num_workers > 1:
+        process_video_chunked(num_workers=num_workers, **process_kwargs)
+    else:
+        # Задание, возвращённое в очередь после сбоя обработчика, продолжается с последней контрольной точки;
+        # метрики этапов сохраняются, чтобы по ним можно было найти узкое место медленного задания
+        process_video_one_cell(
+            checkpoint_dir=os.path.join(result_folder, CHECKPOINT_DIR_NAME),
+            metrics_output_path=os.path.join(result_folder, METRICS_FILE_NAME),
+            **process_kwargs
+        )
+
+
+def run_worker(db_path=JOBS_DB_PATH, poll_interval=1.0, max_jobs=None):
+    """
+    Цикл процесса-обработчика: загружает модели один раз и выполняет задания из очереди по одному.
+
+    Параметры:
+      db_path (str): Путь к базе очереди заданий.
+      poll_interval (float): Интервал опроса пустой очереди (с).
+      max_jobs (int): Завершиться после стольких заданий; None — работать бесконечно.
+    """
+    from video_handler import load_deepface_models
+
+    queue = JobQueue(db_path)
+    result_cache = ResultCache()
+    load_deepface_models()
+    completed = 0
+    while max_jobs is None or completed < max_jobs:
+        job = queue.claim_next(os.getpid())
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        print(f"Задание {job['id']}: обработка {job['video_path']}")
+        try:
+            run_job(job, queue)
+        except Exception:
+            queue.fail(job['id'], traceback.format_exc())
+            print(f"Задание {job['id']} завершилось с ошибкой")
+        else:
+            queue.finish(job['id'])
+            print(f"Задание {job['id']} выполнено")
+            if job['params'].get('cache_key'):
+                result_cache.store(job['params']['cache_key'], job['result_folder'])
+        finally:
+            # Загруженное видео больше не нужно: результаты сохранены в папке задания
+            if job['params'].get('delete_video') and os.path.exists(job['video_path']):
+                os.remove(job['video_path'])
+        completed += 1
+
+
+def remove_orphaned_uploads(queue, uploads_folder=UPLOADS_FOLDER, max_age=ORPHANED_UPLOAD_AGE):
+    """
+    Удаляет загруженные видео, для которых нет невыполненного задания
+    (например, если сервер был остановлен во время загрузки).
+
+    Параметры:
+      queue (JobQueue): Очередь заданий.
+      uploads_folder (str): Папка с загруженными видео.
+      max_age (float): Минимальный возраст удаляемого файла (с), чтобы не удалить загрузку,
+                       задание для которой ещё не поставлено в очередь.
+
+    Возвращает:
+      int: Число удалённых файлов.
+    """
+    if not os.path.isdir(uploads_folder):
+        return 0
+    active = {os.path.abspath(path) for path in queue.active_video_paths()}
+    removed = 0
+    for name in os.listdir(uploads_folder):
+        path = os.path.join(uploads_folder, name)
+        if os.path.abspath(path) in active or time.time() - os.path.getmtime(path) < max_age:
+            continue
+        os.remove(path)
+        removed += 1
+    return removed
+
+
+class WorkerPool:
+    """
+    Набор процессов-обработчиков очереди; число процессов ограничивает число одновременно
+    обрабатываемых видео.
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, db_path=JOBS_DB_PATH):
+        """
+        Инициализация.
+
+        Параметры:
+          max_workers (int): Максимальное число одновременно выполняемых заданий.
+          db_path (str): Путь к базе очереди заданий.
+        """
+        self.max_workers = max_workers
+        self.db_path = db_path
+        self._processes = []
+
+    def ensure_running(self):
+        """
+        Запускает недостающие процессы-обработчики (например, после падения процесса)
+        и возвращает в очередь задания завершившихся процессов.
+        """
+        self._processes = [process for process in self._processes if process.is_alive()]
+        if len(self._processes) >= self.max_workers:
+            return
+        queue = JobQueue(self.db_path)
+        queue.requeue_stale()
+        remove_orphaned_uploads(queue)
+        # spawn: TensorFlow в родительском процессе может быть уже инициализирован;
+        # процессы не daemon, чтобы обработчик мог запускать процессы для обработки фрагментами
+        context = multiprocessing.get_context('spawn')
+        while len(self._processes) < self.max_workers:
+            process = context.Process(target=run_worker, args=(self.db_path,), name="video-job-worker")
+            process.start()
+            self._processes.append(process)
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+
+
+def main():
+    from model_registry import INFERENCE_ENGINES, configure_inference_engine
+    from tflite_engine import QUANTIZATIONS, DEFAULT_QUANTIZATION
+
+    parser = argparse.ArgumentParser(description="Обработчики очереди заданий обработки видео")
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help="Число одновременно выполняемых заданий")
+    parser.add_argument('--db-path', default=JOBS_DB_PATH, help="Путь к базе очереди заданий")
+    parser.add_argument('--engine', choices=INFERENCE_ENGINES, default='keras',
+                        help="Движок инференса моделей атрибутов и эмбеддингов (tflite — квантованные модели для CPU)")
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=DEFAULT_QUANTIZATION, help="Квантование весов для TFLite")
+    parser.add_argument('--engine-threads', type=int, default=None, help="Число потоков интерпретатора TFLite")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DEEPFACE_HOME', 'models')
+    # Настройки движка передаются процессам-обработчикам через переменные окружения
+    configure_inference_engine(args.engine, args.quantization, args.engine_threads)
+    pool = WorkerPool(args.workers, args.db_path)
+    try:
+        while True:
+            pool.ensure_running()
+            time.sleep(5)
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == '__main__':
+    main()
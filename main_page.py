@@ -3,6 +3,7 @@ from pathlib import Path
 import streamlit as st
 import results_display
 from video_handler import load_deepface_models # Импорт функции для загрузки моделей DeepFace
+from model_registry import format_model_report
 
 
 # ===================== Настройка моделей DeepFace и TensorFlow =====================
@@ -36,9 +37,18 @@ st.set_page_config(
 st.title("Приложение распознавания эмоций, пола, возраста")
 
 # ===================== Предварительная загрузка моделей DeepFace =====================
-with st.spinner("Загрузка моделей DeepFace..."):
-    load_deepface_models()
+@st.cache_resource(show_spinner="Загрузка моделей DeepFace...")
+def load_models():
+    """
+    Загружает модели один раз на процесс сервера: повторные запуски страницы и новые сессии
+    используют уже загруженные модели.
+    """
+    return load_deepface_models()
+
+model_report = load_models()
 st.success("Модели DeepFace успешно загружены.")
+with st.expander("Время загрузки и память моделей"):
+    st.text(format_model_report(model_report))
 
 # ===================== Определение путей к файлам в папке media =====================
 # Путь к обработанному видео
@@ -51,12 +61,10 @@ video_width = 280
 video_side = 100
 
 if os.path.exists(MAIN_VIDEO_PATH):
-    with open(MAIN_VIDEO_PATH, 'rb') as file:
-        video_bytes = file.read()
     st.subheader("Пример обработанного видео")
     # Центрирование видео с помощью колонок
     _, container, _ = st.columns([video_side, video_width, video_side])
-    container.video(data=video_bytes)
+    container.video(MAIN_VIDEO_PATH)
 else:
     st.info("Обработанное видео не найдено в папке media.")
 
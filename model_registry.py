@@ -0,0 +1,221 @@
+import os
+import time
+import resource
+import numpy as np
+from deepface.modules import modeling
+
+# Детектор лиц, используемый при обработке видео по умолчанию
+DETECTOR_BACKEND = 'centerface'
+# Детекторы лиц DeepFace, которые можно выбрать для обработки
+# (opencv — каскады Хаара, yunet — детектор OpenCV YuNet; dlib, mediapipe и yolov8
+# требуют установки соответствующих пакетов)
+DETECTOR_BACKENDS = ('opencv', 'yunet', 'ssd', 'centerface', 'mtcnn', 'fastmtcnn', 'retinaface', 'mediapipe', 'yolov8', 'dlib')
+# Модель эмбеддингов для сопоставления лиц
+RECOGNITION_MODEL = 'Facenet'
+# Модели атрибутов лица DeepFace
+ATTRIBUTE_MODEL_NAMES = ('Age', 'Gender', 'Race', 'Emotion')
+# Размер синтетического изображения для прогрева детектора
+WARMUP_IMAGE_SIZE = (64, 64)
+# Движки инференса моделей атрибутов и эмбеддингов: keras — модели DeepFace в TensorFlow,
+# tflite — модели TFLite с квантованными весами (см. tflite_engine)
+INFERENCE_ENGINES = ('keras', 'tflite')
+# Переменные окружения с настройками движка: их наследуют процессы-обработчики
+INFERENCE_ENGINE_ENV = 'FACE_INFERENCE_ENGINE'
+TFLITE_QUANTIZATION_ENV = 'FACE_TFLITE_QUANTIZATION'
+TFLITE_THREADS_ENV = 'FACE_TFLITE_THREADS'
+
+
+def get_engine_name(engine, quantization='int8'):
+    """
+    Возвращает название движка с квантованием (например, 'keras' или 'tflite/int8');
+    квантование учитывается только для TFLite.
+    """
+    return engine if engine == 'keras' else f"{engine}/{quantization}"
+
+
+def get_memory_mb():
+    """
+    Возвращает объём памяти процесса в МБ: текущий RSS из /proc (Linux)
+    или пиковый RSS из getrusage на остальных системах.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return get_peak_memory_mb()
+
+
+def get_peak_memory_mb():
+    """
+    Возвращает пиковый объём памяти процесса (RSS) в МБ.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    return max_rss / 2 ** 20 if max_rss > 2 ** 30 else max_rss / 2 ** 10
+
+
+def _warmup(task, client):
+    """
+    Выполняет один прямой проход модели на крошечном синтетическом входе, чтобы построить граф
+    вычислений до обработки первого кадра. Каталоги при этом не сканируются.
+    """
+    if task == 'face_detector':
+        client.detect_faces(np.zeros((*WARMUP_IMAGE_SIZE, 3), dtype=np.uint8))
+    elif task == 'facial_recognition':
+        client.model(np.zeros((1, *client.input_shape, 3), dtype=np.float32), training=False)
+    else:
+        client.model(np.zeros((1, *client.model.input_shape[1:]), dtype=np.float32), training=False)
+
+
+class ModelRegistry:
+    """
+    Реестр моделей DeepFace на весь процесс: каждая модель загружается и прогревается один раз,
+    для каждой запоминаются время загрузки и прирост памяти процесса.
+    """
+    def __init__(self):
+        self._models = {}
+        self.report = {}
+        self.engine = os.environ.get(INFERENCE_ENGINE_ENV, 'keras')
+        self.quantization = os.environ.get(TFLITE_QUANTIZATION_ENV, 'int8')
+        self.num_threads = int(os.environ.get(TFLITE_THREADS_ENV, 0)) or None
+
+    def set_engine(self, engine, quantization='int8', num_threads=None):
+        """
+        Выбирает движок инференса моделей атрибутов и эмбеддингов. Движок выбирается до загрузки этих моделей.
+
+        Параметры:
+          engine (str): 'keras' или 'tflite'.
+          quantization (str): Квантование весов для TFLite ('int8' или 'float16').
+          num_threads (int): Число потоков интерпретатора TFLite; None — по умолчанию TFLite.
+        """
+        from tflite_engine import QUANTIZATIONS, TFLITE_TASKS
+
+        if engine not in INFERENCE_ENGINES:
+            raise ValueError(f"Неизвестный движок инференса: {engine}. Доступные движки: {', '.join(INFERENCE_ENGINES)}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Неизвестное квантование: {quantization}. Доступные варианты: {', '.join(QUANTIZATIONS)}")
+        changed = (engine, quantization, num_threads) != (self.engine, self.quantization, self.num_threads)
+        if changed and any(task in TFLITE_TASKS for task, _ in self._models):
+            raise ValueError("Движок инференса нельзя сменить после загрузки моделей атрибутов и эмбеддингов")
+        self.engine = engine
+        self.quantization = quantization
+        self.num_threads = num_threads
+
+    @property
+    def engine_name(self):
+        """
+        Название движка с квантованием (например, 'keras' или 'tflite/int8').
+        """
+        return get_engine_name(self.engine, self.quantization)
+
+    def get(self, task, model_name):
+        """
+        Возвращает клиент модели DeepFace, загружая и прогревая его при первом обращении.
+
+        Параметры:
+          task (str): Задача DeepFace ('face_detector', 'facial_recognition', 'facial_attribute').
+          model_name (str): Название модели.
+
+        Возвращает:
+          object: Клиент модели DeepFace (у моделей Keras модель доступна в атрибуте model).
+        """
+        key = (task, model_name)
+        client = self._models.get(key)
+        if client is not None:
+            return client
+
+        memory_before = get_memory_mb()
+        start_time = time.perf_counter()
+        client = modeling.build_model(task=task, model_name=model_name)
+        engine = 'keras'
+        if self.engine == 'tflite' and task != 'face_detector':
+            from tflite_engine import install_tflite_model
+
+            install_tflite_model(client, task, model_name, self.quantization, self.num_threads)
+            engine = self.engine_name
+        load_time = time.perf_counter() - start_time
+        _warmup(task, client)
+        self.report[key] = {
+            'load_time_s': load_time,
+            'warmup_time_s': time.perf_counter() - start_time - load_time,
+            'memory_mb': get_memory_mb() - memory_before,
+            'engine': engine,
+        }
+        self._models[key] = client
+        return client
+
+    def load_all(self, detector_backend=DETECTOR_BACKEND, attribute_models=ATTRIBUTE_MODEL_NAMES,
+                 recognition_model=RECOGNITION_MODEL):
+        """
+        Загружает и прогревает детектор, модели атрибутов и модель эмбеддингов.
+
+        Параметры:
+          detector_backend (str): Детектор лиц DeepFace.
+          attribute_models (tuple): Названия моделей атрибутов.
+          recognition_model (str): Модель эмбеддингов лиц.
+
+        Возвращает:
+          dict: Отчёт {(задача, модель): {'load_time_s', 'warmup_time_s', 'memory_mb', 'engine'}}.
+        """
+        self.get('face_detector', detector_backend)
+        for model_name in attribute_models:
+            self.get('facial_attribute', model_name)
+        self.get('facial_recognition', recognition_model)
+        return dict(self.report)
+
+
+def configure_inference_engine(engine, quantization='int8', num_threads=None):
+    """
+    Выбирает движок инференса для текущего процесса и для процессов-обработчиков,
+    запускаемых после вызова (настройки передаются через переменные окружения).
+
+    Параметры:
+      engine (str): 'keras' или 'tflite'.
+      quantization (str): Квантование весов для TFLite ('int8' или 'float16').
+      num_threads (int): Число потоков интерпретатора TFLite; None — по умолчанию TFLite.
+    """
+    model_registry.set_engine(engine, quantization, num_threads)
+    os.environ[INFERENCE_ENGINE_ENV] = engine
+    os.environ[TFLITE_QUANTIZATION_ENV] = quantization
+    os.environ[TFLITE_THREADS_ENV] = str(num_threads or 0)
+
+
+def check_detector_backend(detector_backend):
+    """
+    Проверяет, что детектор лиц поддерживается.
+
+    Параметры:
+      detector_backend (str): Детектор лиц DeepFace.
+
+    Возвращает:
+      str: Тот же детектор.
+    """
+    if detector_backend not in DETECTOR_BACKENDS:
+        raise ValueError(
+            f"Неизвестный детектор лиц: {detector_backend}. Доступные детекторы: {', '.join(DETECTOR_BACKENDS)}"
+        )
+    return detector_backend
+
+
+def format_model_report(report):
+    """
+    Формирует текстовый отчёт о загрузке моделей.
+
+    Параметры:
+      report (dict): Отчёт ModelRegistry.load_all.
+
+    Возвращает:
+      str: Строка на каждую модель со временем загрузки, прогрева и приростом памяти.
+    """
+    lines = []
+    for (task, model_name), model_stats in report.items():
+        engine = f" [{model_stats['engine']}]" if model_stats.get('engine', 'keras') != 'keras' else ""
+        lines.append(
+            f"{task}/{model_name}{engine}: загрузка {model_stats['load_time_s']:.2f} с, "
+            f"прогрев {model_stats['warmup_time_s']:.2f} с, память +{model_stats['memory_mb']:.0f} МБ"
+        )
+    return "\n".join(lines)
+
+
+# Общий реестр процесса
+model_registry = ModelRegistry()
@@ -5,11 +5,18 @@
 # ---
 
 import os
+import time
 import tempfile
 import streamlit as st
-from video_handler import process_video_one_cell, convert_video
+from model_registry import DETECTOR_BACKEND, DETECTOR_BACKENDS, model_registry
+from result_cache import ResultCache, hash_file, make_cache_key, is_cacheable
+from identity_store import IDENTITY_STORE_DIR
+from job_queue import JobQueue, WorkerPool, allocate_result_folder, UPLOADS_FOLDER, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
 import results_display
 
+# Размер блока копирования загруженного видео на диск
+UPLOAD_CHUNK_SIZE = 8 * 2 ** 20
+
 # ===================== Настройка страницы обработки видео =====================
 st.set_page_config(page_title="Обработка видео", layout="wide")
 st.title("Обработка видео")
@@ -22,111 +29,168 @@ face_conf_threshold = st.sidebar.slider(
     value=0.7,
     step=0.01,
 )
+min_face_size = st.sidebar.number_input(
+    label='Минимальный размер лица (пикселей)',
+    min_value=0,
+    value=0,
+    step=4,
+)
+auto_detection_scale = st.sidebar.checkbox(
+    label='Ускорить детекцию на уменьшенном кадре (по минимальному размеру лица)',
+    value=False,
+)
+detector_backend = st.sidebar.selectbox(
+    label='Детектор лиц',
+    options=DETECTOR_BACKENDS,
+    index=DETECTOR_BACKENDS.index(DETECTOR_BACKEND),
+)
+use_identity_store = st.sidebar.checkbox(
+    label='Общая база лиц между видео (одни и те же люди в разных видео)',
+    value=False,
+)
 align = False
+num_workers = st.sidebar.number_input(
+    label='Число процессов обработки (для длинных видео)',
+    min_value=1,
+    max_value=os.cpu_count() or 1,
+    value=1,
+    step=1,
+)
 # align = st.sidebar.checkbox(label='Align', value=False)
 
-# Инициализация состояния, если оно ещё не установлено
-if 'processing_done' not in st.session_state:
-    st.session_state.processing_done = False
-
-# ===================== Загрузка видео пользователем и обработка =====================
-if not st.session_state.processing_done:
+# ===================== Очередь заданий обработки =====================
+@st.cache_resource
+def get_worker_pool():
+    """
+    Процессы-обработчики запускаются один раз на процесс сервера и обрабатывают задания всех сессий;
+    их число ограничивает число одновременно обрабатываемых видео.
+    """
+    return WorkerPool()
+
+job_queue = JobQueue()
+get_worker_pool().ensure_running()
+
+def parse_job_id(value):
+    """
+    Разбирает номер задания из параметра адреса; некорректное значение считается отсутствием задания.
+    """
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+# Задание восстанавливается из параметров адреса, поэтому переживает перезагрузку вкладки
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = parse_job_id(st.query_params.get('job'))
+job = job_queue.get(st.session_state.job_id) if st.session_state.job_id is not None else None
+if job is None and (st.session_state.job_id is not None or 'job' in st.query_params):
+    # Неизвестное или некорректное задание в адресе: страница открывается для загрузки нового видео
+    st.session_state.job_id = None
+    st.query_params.clear()
+
+# ===================== Загрузка видео пользователем и постановка в очередь =====================
+if job is None:
     st.subheader("Загрузка видео")
     st_video = st.file_uploader(label='Выберите видео для обработки', type=["mp4", "avi", "mov"])
-    
-    # Задаём размеры для центровки видео (аналогично main_page.py)
-    video_width = 120
-    video_side = 280
 
     if st_video:
         if st.button('Начать обработку видео'):
-            with st.spinner("Обработка видео..."):
-                # Сохраняем загруженное видео во временный файл
-                temp_file = tempfile.NamedTemporaryFile(delete=False)
-                temp_file.write(st_video.read())
-                video_file = temp_file.name
-
-                # ===================== Определение новой папки в results_folder =====================
-                base_results_folder = "results_folder"
-                os.makedirs(base_results_folder, exist_ok=True)
-                # Получаем список существующих папок с числовыми названиями
-                existing = [int(d) for d in os.listdir(base_results_folder) if d.isdigit()]
-                next_num = max(existing) + 1 if existing else 1
-                new_folder = os.path.join(base_results_folder, str(next_num))
-                os.makedirs(new_folder, exist_ok=True)
-
-                # Задаём пути для сохранения: обработанного видео, сконвертированного видео, CSV и изображений лиц
-                output_video_path = os.path.join(new_folder, "result_video.mp4")
-                convert_video_path = os.path.join(new_folder, "result_video_convert.mp4")
-                csv_output_path = os.path.join(new_folder, "video_results.csv")
-                faces_dir = os.path.join(new_folder, "faces")
-                os.makedirs(faces_dir, exist_ok=True)
-
-                # ===================== Создание прогресс-бара для отображения хода обработки =====================
-                progress_bar = st.progress(0)
-                progress_text = st.empty()
-
-                def update_progress(current, total):
-                    """
-                    Функция обновления прогресса обработки видео.
-                    
-                    Параметры:
-                      current (int): текущий номер обработанного кадра.
-                      total (int): общее количество кадров.
-                    """
-                    progress = current / total
-                    progress_bar.progress(progress)
-                    progress_text.text(f"Обработка кадра {current} из {total}")
-
-                # Запуск обработки видео с сохранением CSV в новой папке
-                tracked_faces = process_video_one_cell(
-                    video_path=video_file,
-                    faces_dir=faces_dir,
-                    output_video_path=output_video_path,
-                    face_conf_threshold=face_conf_threshold,
-                    align=align,
-                    progress_callback=update_progress,
-                    csv_output_path=csv_output_path
+            # Копируем загруженное видео на диск блоками, не создавая его полную копию в памяти,
+            # и за тот же проход вычисляем хэш содержимого; файл удаляется обработчиком после выполнения задания
+            os.makedirs(UPLOADS_FOLDER, exist_ok=True)
+            st_video.seek(0)
+            with tempfile.NamedTemporaryFile(dir=UPLOADS_FOLDER, suffix=os.path.splitext(st_video.name)[1], delete=False) as temp_file:
+                video_hash = hash_file(st_video, UPLOAD_CHUNK_SIZE, copy_to=temp_file)
+
+            params = {
+                'detector_backend': detector_backend,
+                'face_conf_threshold': face_conf_threshold,
+                'min_face_size': int(min_face_size),
+                'detection_scale': 'auto' if auto_detection_scale else None,
+                'identity_store_dir': IDENTITY_STORE_DIR if use_identity_store else None,
+                'align': align,
+                # Движок обработчиков (задаётся переменными окружения, которые наследуют процессы-обработчики)
+                'inference_engine': model_registry.engine,
+                'quantization': model_registry.quantization,
+                'num_workers': int(num_workers),
+                'delete_video': True,
+            }
+            cache_key = make_cache_key(video_hash, params) if is_cacheable(params) else None
+            # То же видео с теми же параметрами уже обработано: готовые результаты выдаются сразу
+            cached_folder = ResultCache().lookup(cache_key) if cache_key is not None else None
+            if cached_folder is not None:
+                os.remove(temp_file.name)
+                job_id = job_queue.add_completed(video_path=st_video.name, result_folder=cached_folder, params=params)
+            else:
+                # Новая папка в results_folder для результатов задания
+                new_folder = allocate_result_folder()
+                job_id = job_queue.submit(
+                    video_path=temp_file.name,
+                    result_folder=new_folder,
+                    params={**params, 'cache_key': cache_key} if cache_key is not None else params
                 )
-            st.success("Обработка видео завершена!")
-            
-            # ===================== Конвертация видео для отображения в браузере =====================
-            with st.spinner('Идет конвертация видео ...'):
-                convert_video(output_video_path, convert_video_path)
-            
-            with open(convert_video_path, 'rb') as file:
-                video_bytes = file.read()
-            
-            # Сохраняем результаты в session_state
-            st.session_state.video_bytes = video_bytes
-            st.session_state.convert_video_path = convert_video_path
-            st.session_state.csv_output_path = csv_output_path
-            st.session_state.processing_done = True
+            st.session_state.job_id = job_id
+            st.query_params['job'] = str(job_id)
+            st.rerun()
+
+# ===================== Ожидание выполнения задания =====================
+elif job['status'] in (JOB_QUEUED, JOB_RUNNING):
+    st.subheader(f"Задание {job['id']}")
+    if job['status'] == JOB_QUEUED:
+        st.info(f"Видео в очереди, заданий перед ним: {job_queue.queue_position(job['id'])}")
+    else:
+        total = max(job['progress_total'], 1)
+        st.progress(min(job['progress_current'] / total, 1.0))
+        st.text(f"Обработка кадра {job['progress_current']} из {job['progress_total']}")
+    st.caption("Обработка продолжится, даже если закрыть вкладку; задание откроется по этой же ссылке.")
+    # Опрос состояния задания
+    time.sleep(1)
+    st.rerun()
+
+elif job['status'] == JOB_FAILED:
+    st.error(f"Обработка видео завершилась с ошибкой:\n\n{job['error']}")
+    if st.button('Загрузить другое видео'):
+        st.session_state.job_id = None
+        st.query_params.clear()
+        st.rerun()
 
 # ===================== Отображение результатов после обработки =====================
-if st.session_state.processing_done:
+elif job['status'] == JOB_DONE and not os.path.exists(job['result_folder']):
+    st.info("Результаты задания удалены из кэша результатов. Загрузите видео для повторной обработки.")
+    if st.button('Загрузить видео'):
+        st.session_state.job_id = None
+        st.query_params.clear()
+        st.rerun()
+
+elif job['status'] == JOB_DONE:
+    output_video_path = os.path.join(job['result_folder'], "result_video.mp4")
+    csv_output_path = os.path.join(job['result_folder'], "video_results.csv")
+    st.success("Обработка видео завершена!")
+
     video_side = 100
     video_width = 60
 
+    # Видео передаётся по пути к файлу: в состоянии сессии хранятся только пути,
+    # а не содержимое видео
     st.subheader("Результат обработки видео")
     _, container, _ = st.columns([video_side, video_width, video_side])
-    container.video(data=st.session_state.video_bytes)
+    container.video(output_video_path)
 
-    st.download_button(
-        label='Скачать видео',
-        data=st.session_state.video_bytes,
-        file_name=os.path.basename(st.session_state.convert_video_path)
-    )
+    results_display.video_download_button(output_video_path, os.path.basename(output_video_path))
 
     # Добавление возможности скачивания CSV файла
-    with open(st.session_state.csv_output_path, 'rb') as csv_file:
-        csv_bytes = csv_file.read()
-    st.download_button(
-        label='Скачать CSV файл',
-        data=csv_bytes,
-        file_name=os.path.basename(st.session_state.csv_output_path),
-        mime='text/csv'
-    )
+    with open(csv_output_path, 'rb') as csv_file:
+        st.download_button(
+            label='Скачать CSV файл',
+            data=csv_file,
+            file_name=os.path.basename(csv_output_path),
+            mime='text/csv'
+        )
+
+    if st.button('Обработать другое видео'):
+        st.session_state.job_id = None
+        st.query_params.clear()
+        st.rerun()
 
     st.header("Отображение результатов")
-    results_display.display_results(csv_path=st.session_state.csv_output_path)
+    results_display.display_results(csv_path=csv_output_path)
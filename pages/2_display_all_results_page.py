@@ -1,48 +1,53 @@
-import os
 import pandas as pd
 import streamlit as st
 import altair as alt
 import itertools
+from results_store import (ResultsStore, AGE_GROUPS, AGGREGATE_GENDER, AGGREGATE_EMOTION, AGGREGATE_AGE,
+                           AGGREGATE_GENDER_EMOTION, AGGREGATE_AGE_GROUP_EMOTION)
+
+# Максимальное число строк объединённой таблицы на странице
+MAX_TABLE_ROWS = 1000
 
 # ===================== Настройка страницы общего отображения результатов =====================
 st.set_page_config(page_title="Общее отображение результатов", layout="wide")
 st.title("Общее отображение результатов")
 
-# ===================== Поиск CSV файлов в папке results_folder =====================
-base_results_folder = "results_folder"
-csv_files = []
-
-if os.path.exists(base_results_folder):
-    for d in os.listdir(base_results_folder):
-        folder_path = os.path.join(base_results_folder, d)
-        if os.path.isdir(folder_path) and d.isdigit():
-            csv_path = os.path.join(folder_path, "video_results.csv")
-            if os.path.exists(csv_path):
-                csv_files.append(csv_path)
+# ===================== Синхронизация сводного хранилища с папкой results_folder =====================
+# Загружаются только новые и изменённые запуски; графики строятся по заранее вычисленным агрегатам
+store = ResultsStore()
+store.sync()
+runs = store.list_runs()
 
-if not csv_files:
+if runs.empty:
     st.info("CSV файлы не найдены в папке results_folder.")
 else:
     # ===================== Панель выбора CSV файлов =====================
     st.sidebar.header("Выбор CSV файлов для отображения")
-    selected_files = []
+    selected_runs = []
     # Для каждого найденного CSV создаётся галочка для его выбора
-    for csv_file in csv_files:
+    for run, csv_file in zip(runs['run'], runs['csv_path']):
         if st.sidebar.checkbox(f"{csv_file}", value=True):
-            selected_files.append(csv_file)
+            selected_runs.append(int(run))
     
-    if selected_files:
-        # Объединяем выбранные CSV файлы в один DataFrame
-        combined_df = pd.concat([pd.read_csv(f) for f in selected_files], ignore_index=True)
+    if selected_runs:
+        # Объединённая таблица читается из хранилища с ограничением числа строк
+        combined_df = store.load_faces(selected_runs, limit=MAX_TABLE_ROWS)
+        total_faces = int(runs.loc[runs['run'].isin(selected_runs), 'face_count'].sum())
         
         st.subheader("Объединенная таблица результатов")
+        if total_faces > len(combined_df):
+            st.caption(f"Показаны первые {len(combined_df)} строк из {total_faces}")
         st.dataframe(combined_df)
         
         # ===================== Подготовка данных для построения графиков =====================
+        # Агрегаты выбранных запусков суммируются в хранилище
+        aggregates = store.load_aggregates(selected_runs)
+        
+        def get_aggregate(kind):
+            return aggregates[aggregates['kind'] == kind]
+        
         # Преобразуем значения пола для отображения (с англ. на рус.)
         gender_map = {"Man": "Мужчина", "Woman": "Женщина"}
-        if "gender" in combined_df.columns:
-            combined_df['gender'] = combined_df['gender'].map(gender_map).fillna(combined_df['gender'])
         
         # Определяем соответствие эмоций: ключи – значения из CSV, значения – для отображения
         emotion_map = {
@@ -54,16 +59,17 @@ else:
             'surprise': 'удивление'
         }
         emotions = list(emotion_map.keys())
-        for emo in emotions:
-            if emo not in combined_df.columns:
-                combined_df[emo] = 0
         
         # ===================== Построение простых распределений =====================
         st.subheader("Простые распределения")
         col1, col2, col3 = st.columns(3)
         with col1:
             st.markdown("**Распределение по полу**")
-            gender_counts = combined_df['gender'].value_counts().reindex(["Мужчина", "Женщина"]).fillna(0)
+            gender_aggregate = get_aggregate(AGGREGATE_GENDER)
+            gender_counts = pd.Series(
+                gender_aggregate['value'].values,
+                index=gender_aggregate['key'].map(gender_map).fillna(gender_aggregate['key'])
+            ).groupby(level=0).sum().reindex(["Мужчина", "Женщина"]).fillna(0)
             gender_chart = alt.Chart(pd.DataFrame({
                 'Пол': gender_counts.index,
                 'Количество': gender_counts.values
@@ -74,7 +80,8 @@ else:
             st.altair_chart(gender_chart, use_container_width=True)
         with col2:
             st.markdown("**Распределение по эмоциям**")
-            emotion_sums = combined_df[emotions].sum()
+            emotion_aggregate = get_aggregate(AGGREGATE_EMOTION)
+            emotion_sums = pd.Series(emotion_aggregate['value'].values, index=emotion_aggregate['key']).reindex(emotions).fillna(0)
             # Преобразуем названия эмоций согласно emotion_map
             emotion_sums.index = [emotion_map.get(x, x) for x in emotion_sums.index]
             emotion_chart = alt.Chart(pd.DataFrame({
@@ -87,9 +94,10 @@ else:
             st.altair_chart(emotion_chart, use_container_width=True)
         with col3:
             st.markdown("**Распределение по возрасту (по годам)**")
-            df_age = combined_df[(combined_df['age'] >= 1) & (combined_df['age'] <= 99)]
+            age_aggregate = get_aggregate(AGGREGATE_AGE)
             all_years = list(range(1, 100))
-            age_counts = df_age['age'].value_counts().reindex(all_years, fill_value=0).sort_index()
+            age_counts = pd.Series(age_aggregate['value'].values, index=age_aggregate['key'].astype(int))
+            age_counts = age_counts.reindex(all_years, fill_value=0).sort_index().astype(int)
             age_data = pd.DataFrame({
                 'Возраст': age_counts.index,
                 'Количество': age_counts.values
@@ -111,12 +119,10 @@ else:
         with col4:
             st.markdown("**Распределение эмоций по полу**")
             
-            # Копируем данные по столбцу 'gender' и списку эмоций
-            df_gender = combined_df[['gender'] + emotions].copy()
-            # Преобразуем DataFrame из широкого формата в длинный (melt)
-            df_gender = df_gender.melt(id_vars='gender', value_vars=emotions,
-                                    var_name='emotion', value_name='count')
-            # Группируем данные по полу и эмоции для подсчёта суммы
+            # Суммы кадров по полу и эмоции из агрегатов
+            df_gender = get_aggregate(AGGREGATE_GENDER_EMOTION)
+            df_gender = df_gender[df_gender['emotion'].isin(emotions)].rename(columns={'key': 'gender', 'value': 'count'})
+            df_gender['gender'] = df_gender['gender'].map(gender_map).fillna(df_gender['gender'])
             df_gender = df_gender.groupby(['gender', 'emotion'], as_index=False)['count'].sum()
             # Преобразуем названия эмоций согласно сопоставлению (emotion_map)
             df_gender['emotion'] = df_gender['emotion'].map(emotion_map)
@@ -135,23 +141,16 @@ else:
         # График: Распределение эмоций по возрастным группам
         with col5:
             st.markdown("**Распределение эмоций по возрастным группам**")
-            # Создаем возрастные группы для каждого значения возраста
-            combined_df['age_group'] = combined_df['age'].apply(
-                lambda x: 'до 18' if x < 18 else ('18–25' if 18 <= x <= 25 else ('26–40' if 26 <= x <= 40 else ('41–60' if 41 <= x <= 60 else '60+')))
-            )
-            # Копируем данные по столбцу 'age_group' и списку эмоций
-            df_age_group = combined_df[['age_group'] + emotions].copy()
-            # Преобразуем DataFrame в длинный формат
-            df_age_group = df_age_group.melt(id_vars='age_group', value_vars=emotions,
-                                            var_name='emotion', value_name='count')
-            # Группируем данные по возрастной группе и эмоции
-            df_age_group = df_age_group.groupby(['age_group', 'emotion'], as_index=False)['count'].sum()
+            # Суммы кадров по возрастной группе и эмоции из агрегатов
+            df_age_group = get_aggregate(AGGREGATE_AGE_GROUP_EMOTION)
+            df_age_group = df_age_group[df_age_group['emotion'].isin(emotions)].rename(
+                columns={'key': 'age_group', 'value': 'count'}
+            )[['age_group', 'emotion', 'count']]
             # Преобразуем названия эмоций согласно emotion_map
             df_age_group['emotion'] = df_age_group['emotion'].map(emotion_map)
             
             # Чтобы избежать отсутствия комбинаций, создаём все возможные комбинации возрастных групп и эмоций
-            age_groups = ['до 18', '18–25', '26–40', '41–60', '60+']
-            all_combinations = pd.DataFrame(list(itertools.product(age_groups, list(emotion_map.values()))),
+            all_combinations = pd.DataFrame(list(itertools.product(AGE_GROUPS, list(emotion_map.values()))),
                                             columns=['age_group','emotion'])
             df_age_group = all_combinations.merge(df_age_group, on=['age_group','emotion'], how='left').fillna(0)
             
@@ -6,6 +6,7 @@
 
 import os
 import streamlit as st
+import results_display
 
 # ===================== Настройка страницы =====================
 st.set_page_config(page_title="Скачать результаты", layout="wide")
@@ -26,42 +27,37 @@ else:
         st.info("Нет результатов для скачивания.")
     else:
         st.subheader("Найденные результаты:")
-        # Перебор всех найденных папок с результатами
-        for folder in folders:
-            folder_path = os.path.join(results_folder, folder)
-            st.markdown(f"### Результаты {folder}")
-            
-            # Определяем пути к файлам: сконвертированное видео и CSV с результатами
-            converted_video_path = os.path.join(folder_path, "result_video_convert.mp4")
-            csv_file_path = os.path.join(folder_path, "video_results.csv")
-            
-            # Разбиваем область на две колонки: одна для видео, другая для CSV
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.markdown("**Сконвертированное видео:**")
-                if os.path.exists(converted_video_path):
-                    with open(converted_video_path, "rb") as f:
-                        video_data = f.read()
-                    st.download_button(
-                        label="Скачать видео",
-                        data=video_data,
-                        file_name=f"result_video_convert_{folder}.mp4",
-                        mime="video/mp4"
-                    )
-                else:
-                    st.info("Сконвертированное видео не найдено.")
-                    
-            with col2:
-                st.markdown("**CSV с результатами:**")
-                if os.path.exists(csv_file_path):
-                    with open(csv_file_path, "rb") as f:
-                        csv_data = f.read()
+        # Показывается один выбранный результат: файлы остальных результатов не читаются
+        folder = st.selectbox("Результат", folders, index=len(folders) - 1)
+        folder_path = os.path.join(results_folder, folder)
+        st.markdown(f"### Результаты {folder}")
+        
+        # Определяем пути к файлам: обработанное видео и CSV с результатами.
+        # В ранних результатах видео для браузера хранилось отдельно в result_video_convert.mp4
+        video_path = os.path.join(folder_path, "result_video_convert.mp4")
+        if not os.path.exists(video_path):
+            video_path = os.path.join(folder_path, "result_video.mp4")
+        csv_file_path = os.path.join(folder_path, "video_results.csv")
+        
+        # Разбиваем область на две колонки: одна для видео, другая для CSV
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown("**Обработанное видео:**")
+            if os.path.exists(video_path):
+                results_display.video_download_button(video_path, f"result_video_{folder}.mp4")
+            else:
+                st.info("Обработанное видео не найдено.")
+                
+        with col2:
+            st.markdown("**CSV с результатами:**")
+            if os.path.exists(csv_file_path):
+                with open(csv_file_path, "rb") as f:
                     st.download_button(
                         label="Скачать CSV",
-                        data=csv_data,
+                        data=f,
                         file_name=f"video_results_{folder}.csv",
                         mime="text/csv"
                     )
-                else:
-                    st.info("CSV файл не найден.")
+            else:
+                st.info("CSV файл не найден.")
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+# Этапы обработки кадра, время которых замеряется (в порядке вывода)
+TIMED_STAGES = ('decode', 'detection', 'attribute_inference', 'match_face', 'crop_save', 'annotation', 'encode')
+# Процентили в сводке метрик
+METRIC_PERCENTILES = (50, 90, 99)
+# Интервал замера памяти процесса (кадров)
+RSS_SAMPLE_INTERVAL = 100
+# Префикс метрик в формате Prometheus
+PROMETHEUS_PREFIX = "face_video"
+# Профилировщики для разового подробного анализа
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+class ProcessingMetrics:
+    """
+    Сборщик метрик обработки видео: время этапов обработки кадра (timer) и значения на кадр
+    (observe: число лиц на кадре, размер галереи, память процесса).
+    Этапы конвейера работают в разных потоках, поэтому запись защищена блокировкой.
+    """
+    def __init__(self):
+        self._timings = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self.started_at = time.perf_counter()
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Замеряет время блока with и записывает его в этап stage.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start_time)
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self._timings.setdefault(stage, []).append(seconds)
+
+    def observe(self, name, value):
+        """
+        Записывает значение метрики name (например, число лиц на кадре).
+        """
+        with self._lock:
+            self._values.setdefault(name, []).append(value)
+
+    def summary(self):
+        """
+        Формирует агрегаты метрик.
+
+        Возвращает:
+          dict: {'elapsed_s': общее время,
+                 'stages': {этап: {'count', 'total_s', 'mean_ms', 'p50_ms', ..., 'max_ms'}},
+                 'values': {метрика: {'count', 'mean', 'p50', ..., 'max', 'last'}}}.
+        """
+        with self._lock:
+            timings = {stage: np.array(values) for stage, values in self._timings.items()}
+            observed = {name: np.array(values, dtype=np.float64) for name, values in self._values.items()}
+        order = {stage: index for index, stage in enumerate(TIMED_STAGES)}
+        stages = {}
+        for stage in sorted(timings, key=lambda stage: order.get(stage, len(order))):
+            values_ms = timings[stage] * 1000
+            stages[stage] = {
+                'count': int(values_ms.size),
+                'total_s': float(values_ms.sum() / 1000),
+                'mean_ms': float(values_ms.mean()),
+                **{f'p{p}_ms': float(np.percentile(values_ms, p)) for p in METRIC_PERCENTILES},
+                'max_ms': float(values_ms.max()),
+            }
+        values = {}
+        for name, samples in observed.items():
+            values[name] = {
+                'count': int(samples.size),
+                'mean': float(samples.mean()),
+                **{f'p{p}': float(np.percentile(samples, p)) for p in METRIC_PERCENTILES},
+                'max': float(samples.max()),
+                'last': float(samples[-1]),
+            }
+        return {'elapsed_s': time.perf_counter() - self.started_at, 'stages': stages, 'values': values}
+
+
+def get_bottleneck(summary):
+    """
+    Определяет этап с наибольшим суммарным временем (детекция, поиск лиц, кодирование и т.д.).
+
+    Возвращает:
+      tuple: (этап, доля его времени от суммы времени этапов) или (None, 0.0), если замеров нет.
+    """
+    stages = summary['stages']
+    total = sum(stage_stats['total_s'] for stage_stats in stages.values())
+    if not total:
+        return None, 0.0
+    stage = max(stages, key=lambda name: stages[name]['total_s'])
+    return stage, stages[stage]['total_s'] / total
+
+
+def format_metrics(summary):
+    """
+    Формирует текстовую сводку метрик обработки.
+
+    Параметры:
+      summary (dict): Агрегаты ProcessingMetrics.summary().
+
+    Возвращает:
+      str: Строка на каждый этап и метрику и строка с узким местом.
+    """
+    lines = []
+    for stage, stage_stats in summary['stages'].items():
+        percentiles = ", ".join(f"p{p} {stage_stats[f'p{p}_ms']:.1f}" for p in METRIC_PERCENTILES)
+        lines.append(
+            f"{stage}: замеров {stage_stats['count']}, всего {stage_stats['total_s']:.2f} с, "
+            f"среднее {stage_stats['mean_ms']:.1f} мс ({percentiles}, макс. {stage_stats['max_ms']:.1f} мс)"
+        )
+    for name, value_stats in summary['values'].items():
+        lines.append(f"{name}: среднее {value_stats['mean']:.1f}, макс. {value_stats['max']:.1f}, последнее {value_stats['last']:.1f}")
+    stage, share = get_bottleneck(summary)
+    if stage is not None:
+        lines.append(f"Узкое место: {stage} ({share:.0%} времени этапов)")
+    return "\n".join(lines)
+
+
+def _format_prometheus(summary):
+    lines = [
+        f"# HELP {PROMETHEUS_PREFIX}_stage_seconds Время этапа обработки кадра.",
+        f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds summary",
+    ]
+    for stage, stage_stats in summary['stages'].items():
+        for p in METRIC_PERCENTILES:
+            lines.append(
+                f'{PROMETHEUS_PREFIX}_stage_seconds{{stage="{stage}",quantile="{p / 100}"}} {stage_stats[f"p{p}_ms"] / 1000:.6f}'
+            )
+        lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {stage_stats["total_s"]:.6f}')
+        lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {stage_stats["count"]}')
+    for name, value_stats in summary['values'].items():
+        metric = f"{PROMETHEUS_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} summary")
+        for p in METRIC_PERCENTILES:
+            lines.append(f'{metric}{{quantile="{p / 100}"}} {value_stats[f"p{p}"]}')
+        lines.append(f"{metric}_sum {value_stats['mean'] * value_stats['count']}")
+        lines.append(f"{metric}_count {value_stats['count']}")
+    lines.append(f"# TYPE {PROMETHEUS_PREFIX}_elapsed_seconds gauge")
+    lines.append(f"{PROMETHEUS_PREFIX}_elapsed_seconds {summary['elapsed_s']:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def save_metrics(summary, output_path):
+    """
+    Сохраняет агрегаты метрик атомарно: в формате Prometheus (текстовый файл для node_exporter),
+    если расширение файла .prom, иначе в JSON.
+
+    Параметры:
+      summary (dict): Агрегаты ProcessingMetrics.summary().
+      output_path (str): Путь к файлу метрик.
+    """
+    if output_path.endswith('.prom'):
+        content = _format_prometheus(summary)
+    else:
+        content = json.dumps(summary, ensure_ascii=False, indent=2)
+    temp_path = output_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+        metrics_file.write(content)
+    os.replace(temp_path, output_path)
+
+
+@contextmanager
+def profiling(profiler, output_path):
+    """
+    Профилирует блок with для разового подробного анализа.
+    Профилировщики учитывают только текущий поток, поэтому обработку нужно выполнять последовательно.
+
+    Параметры:
+      profiler (str): 'cprofile' (результат — файл pstats) или 'pyinstrument' (результат — HTML);
+                      None — без профилирования.
+      output_path (str): Путь к файлу результата профилирования.
+    """
+    if profiler is None:
+        yield
+        return
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(output_path)
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+    elif profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("Для профилирования pyinstrument установите пакет pyinstrument")
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(output_path, 'w', encoding='utf-8') as profile_file:
+                profile_file.write(profile.output_html())
+    else:
+        raise ValueError(f"Неизвестный профилировщик: {profiler}. Доступные профилировщики: {', '.join(PROFILERS)}")
+    print(f"Результат профилирования сохранён в {output_path}")
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+from contextlib import closing
+from importlib import metadata
+
+# Папка с результатами обработки и файл кэша результатов
+RESULTS_FOLDER = "results_folder"
+RESULT_CACHE_DB_PATH = os.path.join(RESULTS_FOLDER, "result_cache.db")
+# Файлы, без которых результат в кэше считается недействительным
+RESULT_FILES = ("result_video.mp4", "video_results.csv")
+# Размер блока чтения видео при вычислении хэша
+HASH_CHUNK_SIZE = 8 * 2 ** 20
+# Версия ключа кэша: увеличивается при изменениях обработки, меняющих результат
+CACHE_VERSION = 1
+# Параметры задания, не входящие в ключ: не влияют на результат или учитываются отдельно (детектор, движок)
+NON_RESULT_PARAMS = ('num_workers', 'delete_video', 'cache_key', 'detector_backend', 'inference_engine', 'quantization')
+# Параметры, при которых результат не кэшируется: общая база лиц меняется после каждого задания,
+# поэтому идентификаторы лиц из кэша устарели бы, а лица видео не попали бы в базу
+UNCACHEABLE_PARAMS = ('identity_store_dir',)
+
+# Ограничения кэша по умолчанию: число запусков и суммарный размер папок результатов
+DEFAULT_MAX_ENTRIES = 100
+DEFAULT_MAX_SIZE = 20 * 2 ** 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    result_folder TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+def hash_file(file_obj, chunk_size=HASH_CHUNK_SIZE, copy_to=None):
+    """
+    Вычисляет SHA-256 содержимого файла, читая его блоками (файл целиком в память не загружается).
+
+    Параметры:
+      file_obj: Открытый в двоичном режиме файл (или загруженный файл Streamlit).
+      chunk_size (int): Размер блока чтения.
+      copy_to: Необязательный файл, в который содержимое копируется за тот же проход.
+
+    Возвращает:
+      str: Хэш содержимого (hex).
+    """
+    digest = hashlib.sha256()
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        if copy_to is not None:
+            copy_to.write(chunk)
+    return digest.hexdigest()
+
+
+def _get_deepface_version():
+    try:
+        return metadata.version('deepface')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def is_cacheable(params):
+    """
+    Проверяет, можно ли брать результат задания с такими параметрами из кэша и сохранять его в кэш.
+    """
+    return not any(params.get(name) for name in UNCACHEABLE_PARAMS)
+
+
+def make_cache_key(video_hash, params):
+    """
+    Формирует ключ кэша из хэша видео и параметров обработки.
+    В ключ входят детектор, модели распознавания и атрибутов, движок инференса (с квантованием), версия DeepFace
+    и параметры задания, влияющие на результат (порог уверенности, выравнивание и т.д.).
+    Движок берётся из параметров задания (inference_engine, quantization; по умолчанию keras):
+    с ним задание выполняет обработчик (см. job_queue.run_job).
+
+    Параметры:
+      video_hash (str): Хэш содержимого видео (hash_file).
+      params (dict): Параметры задания.
+
+    Возвращает:
+      str: Ключ кэша.
+    """
+    from model_registry import get_engine_name, DETECTOR_BACKEND, RECOGNITION_MODEL, ATTRIBUTE_MODEL_NAMES
+
+    key_params = {
+        'version': CACHE_VERSION,
+        'video': video_hash,
+        'detector_backend': params.get('detector_backend', DETECTOR_BACKEND),
+        'recognition_model': RECOGNITION_MODEL,
+        'attribute_models': list(ATTRIBUTE_MODEL_NAMES),
+        'inference_engine': get_engine_name(params.get('inference_engine', 'keras'), params.get('quantization', 'int8')),
+        'deepface': _get_deepface_version(),
+        'params': {name: value for name, value in params.items() if name not in NON_RESULT_PARAMS},
+    }
+    return hashlib.sha256(json.dumps(key_params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _get_folder_size(folder):
+    size = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+class ResultCache:
+    """
+    Кэш результатов обработки: ключ (make_cache_key) -> папка результатов запуска.
+    Повторная загрузка того же видео с теми же параметрами сразу получает готовые видео и CSV.
+    Старые запуски вытесняются по давности использования (LRU), когда превышено число запусков
+    или суммарный размер их папок; папки вытесненных запусков удаляются.
+    """
+    def __init__(self, db_path=RESULT_CACHE_DB_PATH, max_entries=DEFAULT_MAX_ENTRIES, max_size=DEFAULT_MAX_SIZE):
+        """
+        Инициализация и создание таблицы кэша.
+
+        Параметры:
+          db_path (str): Путь к файлу базы SQLite.
+          max_entries (int): Максимальное число запусков в кэше; None — без ограничения.
+          max_size (int): Максимальный суммарный размер папок результатов (байт); None — без ограничения.
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_size = max_size
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def lookup(self, key):
+        """
+        Ищет результат в кэше и отмечает его использование.
+
+        Параметры:
+          key (str): Ключ кэша.
+
+        Возвращает:
+          str: Папка результатов или None, если результата нет (или его файлы удалены).
+        """
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT result_folder FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            result_folder = row[0]
+            if not all(os.path.exists(os.path.join(result_folder, name)) for name in RESULT_FILES):
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return result_folder
+
+    def store(self, key, result_folder):
+        """
+        Добавляет результат выполненного задания в кэш и вытесняет старые запуски.
+
+        Параметры:
+          key (str): Ключ кэша.
+          result_folder (str): Папка результатов.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, result_folder, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, result_folder, _get_folder_size(result_folder), now, now)
+            )
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Удаляет давно не использованные запуски, пока кэш превышает ограничения.
+
+        Параметры:
+          keep (str): Ключ, который не вытесняется (только что добавленный результат).
+
+        Возвращает:
+          int: Число вытесненных запусков.
+        """
+        with closing(self._connect()) as conn:
+            entries = conn.execute("SELECT key, result_folder, size FROM entries ORDER BY last_used").fetchall()
+            count = len(entries)
+            total_size = sum(size for _, _, size in entries)
+            evicted = []
+            for key, result_folder, size in entries:
+                over_count = self.max_entries is not None and count > self.max_entries
+                over_size = self.max_size is not None and total_size > self.max_size
+                if not (over_count or over_size):
+                    break
+                if key == keep:
+                    continue
+                evicted.append((key, result_folder))
+                count -= 1
+                total_size -= size
+            with conn:
+                conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+        for _, result_folder in evicted:
+            print(f"Результат вытеснен из кэша: {result_folder}")
+            shutil.rmtree(result_folder, ignore_errors=True)
+        return len(evicted)
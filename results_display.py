@@ -3,27 +3,29 @@ import itertools
 import pandas as pd
 import streamlit as st
 import altair as alt
+from results_store import categorize_age, load_results_table
 
-def categorize_age(age):
+def video_download_button(video_path, file_name):
     """
-    Преобразует числовой возраст в возрастную группу.
-    
+    Кнопка скачивания видео, читающая файл только по запросу. st.download_button загружает данные
+    целиком в память процесса сервера при каждом перезапуске страницы, поэтому сначала показывается
+    кнопка подготовки, а кнопка скачивания появляется только после её нажатия и до скачивания.
+
     Параметры:
-      age (int): Числовое значение возраста.
-      
-    Возвращает:
-      str: Возрастная группа.
+      video_path (str): Путь к видеофайлу.
+      file_name (str): Имя файла при скачивании.
     """
-    if age < 18:
-        return 'до 18'
-    elif 18 <= age <= 25:
-        return '18–25'
-    elif 26 <= age <= 40:
-        return '26–40'
-    elif 41 <= age <= 60:
-        return '41–60'
-    else:
-        return '60+'
+    key = f"video_download_{video_path}"
+    if not st.session_state.get(key):
+        if not st.button("Подготовить видео к скачиванию", key=f"{key}_prepare"):
+            return
+        st.session_state[key] = True
+    with open(video_path, 'rb') as video_file:
+        if st.download_button(label='Скачать видео', data=video_file, file_name=file_name,
+                              mime='video/mp4', key=f"{key}_download"):
+            # Скачивание начато: при следующих перезапусках видео снова не читается
+            st.session_state[key] = False
+
 
 def display_results(csv_path="media/video_results.csv"):
     """
@@ -44,12 +46,13 @@ def display_results(csv_path="media/video_results.csv"):
         st.error("CSV с результатами не найден. Сначала выполните обработку видео.")
         return
 
-    # Загружаем данные из CSV
-    df = pd.read_csv(csv_path)
+    # Загружаем результаты (из Arrow IPC через отображение в память, если файл есть, иначе из CSV)
+    df = load_results_table(csv_path)
     
     # Преобразование значений пола для отображения (англ. -> рус.)
     gender_map = {"Man": "Мужчина", "Woman": "Женщина"}
-    df['gender'] = df['gender'].map(gender_map).fillna(df['gender'])
+    gender = df['gender'].astype(object)
+    df['gender'] = gender.map(gender_map).fillna(gender)
     
     # Определение списка эмоций и их русских названий
     emotion_map = {
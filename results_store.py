@@ -0,0 +1,310 @@
+import os
+import sqlite3
+from contextlib import closing
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Папка с результатами обработки и файл сводного хранилища результатов
+RESULTS_FOLDER = "results_folder"
+RESULTS_DB_PATH = os.path.join(RESULTS_FOLDER, "results.db")
+RESULTS_CSV_NAME = "video_results.csv"
+# Расширение файла Arrow IPC, сохраняемого рядом с CSV
+RESULTS_ARROW_EXTENSION = ".arrow"
+
+EMOTIONS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+FACE_COLUMNS = ['age', 'gender', 'race'] + EMOTIONS
+AGE_GROUPS = ['до 18', '18–25', '26–40', '41–60', '60+']
+
+# Виды агрегатов запуска: (вид, ключ, эмоция) -> значение
+AGGREGATE_GENDER = 'gender'                      # число лиц по полу
+AGGREGATE_EMOTION = 'emotion'                    # сумма кадров по эмоциям
+AGGREGATE_AGE = 'age'                            # число лиц по возрасту (в годах)
+AGGREGATE_GENDER_EMOTION = 'gender_emotion'      # сумма кадров по полу и эмоции
+AGGREGATE_AGE_GROUP_EMOTION = 'age_group_emotion'  # сумма кадров по возрастной группе и эмоции
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+        run INTEGER PRIMARY KEY,
+        csv_path TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        face_count INTEGER NOT NULL
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS faces (
+        run INTEGER NOT NULL,
+        age INTEGER,
+        gender TEXT,
+        race TEXT,
+        {', '.join(f'{emotion} INTEGER' for emotion in EMOTIONS)}
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS faces_run ON faces (run)",
+    """
+    CREATE TABLE IF NOT EXISTS aggregates (
+        run INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        emotion TEXT NOT NULL DEFAULT '',
+        value REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS aggregates_run ON aggregates (run)",
+]
+
+
+def categorize_age(age):
+    """
+    Преобразует числовой возраст в возрастную группу.
+    
+    Параметры:
+      age (int): Числовое значение возраста.
+      
+    Возвращает:
+      str: Возрастная группа.
+    """
+    if age < 18:
+        return 'до 18'
+    elif 18 <= age <= 25:
+        return '18–25'
+    elif 26 <= age <= 40:
+        return '26–40'
+    elif 41 <= age <= 60:
+        return '41–60'
+    else:
+        return '60+'
+
+
+def get_arrow_path(csv_path):
+    """
+    Возвращает путь к файлу Arrow IPC, который сохраняется рядом с CSV результатов.
+    """
+    return os.path.splitext(csv_path)[0] + RESULTS_ARROW_EXTENSION
+
+
+def build_results_table(tracked_faces):
+    """
+    Формирует таблицу результатов за один проход по лицам.
+    Пол и раса хранятся как категориальные столбцы, возраст и счётчики эмоций — как целые числа.
+
+    Параметры:
+      tracked_faces (dict): Словарь с объектами FaceMetrics.
+
+    Возвращает:
+      pandas.DataFrame: Столбцы age, gender, race и счётчики эмоций (по одной строке на лицо).
+    """
+    count = len(tracked_faces)
+    ages = np.zeros(count, dtype=np.int32)
+    genders = [None] * count
+    races = [None] * count
+    emotion_counts = {emotion: np.zeros(count, dtype=np.int64) for emotion in EMOTIONS}
+    for index, face_metrics in enumerate(tracked_faces.values()):
+        ages[index] = face_metrics.get_dominant_age()
+        genders[index] = face_metrics.get_dominant_gender()
+        races[index] = face_metrics.get_dominant_race()
+        for emotion, value in face_metrics.count_emotions().items():
+            emotion_counts[emotion][index] = value
+    return pd.DataFrame({
+        'age': ages,
+        'gender': pd.Categorical(genders),
+        'race': pd.Categorical(races),
+        **emotion_counts,
+    })
+
+
+def save_results_table(df, csv_output_path):
+    """
+    Сохраняет таблицу результатов в CSV и рядом — в Arrow IPC без сжатия
+    (файл читается через отображение в память, категориальные столбцы сохраняются как словари).
+
+    Параметры:
+      df (pandas.DataFrame): Таблица результатов.
+      csv_output_path (str): Путь для сохранения CSV.
+    """
+    df.to_csv(csv_output_path, index=False)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    arrow_path = get_arrow_path(csv_output_path)
+    temp_path = arrow_path + ".tmp"
+    with pa.OSFile(temp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(temp_path, arrow_path)
+
+
+def load_results_table(csv_path):
+    """
+    Загружает таблицу результатов: из файла Arrow IPC через отображение в память, если он есть
+    и не старее CSV, иначе из CSV (результаты, сохранённые ранее).
+
+    Параметры:
+      csv_path (str): Путь к CSV с результатами.
+
+    Возвращает:
+      pandas.DataFrame: Таблица результатов.
+    """
+    arrow_path = get_arrow_path(csv_path)
+    if os.path.exists(arrow_path) and os.path.getmtime(arrow_path) >= os.path.getmtime(csv_path):
+        with pa.memory_map(arrow_path) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    return pd.read_csv(csv_path)
+
+
+def compute_run_aggregates(df):
+    """
+    Вычисляет агрегаты одного запуска по таблице лиц.
+
+    Параметры:
+      df (pandas.DataFrame): Таблица лиц из video_results.csv.
+
+    Возвращает:
+      list: Кортежи (вид, ключ, эмоция, значение).
+    """
+    rows = []
+    for gender, count in df['gender'].value_counts().items():
+        if count == 0:
+            continue
+        rows.append((AGGREGATE_GENDER, str(gender), '', int(count)))
+    for emotion in EMOTIONS:
+        rows.append((AGGREGATE_EMOTION, emotion, '', float(df[emotion].sum())))
+    for age, count in df['age'].dropna().astype(int).value_counts().items():
+        rows.append((AGGREGATE_AGE, str(age), '', int(count)))
+
+    long_df = df[['gender'] + EMOTIONS].melt(id_vars='gender', value_vars=EMOTIONS, var_name='emotion', value_name='count')
+    for (gender, emotion), count in long_df.groupby(['gender', 'emotion'], observed=True)['count'].sum().items():
+        rows.append((AGGREGATE_GENDER_EMOTION, str(gender), emotion, float(count)))
+
+    age_groups = df['age'].apply(categorize_age)
+    long_df = df[EMOTIONS].assign(age_group=age_groups).melt(
+        id_vars='age_group', value_vars=EMOTIONS, var_name='emotion', value_name='count'
+    )
+    for (age_group, emotion), count in long_df.groupby(['age_group', 'emotion'], observed=True)['count'].sum().items():
+        rows.append((AGGREGATE_AGE_GROUP_EMOTION, age_group, emotion, float(count)))
+    return rows
+
+
+class ResultsStore:
+    """
+    Сводное хранилище результатов всех запусков в SQLite.
+    Для каждого запуска (папки results_folder/<номер>) хранятся строки лиц и заранее вычисленные агрегаты;
+    при синхронизации заново загружаются только новые и изменённые запуски (по времени изменения и размеру CSV),
+    а объединение запусков сводится к суммированию небольших таблиц агрегатов.
+    """
+    def __init__(self, db_path=RESULTS_DB_PATH):
+        """
+        Инициализация и создание таблиц.
+
+        Параметры:
+          db_path (str): Путь к файлу базы SQLite.
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def sync(self, results_folder=RESULTS_FOLDER):
+        """
+        Приводит хранилище в соответствие с папкой результатов: загружает новые и изменённые запуски
+        и удаляет запуски, папки которых удалены.
+
+        Параметры:
+          results_folder (str): Папка с результатами запусков.
+
+        Возвращает:
+          int: Число загруженных запусков.
+        """
+        found = {}
+        if os.path.exists(results_folder):
+            for d in os.listdir(results_folder):
+                csv_path = os.path.join(results_folder, d, RESULTS_CSV_NAME)
+                if d.isdigit() and os.path.exists(csv_path):
+                    stat = os.stat(csv_path)
+                    found[int(d)] = (csv_path, stat.st_mtime, stat.st_size)
+
+        with closing(self._connect()) as conn:
+            known = {run: (mtime, size) for run, mtime, size in conn.execute("SELECT run, mtime, size FROM runs")}
+            with conn:
+                for run in set(known) - set(found):
+                    self._delete_run(conn, run)
+            ingested = 0
+            for run, (csv_path, mtime, size) in sorted(found.items()):
+                if known.get(run) == (mtime, size):
+                    continue
+                with conn:
+                    self._ingest_run(conn, run, csv_path, mtime, size)
+                ingested += 1
+        return ingested
+
+    @staticmethod
+    def _delete_run(conn, run):
+        for table in ('runs', 'faces', 'aggregates'):
+            conn.execute(f"DELETE FROM {table} WHERE run = ?", (run,))
+
+    def _ingest_run(self, conn, run, csv_path, mtime, size):
+        df = load_results_table(csv_path)
+        for column in FACE_COLUMNS:
+            if column not in df.columns:
+                df[column] = 0 if column in EMOTIONS else None
+        df = df[FACE_COLUMNS]
+
+        self._delete_run(conn, run)
+        conn.execute(
+            "INSERT INTO runs (run, csv_path, mtime, size, face_count) VALUES (?, ?, ?, ?, ?)",
+            (run, csv_path, mtime, size, len(df))
+        )
+        conn.executemany(
+            f"INSERT INTO faces (run, {', '.join(FACE_COLUMNS)}) VALUES ({', '.join('?' * (len(FACE_COLUMNS) + 1))})",
+            [(run, *row) for row in df.astype(object).where(df.notna(), None).itertuples(index=False)]
+        )
+        conn.executemany(
+            "INSERT INTO aggregates (run, kind, key, emotion, value) VALUES (?, ?, ?, ?, ?)",
+            [(run, *row) for row in compute_run_aggregates(df)]
+        )
+
+    def list_runs(self):
+        """
+        Возвращает таблицу запусков (номер, путь к CSV, число лиц), отсортированную по номеру.
+        """
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query("SELECT run, csv_path, face_count FROM runs ORDER BY run", conn)
+
+    def load_aggregates(self, runs):
+        """
+        Суммирует агрегаты выбранных запусков.
+
+        Параметры:
+          runs (list): Номера запусков.
+
+        Возвращает:
+          pandas.DataFrame: Столбцы kind, key, emotion, value.
+        """
+        placeholders = ', '.join('?' * len(runs))
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(
+                f"SELECT kind, key, emotion, SUM(value) AS value FROM aggregates "
+                f"WHERE run IN ({placeholders}) GROUP BY kind, key, emotion",
+                conn, params=list(runs)
+            )
+
+    def load_faces(self, runs, limit=None):
+        """
+        Загружает строки лиц выбранных запусков.
+
+        Параметры:
+          runs (list): Номера запусков.
+          limit (int): Максимальное число строк; None — все строки.
+
+        Возвращает:
+          pandas.DataFrame: Столбцы video_results.csv.
+        """
+        placeholders = ', '.join('?' * len(runs))
+        query = f"SELECT {', '.join(FACE_COLUMNS)} FROM faces WHERE run IN ({placeholders}) ORDER BY run, rowid"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(query, conn, params=list(runs))
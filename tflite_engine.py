@@ -0,0 +1,311 @@
+import os
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+import cv2
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ===================== Настройка моделей DeepFace =====================
+os.environ.setdefault('DEEPFACE_HOME', 'models')
+
+# Варианты квантования весов: int8 — динамическое квантование (веса int8, вычисления float32),
+# float16 — веса в половинной точности
+QUANTIZATIONS = ('int8', 'float16')
+# Квантование по умолчанию
+DEFAULT_QUANTIZATION = 'int8'
+# Задачи DeepFace, модели которых можно выполнять через TFLite (детекторы остаются как есть)
+TFLITE_TASKS = ('facial_attribute', 'facial_recognition')
+# Папка сконвертированных моделей внутри папки DeepFace (рядом с weights)
+TFLITE_DIR_NAME = "tflite"
+# Число входов для проверки совпадения с Keras по умолчанию
+DEFAULT_PARITY_SAMPLES = 64
+# Расширения изображений лиц для проверки совпадения
+FACE_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def get_tflite_path(model_name, quantization=DEFAULT_QUANTIZATION):
+    """
+    Возвращает путь к сконвертированной модели: <DEEPFACE_HOME>/.deepface/tflite/<модель>_<квантование>.tflite.
+    """
+    deepface_home = os.environ.get('DEEPFACE_HOME', os.path.expanduser('~'))
+    return os.path.join(deepface_home, '.deepface', TFLITE_DIR_NAME, f"{model_name}_{quantization}.tflite")
+
+
+def convert_to_tflite(keras_model, output_path, quantization=DEFAULT_QUANTIZATION):
+    """
+    Конвертирует модель Keras в TFLite с квантованием весов и сохраняет её атомарно.
+
+    Параметры:
+      keras_model: Модель Keras (атрибут model клиента DeepFace).
+      output_path (str): Путь к файлу .tflite.
+      quantization (str): 'int8' или 'float16'.
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Неизвестное квантование: {quantization}. Доступные варианты: {', '.join(QUANTIZATIONS)}")
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    content = converter.convert()
+    output_dir = os.path.dirname(output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    # Уникальное имя временного файла: процессы не перезаписывают файлы друг друга
+    temp_fd, temp_path = tempfile.mkstemp(dir=output_dir, prefix=os.path.basename(output_path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(temp_fd, 'wb') as model_file:
+            model_file.write(content)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path):
+    """
+    Межпроцессная блокировка на файле lock_path: ожидает, пока блокировку не отпустит другой процесс.
+    """
+    with open(lock_path, 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    # LK_LOCK повторяет попытки около 10 секунд, затем выбрасывает OSError
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TFLiteModel:
+    """
+    Модель TFLite с тем же вызовом, что у модели Keras в клиентах DeepFace: model(batch, training=False).
+    Размер пакета может меняться от вызова к вызову: тензоры перераспределяются только при его изменении.
+    Интерпретатор не потокобезопасен, поэтому вызовы защищены блокировкой.
+    """
+    def __init__(self, model_path, num_threads=None):
+        """
+        Инициализация интерпретатора.
+
+        Параметры:
+          model_path (str): Путь к файлу .tflite.
+          num_threads (int): Число потоков интерпретатора; None — по умолчанию TFLite.
+        """
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output_index = self._interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    @property
+    def input_shape(self):
+        """
+        Форма входа в формате Keras: (None, высота, ширина, каналы).
+        """
+        return (None, *(int(dim) for dim in self._input['shape_signature'][1:]))
+
+    def __call__(self, batch, training=False):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input['index'], batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+
+def load_tflite_model(keras_model, model_name, quantization=DEFAULT_QUANTIZATION, num_threads=None):
+    """
+    Возвращает модель TFLite, конвертируя модель Keras при первом обращении
+    (сконвертированная модель сохраняется и переиспользуется при следующих запусках).
+    Конвертация выполняется под межпроцессной блокировкой, поэтому параллельные воркеры
+    конвертируют модель только один раз.
+
+    Параметры:
+      keras_model: Модель Keras.
+      model_name (str): Название модели DeepFace.
+      quantization (str): 'int8' или 'float16'.
+      num_threads (int): Число потоков интерпретатора.
+
+    Возвращает:
+      TFLiteModel: Модель TFLite.
+    """
+    model_path = get_tflite_path(model_name, quantization)
+    if not os.path.exists(model_path):
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+        # Воркеры могут одновременно обратиться к ещё не сконвертированной модели:
+        # конвертирует первый, остальные дожидаются блокировки и используют готовый файл
+        with _file_lock(model_path + ".lock"):
+            if not os.path.exists(model_path):
+                print(f"Конвертация модели {model_name} в TFLite ({quantization})...")
+                convert_to_tflite(keras_model, model_path, quantization)
+    return TFLiteModel(model_path, num_threads=num_threads)
+
+
+def install_tflite_model(client, task, model_name, quantization=DEFAULT_QUANTIZATION, num_threads=None):
+    """
+    Заменяет модель Keras в клиенте DeepFace на модель TFLite. Клиент кэшируется DeepFace,
+    поэтому замена действует и для DeepFace.represent; модель Keras после замены освобождается.
+
+    Параметры:
+      client: Клиент модели DeepFace (modeling.build_model).
+      task (str): 'facial_attribute' или 'facial_recognition'.
+      model_name (str): Название модели.
+      quantization (str): 'int8' или 'float16'.
+      num_threads (int): Число потоков интерпретатора.
+    """
+    if task not in TFLITE_TASKS:
+        raise ValueError(f"TFLite поддерживается только для задач: {', '.join(TFLITE_TASKS)}")
+    if isinstance(client.model, TFLiteModel):
+        return
+    model = load_tflite_model(client.model, model_name, quantization, num_threads)
+    client.model = model
+    if task == 'facial_recognition':
+        # FacialRecognition.forward работает только с моделями Keras
+        client.forward = lambda img: model(img)[0].tolist()
+
+
+def _load_face_images(faces_dir, limit):
+    images = []
+    for name in sorted(os.listdir(faces_dir)):
+        if name.lower().endswith(FACE_IMAGE_EXTENSIONS):
+            image = cv2.imread(os.path.join(faces_dir, name))
+            if image is not None:
+                images.append(image)
+            if len(images) >= limit:
+                break
+    return images
+
+
+def _prepare_inputs(images, input_shape, samples, seed=0):
+    """
+    Готовит входы для проверки совпадения: лица (BGR) приводятся к размеру входа модели и значениям 0..1;
+    без лиц используются случайные изображения.
+    """
+    height, width, channels = input_shape[1:]
+    if not images:
+        return np.random.default_rng(seed).random((samples, height, width, channels), dtype=np.float32)
+    inputs = []
+    for image in images:
+        resized = cv2.resize(image, (width, height)).astype(np.float32) / 255
+        if channels == 1:
+            resized = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)[..., np.newaxis]
+        inputs.append(resized)
+    return np.stack(inputs)
+
+
+def check_parity(task, model_name, quantization=DEFAULT_QUANTIZATION, num_threads=None, faces_dir=None,
+                 samples=DEFAULT_PARITY_SAMPLES):
+    """
+    Сравнивает выходы модели TFLite с моделью Keras на одних и тех же входах, чтобы потерю точности
+    от квантования можно было оценить до включения движка. Замеряется и задержка на одно лицо.
+
+    Параметры:
+      task (str): 'facial_attribute' или 'facial_recognition'.
+      model_name (str): Название модели DeepFace.
+      quantization (str): 'int8' или 'float16'.
+      num_threads (int): Число потоков интерпретатора.
+      faces_dir (str): Папка с изображениями лиц (например, faces из папки результатов); None — случайные входы.
+      samples (int): Максимальное число входов.
+
+    Возвращает:
+      dict: Расхождение выходов (максимальное и среднее), совпадение класса (атрибуты)
+            или косинусное сходство эмбеддингов (распознавание), задержка Keras и TFLite, размер файла модели.
+    """
+    from deepface.modules import modeling
+
+    keras_model = modeling.build_model(task=task, model_name=model_name).model
+    tflite_model = load_tflite_model(keras_model, model_name, quantization, num_threads)
+    images = _load_face_images(faces_dir, samples) if faces_dir else []
+    inputs = _prepare_inputs(images, keras_model.input_shape, samples)
+
+    keras_outputs, tflite_outputs = [], []
+    keras_time = tflite_time = 0.0
+    for sample in inputs:
+        # Задержка замеряется на одном лице, как при поиске эмбеддинга в конвейере
+        sample = sample[np.newaxis]
+        start_time = time.perf_counter()
+        keras_outputs.append(np.asarray(keras_model(sample, training=False))[0])
+        keras_time += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        tflite_outputs.append(tflite_model(sample)[0])
+        tflite_time += time.perf_counter() - start_time
+    keras_outputs = np.stack(keras_outputs)
+    tflite_outputs = np.stack(tflite_outputs)
+    diff = np.abs(keras_outputs - tflite_outputs)
+
+    result = {
+        'model': model_name,
+        'quantization': quantization,
+        'samples': len(inputs),
+        'max_abs_diff': float(diff.max()),
+        'mean_abs_diff': float(diff.mean()),
+    }
+    if task == 'facial_recognition':
+        keras_norm = keras_outputs / np.linalg.norm(keras_outputs, axis=1, keepdims=True)
+        tflite_norm = tflite_outputs / np.linalg.norm(tflite_outputs, axis=1, keepdims=True)
+        result['min_cosine_similarity'] = float((keras_norm * tflite_norm).sum(axis=1).min())
+    else:
+        result['top1_agreement'] = float(np.mean(keras_outputs.argmax(axis=1) == tflite_outputs.argmax(axis=1)))
+    result.update({
+        'keras_ms': keras_time / len(inputs) * 1000,
+        'tflite_ms': tflite_time / len(inputs) * 1000,
+        'keras_size_mb': keras_model.count_params() * 4 / 2 ** 20,
+        'tflite_size_mb': os.path.getsize(tflite_model.model_path) / 2 ** 20,
+    })
+    return result
+
+
+def main():
+    from model_registry import ATTRIBUTE_MODEL_NAMES, RECOGNITION_MODEL
+
+    parser = argparse.ArgumentParser(description="Конвертация моделей атрибутов и эмбеддингов в TFLite и проверка совпадения с Keras")
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=DEFAULT_QUANTIZATION, help="Квантование весов")
+    parser.add_argument('--threads', type=int, default=None, help="Число потоков интерпретатора TFLite")
+    parser.add_argument('--faces-dir', default=None, help="Папка с изображениями лиц для проверки (по умолчанию случайные входы)")
+    parser.add_argument('--samples', type=int, default=DEFAULT_PARITY_SAMPLES, help="Число входов для проверки")
+    parser.add_argument('--output-csv', default=None, help="Сохранить результаты в CSV")
+    args = parser.parse_args()
+
+    models = [('facial_attribute', model_name) for model_name in ATTRIBUTE_MODEL_NAMES]
+    models.append(('facial_recognition', RECOGNITION_MODEL))
+    results = []
+    for task, model_name in models:
+        print(f"Проверка модели {model_name}...")
+        results.append(check_parity(task, model_name, args.quantization, args.threads, args.faces_dir, args.samples))
+    df = pd.DataFrame(results)
+    print(df.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+    if args.output_csv:
+        df.to_csv(args.output_csv, index=False)
+        print(f"Результаты сохранены в {args.output_csv}")
+
+
+if __name__ == "__main__":
+    main()
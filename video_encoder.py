@@ -0,0 +1,115 @@
+import os
+import subprocess
+import cv2
+import numpy as np
+from ffmpeg import FFmpeg
+
+
+class FFmpegVideoWriter:
+    """
+    Запись кадров напрямую в кодировщик H.264 (libx264) процесса ffmpeg.
+    Кадры BGR передаются через stdin в формате rawvideo, поэтому результат сразу воспроизводится
+    в браузере и не требует повторного перекодирования. Интерфейс совместим с cv2.VideoWriter
+    (методы write, release, isOpened).
+    """
+    def __init__(self, output_video_path, fps, frame_size, preset='veryfast', crf=23, ffmpeg_binary='ffmpeg'):
+        """
+        Запускает процесс ffmpeg.
+
+        Параметры:
+          output_video_path (str): Путь для сохранения видео (mp4).
+          fps (float): Частота кадров.
+          frame_size (tuple): Размер кадра (ширина, высота).
+          preset (str): Пресет скорости libx264 (ultrafast ... veryslow).
+          crf (int): Качество libx264 (0..51, меньше — лучше качество и больше файл).
+          ffmpeg_binary (str): Путь к исполняемому файлу ffmpeg.
+        """
+        width, height = frame_size
+        self.frame_size = (width, height)
+        self.output_video_path = output_video_path
+        self.frames_written = 0
+        command = [
+            ffmpeg_binary, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps or 25),
+            '-i', '-',
+            '-an',
+            # yuv420p требует чётных размеров кадра
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+            '-pix_fmt', 'yuv420p',
+            # moov-атом в начале файла, чтобы браузер начинал воспроизведение до полной загрузки
+            '-movflags', '+faststart',
+            output_video_path,
+        ]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def isOpened(self):
+        return self._process is not None and self._process.poll() is None
+
+    def write(self, frame):
+        """
+        Передаёт кадр кодировщику.
+
+        Параметры:
+          frame (numpy.ndarray): Кадр BGR размера frame_size.
+        """
+        try:
+            self._process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+            self.frames_written += 1
+        except BrokenPipeError:
+            self.release()
+
+    def release(self):
+        """
+        Завершает запись и дожидается окончания кодирования.
+        """
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = process.stderr.read()
+        process.wait()
+        if process.returncode != 0:
+            raise RuntimeError(f"Ошибка кодирования видео ffmpeg: {stderr.decode(errors='replace')}")
+
+
+def _has_frames(video_path):
+    """
+    Проверяет, что видеофайл существует и содержит хотя бы один кадр.
+    """
+    if not os.path.exists(video_path) or os.path.getsize(video_path) == 0:
+        return False
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return cap.grab()
+    finally:
+        cap.release()
+
+
+def concat_video_segments(segment_paths, output_video_path):
+    """
+    Склеивает видеофрагменты без перекодирования (concat demuxer ffmpeg).
+    Фрагменты без кадров (например, сегмент, начатый сразу перед контрольной точкой) пропускаются.
+
+    Параметры:
+      segment_paths (list): Пути к фрагментам в порядке следования.
+      output_video_path (str): Путь для сохранения итогового видео.
+    """
+    segment_paths = [segment_path for segment_path in segment_paths if _has_frames(segment_path)]
+    if not segment_paths:
+        raise ValueError(f"Нет видеофрагментов с кадрами для склейки в {output_video_path}")
+    list_path = f"{output_video_path}.segments.txt"
+    with open(list_path, 'w') as list_file:
+        for segment_path in segment_paths:
+            escaped_path = os.path.abspath(segment_path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped_path}'\n")
+    try:
+        ffmpeg = FFmpeg().option('y').input(list_path, f='concat', safe=0).output(
+            output_video_path, {'c': 'copy', 'movflags': '+faststart'}
+        )
+        ffmpeg.execute()
+    finally:
+        os.remove(list_path)
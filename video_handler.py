@@ -1,36 +1,46 @@
 import os
+import csv
+import time
 from pathlib import Path
-import pandas as pd
 import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-from deepface import DeepFace
-from collections import Counter
-from ffmpeg import FFmpeg  # Для конвертации видео с использованием ffmpeg
+from collections import deque
+from face_gallery import FaceGallery, get_face_embedding
+from identity_store import IdentityStore
+from face_analysis import FaceBatcher, extract_frame_faces, get_detection_scale
+from face_filters import DetectionFilter, format_filter_stats
+from face_tracker import FaceTracker
+from video_pipeline import PipelineStage, VideoPipeline, format_pipeline_stats
+from video_encoder import FFmpegVideoWriter, concat_video_segments
+from frame_annotator import FrameAnnotator
+from frame_sampling import FrameSampler
+from model_registry import model_registry, format_model_report, check_detector_backend, get_memory_mb, DETECTOR_BACKEND
+from results_store import build_results_table, save_results_table
+from detection_log import DetectionLogWriter, get_frame_timestamp, merge_detection_logs
+from checkpointing import ProcessingCheckpoint, DEFAULT_CHECKPOINT_INTERVAL
+from processing_metrics import ProcessingMetrics, RSS_SAMPLE_INTERVAL, format_metrics, save_metrics, profiling
 
-def load_deepface_models():
+# Столбцы CSV с покадровыми детекциями
+DETECTION_COLUMNS = ['frame', 'timestamp', 'face_id', 'x', 'y', 'w', 'h', 'age', 'gender', 'race', 'emotion']
+
+def load_deepface_models(detector_backend=DETECTOR_BACKEND):
     """
-    Функция выполняет детекцию на случайном изображении с шумом для предварительной загрузки моделей DeepFace.
-    После этого вызывается функция match_face для тестового поиска совпадений в базе лиц.
+    Загружает детектор лиц, модели атрибутов и модель эмбеддингов DeepFace один раз на процесс
+    и прогревает их на крошечном синтетическом входе (без сканирования каталогов).
+    Повторные вызовы возвращают отчёт без повторной загрузки.
     
     Документация DeepFace: https://github.com/serengil/deepface
-    """
-    # Генерация случайного изображения с шумом размером 28x28 пикселей
-    random_image = np.random.randint(0, 256, size=(28, 28, 3), dtype=np.uint8)
     
-    # Вызов анализа на случайном изображении для загрузки моделей
-    analysis_result = DeepFace.analyze(
-        img_path=random_image,
-        actions=['age', 'gender', 'race', 'emotion'],
-        detector_backend='ssd',  # Замените на нужный backend, если требуется
-        align=False,
-        enforce_detection=False,
-        silent=True
-    )
-    print("Модели DeepFace загружены через analyze на случайном изображении.")
+    Параметры:
+      detector_backend (str): Детектор лиц DeepFace (см. model_registry.DETECTOR_BACKENDS).
     
-    test_db_path = "./"
-    match_result = match_face(random_image, test_db_path)
+    Возвращает:
+      dict: Отчёт о загрузке {(задача, модель): {'load_time_s', 'warmup_time_s', 'memory_mb', 'engine'}}.
+    """
+    report = model_registry.load_all(detector_backend=check_detector_backend(detector_backend))
+    print("Модели DeepFace загружены:")
+    print(format_model_report(report))
+    return report
 
 
 def get_face_matrics(face_result):
@@ -55,54 +65,94 @@ def get_face_matrics(face_result):
     }
     return metrics
 
-def match_face(face_img, db_path):
+def match_face(face_img, gallery):
     """
-    Ищет совпадения для переданного изображения лица в базе изображений.
+    Ищет совпадения для переданного изображения лица в галерее известных лиц.
     
     Параметры:
       face_img (numpy.ndarray): Изображение лица в виде numpy массива.
-      db_path (str): Путь к папке с базой изображений лиц.
+      gallery (FaceGallery): Галерея эмбеддингов известных лиц.
       
     Возвращает:
-      str или None: Идентификатор найденного лица или None, если совпадений нет.
+      tuple: (идентификатор найденного лица или None, эмбеддинг лица или None при ошибке).
     """
     try:
-        df = DeepFace.find(
-            img_path=face_img,
-            db_path=db_path,
-            model_name="Facenet",
-            enforce_detection=False,
-            silent=True
-        )
-        if not df[0].empty:
-            return df[0].iloc[0]['identity']
+        embedding = get_face_embedding(face_img)
     except Exception as e:
         print(f"Ошибка при поиске совпадения для лица: {e}")
-    return None
+        return None, None
+    return gallery.match(embedding), embedding
 
 class FaceMetrics:
     """
     Класс для хранения и обновления метрик для уникального лица.
-    Позволяет аккумулировать историю распознаваний и получать усреднённые значения метрик.
+    Агрегаты (счётчики пола, расы и эмоций, сумма возрастов) обновляются инкрементально в update(),
+    поэтому получение усреднённых значений выполняется за O(1) независимо от длины истории.
+    Сырая история распознаваний хранится опционально и может быть ограничена.
     """
-    def __init__(self, identifier):
+    __slots__ = ('id', 'metrics_history', '_count', '_age_sum', '_gender_counts', '_race_counts',
+                 '_emotion_counts', '_last_emotion')
+
+    EMOTIONS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+
+    def __init__(self, identifier, max_history=None):
         """
         Инициализация объекта.
         
         Параметры:
           identifier (str): Уникальный идентификатор лица (например, путь к изображению).
+          max_history (int): Сколько последних записей сырой истории хранить:
+                             None — всю историю, 0 — не хранить историю.
         """
         self.id = identifier
-        self.metrics_history = []  # список с историей распознавания
+        # список с историей распознавания (при ограничении — только последние записи)
+        self.metrics_history = [] if max_history is None else deque(maxlen=max_history)
+        self._count = 0
+        self._age_sum = 0
+        self._gender_counts = {}
+        self._race_counts = {}  # порядок ключей — порядок первого появления (как у Counter)
+        self._emotion_counts = {emotion: 0 for emotion in self.EMOTIONS}
+        self._last_emotion = None
 
-    def update(self, metrics):
+    def update(self, metrics, weight=1):
         """
-        Добавляет новые метрики в историю.
+        Добавляет новые метрики и обновляет накопленные агрегаты.
         
         Параметры:
           metrics (dict): Словарь с результатами анализа.
+          weight (int): Число кадров, которое представляет наблюдение (при выборочном анализе кадров);
+                        на этот вес увеличивается счётчик эмоции.
         """
         self.metrics_history.append(metrics)
+        self._count += 1
+        self._age_sum += metrics['age']
+        gender, race = metrics['gender'], metrics['race']
+        self._gender_counts[gender] = self._gender_counts.get(gender, 0) + 1
+        self._race_counts[race] = self._race_counts.get(race, 0) + 1
+        self._last_emotion = metrics.get('emotion')
+        emotion = (metrics.get('emotion') or '').lower()
+        if emotion in self._emotion_counts:
+            self._emotion_counts[emotion] += weight
+
+    def merge(self, other):
+        """
+        Добавляет историю и агрегаты другого объекта FaceMetrics того же лица
+        (например, найденного в следующем фрагменте видео).
+        
+        Параметры:
+          other (FaceMetrics): Метрики, которые нужно присоединить в конец истории.
+        """
+        self.metrics_history.extend(other.metrics_history)
+        self._count += other._count
+        self._age_sum += other._age_sum
+        for gender, count in other._gender_counts.items():
+            self._gender_counts[gender] = self._gender_counts.get(gender, 0) + count
+        for race, count in other._race_counts.items():
+            self._race_counts[race] = self._race_counts.get(race, 0) + count
+        for emotion, count in other._emotion_counts.items():
+            self._emotion_counts[emotion] += count
+        if other._count:
+            self._last_emotion = other._last_emotion
 
     def get_dominant_gender(self):
         """
@@ -111,9 +161,7 @@ class FaceMetrics:
         Возвращает:
           str: Наиболее частое значение ('Man' или 'Woman').
         """
-        genders_list = [m['gender'] for m in self.metrics_history]
-        gender_count = Counter(genders_list)
-        return "Man" if gender_count.get("Man", 0) > gender_count.get("Woman", 0) else "Woman"
+        return "Man" if self._gender_counts.get("Man", 0) > self._gender_counts.get("Woman", 0) else "Woman"
 
     def get_dominant_race(self):
         """
@@ -122,12 +170,10 @@ class FaceMetrics:
         Возвращает:
           str: Название расы или 'Unknown', если данных нет.
         """
-        races_list = [m['race'] for m in self.metrics_history]
-        race_count = Counter(races_list)
-        if not race_count:
+        if not self._race_counts:
             return "Unknown"
-        max_count = max(race_count.values())
-        dominant_races = [race for race, count in race_count.items() if count == max_count]
+        max_count = max(self._race_counts.values())
+        dominant_races = [race for race, count in self._race_counts.items() if count == max_count]
         return dominant_races[0]
 
     def get_dominant_age(self):
@@ -137,8 +183,7 @@ class FaceMetrics:
         Возвращает:
           int: Усреднённый возраст.
         """
-        total_age = sum(m['age'] for m in self.metrics_history)
-        avg_age = total_age / len(self.metrics_history)
+        avg_age = self._age_sum / self._count
         return int(avg_age)
 
     def get_emotion(self):
@@ -148,7 +193,7 @@ class FaceMetrics:
         Возвращает:
           str: Эмоция из последней записи.
         """
-        return self.metrics_history[-1].get('emotion')
+        return self._last_emotion
 
     def get_average_metrics(self):
         """
@@ -172,158 +217,461 @@ class FaceMetrics:
         Возвращает:
           dict: Словарь с подсчитанными значениями для каждого типа эмоций.
         """
-        emotions = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
-        emotion_counts = {emotion: 0 for emotion in emotions}
-        for record in self.metrics_history:
-            emotion = record.get('emotion', '').lower()
-            if emotion in emotion_counts:
-                emotion_counts[emotion] += 1
-        return emotion_counts
+        return dict(self._emotion_counts)
 
-def process_video_one_cell(video_path, faces_dir, output_video_path, face_conf_threshold=0.7, align=False, progress_callback=None, csv_output_path="video_results.csv"):
+def process_video_one_cell(video_path, faces_dir, output_video_path, face_conf_threshold=0.7, align=False, progress_callback=None, csv_output_path="video_results.csv", batch_size=32, batch_timeout_ms=500, detect_interval=1, min_track_confidence=0.5, scene_change_threshold=0.25, pipeline_queue_size=8, pipeline_stats=None, gallery=None, start_frame=0, end_frame=None, encoder_preset='veryfast', encoder_crf=23, metrics_history_size=None, frame_stride=1, target_fps=None, motion_threshold=None, annotate_skipped_frames=True, detections_output_path=None, detection_log_path=None, checkpoint_dir=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, detector_backend=DETECTOR_BACKEND, min_face_size=0, roi=None, filter_stats=None, timing_stats=None, metrics_output_path=None, profiler=None, profile_output_path=None, detection_scale=None, detection_short_side=None, identity_store_dir=None):
     """
     Обрабатывает видео: анализирует каждый кадр, выполняет аннотацию, сохраняет обработанное видео
     и записывает результаты распознавания лиц в CSV.
     
     Параметры:
       video_path (str): Путь к исходному видеофайлу.
-      faces_dir (str): Путь для сохранения изображений лиц.
-      output_video_path (str): Путь для сохранения обработанного видео.
-      face_conf_threshold (float): Порог уверенности для аннотации лица.
+      faces_dir (str): Путь для сохранения изображений лиц (архив вырезанных лиц, поиск по нему не выполняется).
+      output_video_path (str): Путь для сохранения обработанного видео (H.264, воспроизводится в браузере).
+                               None — режим только аналитики: аннотация и кодирование видео не выполняются,
+                               а пропущенные при выборочном анализе кадры не декодируются.
+      face_conf_threshold (float): Минимальная уверенность детектора; лица с меньшей уверенностью отбрасываются
+                                   сразу после детекции и не проходят анализ атрибутов и поиск в галерее.
       align (bool): Флаг использования дополнительного выравнивания.
       progress_callback (function): Функция для обновления прогресса обработки.
-      csv_output_path (str): Путь для сохранения CSV с результатами.
+      csv_output_path (str): Путь для сохранения CSV с результатами; None — CSV не сохраняется.
+      batch_size (int): Максимальное число лиц в одном пакете анализа атрибутов (пакет может охватывать несколько кадров).
+      batch_timeout_ms (float): Максимальное время ожидания кадра в пакете, мс.
+      detect_interval (int): Интервал полной детекции и идентификации в кадрах. При значении больше 1
+                             включается режим трекинга: на промежуточных кадрах лица переносятся
+                             оптическим потоком, а атрибуты пересчитываются только для новых треков.
+      min_track_confidence (float): Уверенность трека, ниже которой выполняется повторная детекция (режим трекинга).
+      scene_change_threshold (float): Порог смены сцены, при которой выполняется повторная детекция (режим трекинга).
+      pipeline_queue_size (int): Глубина очередей между этапами декодирования, инференса, аннотации и записи.
+                                 При значении 0 этапы выполняются последовательно в одном потоке.
+      pipeline_stats (dict): Необязательный словарь, в который записывается статистика этапов конвейера
+                             (число кадров, время работы и ожидания, максимальная глубина очереди).
+      gallery (FaceGallery): Галерея известных лиц (или общая база лиц IdentityStore); если не передана, создаётся новая.
+      start_frame (int): Индекс первого обрабатываемого кадра (для обработки фрагмента видео).
+      end_frame (int): Индекс кадра, перед которым обработка останавливается; None — до конца видео.
+      encoder_preset (str): Пресет скорости кодировщика libx264.
+      encoder_crf (int): Качество кодировщика libx264 (CRF).
+      metrics_history_size (int): Сколько последних записей сырой истории хранить в FaceMetrics:
+                                  None — всю историю, 0 — не хранить (агрегаты считаются без неё).
+      frame_stride (int): Шаг анализа кадров (анализируется каждый frame_stride-й кадр);
+                          в режиме анализа по движению — максимальный интервал между анализами.
+      target_fps (float): Целевая частота анализа кадров в секунду (задаёт шаг вместо frame_stride).
+      motion_threshold (float): Порог движения (0..1): кадр анализируется, если он заметно отличается
+                                от последнего проанализированного кадра.
+      annotate_skipped_frames (bool): Записывать пропущенные кадры в видео с последними аннотациями.
+                                      При False пропущенные кадры не декодируются (cap.grab())
+                                      и в выходное видео не попадают. В режиме анализа по движению
+                                      проанализированные кадры идут неравномерно, поэтому False при записи
+                                      видео не поддерживается (частоту кадров видео нельзя сохранить).
+      detections_output_path (str): Путь к CSV с покадровыми детекциями (кадр, время, лицо, регион, атрибуты);
+                                    None — файл не создаётся.
+      detection_log_path (str): Путь к двоичному покадровому журналу детекций (поток Arrow IPC с индексом времени,
+                                см. detection_log.DetectionLog); None — журнал не создаётся.
+      checkpoint_dir (str): Папка контрольных точек. Если задана, каждые checkpoint_interval кадров сохраняются
+                            метрики лиц, галерея и номер кадра, а видео и журнал детекций пишутся сегментами;
+                            при повторном запуске обработка продолжается с последней контрольной точки
+                            (переданная галерея при этом заменяется сохранённой). Для общей базы лиц сохраняется
+                            номер её последней строки: при продолжении лица этого видео, добавленные после
+                            контрольной точки, удаляются из базы. None — без контрольных точек.
+      checkpoint_interval (int): Интервал контрольных точек в кадрах.
+      detector_backend (str): Детектор лиц DeepFace (см. model_registry.DETECTOR_BACKENDS).
+      min_face_size (int): Минимальный размер меньшей стороны лица в пикселях; меньшие лица отбрасываются после детекции.
+      roi (tuple): Область интереса (left, top, right, bottom) в долях ширины и высоты кадра;
+                   лица с центром вне области отбрасываются после детекции. None — весь кадр.
+      filter_stats (dict): Необязательный словарь, в который записываются счётчики фильтрации лиц
+                           (найдено, отброшено по каждой причине, передано на анализ, поиск в галерее).
+      timing_stats (dict): Необязательный словарь, в который записываются агрегаты метрик обработки:
+                           время этапов кадра (декодирование, детекция, анализ атрибутов, match_face,
+                           сохранение лиц, аннотация, кодирование) с процентилями, число лиц на кадре,
+                           размер галереи и память процесса (см. processing_metrics.ProcessingMetrics).
+      metrics_output_path (str): Путь для сохранения агрегатов метрик: .prom — формат Prometheus, иначе JSON.
+      profiler (str): Профилировщик для разового подробного анализа ('cprofile' или 'pyinstrument');
+                      этапы при этом выполняются последовательно в одном потоке.
+      profile_output_path (str): Путь к результату профилирования (по умолчанию profile.pstats или profile.html).
+      detection_scale (float | str): Масштаб кадра для детекции: множитель (например, 0.5) или 'auto' — по min_face_size
+                                     (см. face_analysis.get_detection_scale). Детектор работает на уменьшенной копии
+                                     кадра, а лица для анализа атрибутов и эмбеддингов вырезаются из кадра
+                                     в полном разрешении. None — детекция в исходном разрешении.
+      detection_short_side (int): Меньшая сторона кадра для детекции в пикселях (задаёт масштаб вместо detection_scale).
+      identity_store_dir (str): Папка общей базы лиц между видео (см. identity_store.IdentityStore): лица ищутся
+                                среди всех ранее обработанных видео, новые лица добавляются в базу, а после обработки
+                                переносятся в её индекс. Используется, если не передана gallery; база открывается
+                                на время обработки и закрывается после неё. None — галерея только этого видео.
       
     Возвращает:
       dict: Словарь объектов FaceMetrics для каждого уникального лица.
     """
+    if motion_threshold is not None and not annotate_skipped_frames and output_video_path is not None:
+        raise ValueError(
+            "Анализ по движению без записи пропущенных кадров не поддерживается при записи видео: "
+            "видео воспроизводилось бы быстрее реального времени"
+        )
+    # Детектор загружается и прогревается до начала обработки (один раз на процесс)
+    model_registry.get('face_detector', check_detector_backend(detector_backend))
+    
     tracked_faces = {}
+    if gallery is None and identity_store_dir is None:
+        gallery = FaceGallery()  # эмбеддинги известных лиц для поиска совпадений в памяти
+    last_annotations = []  # аннотации последнего проанализированного кадра
+    first_frame = start_frame
+    
+    checkpoint = None
+    resume_state = None
+    if checkpoint_dir is not None:
+        checkpoint = ProcessingCheckpoint(checkpoint_dir, video_path, interval=checkpoint_interval)
+        resume_state = checkpoint.load()
+    # Номера текущего сегмента видео и части журнала детекций (при записи с контрольными точками)
+    segment_index = 0
+    log_part = 0
+    if resume_state is not None:
+        tracked_faces = resume_state['tracked_faces']
+        if resume_state['gallery'] is not None:
+            gallery = resume_state['gallery']
+        last_annotations = resume_state['last_annotations']
+        segment_index = resume_state['segments']
+        log_part = resume_state['log_parts']
+        start_frame = resume_state['frame_count']
+        print(f"Обработка продолжается с контрольной точки: кадр {start_frame}")
+    
+    processing_metrics = ProcessingMetrics()
+    batcher = FaceBatcher(max_batch_size=batch_size, max_delay_ms=batch_timeout_ms, metrics=processing_metrics)
+    face_filter = DetectionFilter(min_confidence=face_conf_threshold, min_face_size=min_face_size, roi=roi)
+    annotator = FrameAnnotator()
+    tracker = None
+    if detect_interval > 1:
+        tracker = FaceTracker(
+            detect_interval=detect_interval,
+            min_track_confidence=min_track_confidence,
+            scene_change_threshold=scene_change_threshold
+        )
     os.makedirs(faces_dir, exist_ok=True)
     
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
+    scale = get_detection_scale(width, height, detection_scale, detection_short_side, min_face_size)
+    if scale < 1.0:
+        print(f"Детекция лиц на кадре {round(width * scale)}x{round(height * scale)} (масштаб {scale:.2f})")
+    sampler = FrameSampler(fps, stride=frame_stride, target_fps=target_fps, motion_threshold=motion_threshold)
+    output_fps = fps
+    if sampler.is_enabled and not annotate_skipped_frames:
+        # В видео попадают только проанализированные кадры (шаг анализа постоянный)
+        output_fps = fps / sampler.stride
     
-    frame_count = 0
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    def open_video_writer():
+        # Аннотированные кадры сразу кодируются в H.264, отдельная конвертация для браузера не нужна
+        path = checkpoint.segment_path(segment_index) if checkpoint is not None else output_video_path
+        return FFmpegVideoWriter(path, output_fps, (width, height), preset=encoder_preset, crf=encoder_crf)
     
-    while True:
-        ret, frame_image = cap.read()
-        if not ret:
-            print("Видео закончено")
-            break
+    def open_detection_log():
+        return DetectionLogWriter(checkpoint.log_part_path(log_part) if checkpoint is not None else detection_log_path)
+    
+    out = open_video_writer() if output_video_path is not None else None
+    
+    detections_file = None
+    if detections_output_path is not None:
+        if resume_state is not None and resume_state['detections_offset'] is not None:
+            # Строки, записанные после контрольной точки, отбрасываются
+            detections_file = open(detections_output_path, 'r+', newline='')
+            detections_file.seek(resume_state['detections_offset'])
+            detections_file.truncate()
+            detections_writer = csv.writer(detections_file)
+        else:
+            detections_file = open(detections_output_path, 'w', newline='')
+            detections_writer = csv.writer(detections_file)
+            detections_writer.writerow(DETECTION_COLUMNS)
+    detection_log = open_detection_log() if detection_log_path is not None else None
+    
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    # Число кадров в контейнере может быть оценочным, поэтому без end_frame видео читается до конца
+    last_frame = end_frame if end_frame is not None else total_frames
+    if start_frame > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    # ===================== Этап декодирования =====================
+    def read_frames():
+        # Номера кадров сквозные по всему видео, чтобы имена сохранённых лиц не пересекались между фрагментами
+        frame_count = start_frame
+        while end_frame is None or frame_count < end_frame:
+            # Время декодирования включает выбор кадров для анализа
+            start_time = time.perf_counter()
+            if sampler.needs_frame:
+                ret, frame_image = cap.read()
+                weight = sampler.should_analyze(frame_count, frame_image) if ret else 0
+            else:
+                weight = sampler.should_analyze(frame_count)
+                if weight or (annotate_skipped_frames and out is not None):
+                    ret, frame_image = cap.read()
+                else:
+                    # Пропущенный кадр не нужен в видео: grab() продвигает поток без получения изображения
+                    ret, frame_image = cap.grab(), None
+            if not ret:
+                print("Видео закончено")
+                break
+            processing_metrics.add_time('decode', time.perf_counter() - start_time)
+            frame_count += 1
+            # weight — число кадров, которое представляет кадр; 0 — кадр пропускается без анализа
+            yield {'frame_count': frame_count, 'frame_image': frame_image, 'weight': weight}
+
+    # ===================== Этап инференса: детекция, анализ атрибутов, идентификация =====================
+    def infer_frame(item):
+        frame_count = item['frame_count']
+        frame_image = item['frame_image']
+        if not item['weight']:
+            # Пропущенный кадр проходит через накопитель пакета, чтобы сохранить порядок кадров
+            item['faces'] = []
+            item['tracks'] = None
+            return [identify_and_checkpoint(ready_item) for ready_item in batcher.submit(item)]
         
-        frame_count += 1
-        frame_rgb = cv2.cvtColor(frame_image, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(frame_rgb)
+        def detect_faces():
+            try:
+                # DeepFace принимает numpy-массивы в порядке каналов BGR, поэтому кадр передаётся без преобразований
+                with processing_metrics.timer('detection'):
+                    face_objs = extract_frame_faces(frame_image, detector_backend=detector_backend, align=align, scale=scale)
+            except Exception as e:
+                print(f"Ошибка при обработке кадра {frame_count}: {e}")
+                return []
+            # Отброшенные лица не попадают в пакет анализа атрибутов и в поиск по галерее
+            return face_filter.filter(face_objs, width, height)
         
-        try:
-            analysis_result = DeepFace.analyze(
-                img_path=np.array(pil_image),
-                actions=['age', 'gender', 'race', 'emotion'],
-                detector_backend='centerface',
-                enforce_detection=False,
-                align=align,
-                silent=True
-            )
-        except Exception as e:
-            print(f"Ошибка при обработке кадра {frame_count}: {e}")
-            analysis_result = None
+        # Детекция выполняется сразу, а анализ атрибутов откладывается до заполнения пакета
+        if tracker is None:
+            item['faces'] = detect_faces()
+            item['tracks'] = None
+        else:
+            item['tracks'] = tracker.step(frame_image, detect_faces)
+            item['faces'] = [face_obj for _, _, face_obj in item['tracks'] if face_obj is not None]
+        face_filter.count('analyzed', len(item['faces']))
         
-        face_results = analysis_result if analysis_result is not None and isinstance(analysis_result, list) else ([analysis_result] if analysis_result is not None else [])
+        return [identify_and_checkpoint(ready_item) for ready_item in batcher.submit(item)]
+
+    def flush_inference():
+        return [identify_and_checkpoint(ready_item) for ready_item in batcher.flush()]
+
+    def identify_faces(item):
+        """
+        Сопоставляет лица кадра с галереей и обновляет метрики.
+        Вызывается для кадров в порядке их чтения после завершения пакетного анализа
+        и заполняет item['annotations'] списком (x, y, w, h, подпись).
+        """
+        nonlocal last_annotations
+        if not item['weight']:
+            item['annotations'] = last_annotations if annotate_skipped_frames else []
+            return item
         
-        if face_results:
-            region = face_results[0]['region']
-            w_face, h_face = region['w'], region['h']
-            frame_w, frame_h = pil_image.size
-            if not (w_face == frame_w - 1 and h_face == frame_h - 1):
-                draw = ImageDraw.Draw(pil_image)
-                font_size = pil_image.size[1] // 40  # динамический размер шрифта
-                try:
-                    font = ImageFont.truetype("fonts/LiberationMono-Regular.ttf", size=font_size)
-                except Exception:
-                    font = ImageFont.load_default()
-                box_color = "red"
-                text_color = "yellow"
-                fill_color = "black"
-                
-                for number_face, face_result in enumerate(face_results):
-                    metrics = get_face_matrics(face_result)
-                    x, y, w_face, h_face = metrics['x'], metrics['y'], metrics['w'], metrics['h']
-                    face_img = pil_image.crop((x, y, x + w_face, y + h_face))
-                    face_id = match_face(np.array(face_img), faces_dir)
-                    if face_id is None:
-                        face_name = f'fr{frame_count}_fc{number_face}'
-                        face_id = os.path.join(faces_dir, f"{face_name}.jpg")
-                        face_img.save(face_id)
-                    if face_id in tracked_faces:
-                        tracked_faces[face_id].update(metrics)
-                    else:
-                        tracker = FaceMetrics(face_id)
-                        tracker.update(metrics)
-                        tracked_faces[face_id] = tracker
-                    
-                    gender_text = tracked_faces[face_id].get_dominant_gender()
-                    age_text = tracked_faces[face_id].get_dominant_age()
-                    race_text = tracked_faces[face_id].get_dominant_race()
-                    emotion_text = tracked_faces[face_id].get_emotion()
-                    text = f"{gender_text}, {age_text}, {race_text}, {emotion_text}"
-                    
-                    draw.rectangle([(x, y), (x + w_face, y + h_face)], outline=box_color, width=2)
-                    bbox = font.getbbox(text)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                    text_x = x if (x + text_width) <= pil_image.size[0] else x - text_width // 2
-                    draw.rectangle([(text_x, y - text_height), (text_x + text_width, y)], fill=fill_color)
-                    draw.text((text_x, y - text_height), text, font=font, fill=text_color)
-                
-                annotated_frame = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-                out.write(annotated_frame)
-            else:
-                out.write(frame_image)
+        frame_image = item['frame_image']
+        
+        # Список пар (результат анализа лица, трек или None)
+        face_entries = []
+        if item['tracks'] is None:
+            face_entries = [(face_result, None) for face_result in item['face_results']]
         else:
-            out.write(frame_image)
+            analyzed_results = iter(item['face_results'])
+            for track, region, face_obj in item['tracks']:
+                if face_obj is not None:
+                    face_result = next(analyzed_results, None)
+                    if face_result is None:
+                        continue
+                    # Трек новый или потерял уверенность: обновляем атрибуты и идентифицируем заново
+                    track.face_result = face_result
+                    track.face_id = None
+                elif track.face_result is None:
+                    continue
+                else:
+                    face_result = dict(track.face_result, region=region)
+                face_entries.append((face_result, track))
+        
+        annotations = []
+        for number_face, (face_result, track) in enumerate(face_entries):
+            metrics = get_face_matrics(face_result)
+            x, y, w_face, h_face = metrics['x'], metrics['y'], metrics['w'], metrics['h']
+            face_id = track.face_id if track is not None else None
+            if face_id is None:
+                # Вырезанное лицо — представление (view) буфера кадра без копирования
+                face_img = frame_image[max(y, 0):y + h_face, max(x, 0):x + w_face]
+                with processing_metrics.timer('match_face'):
+                    face_id, embedding = match_face(face_img, gallery)
+                face_filter.count('gallery_search')
+                if face_id is None:
+                    face_name = f'fr{item["frame_count"]}_fc{number_face}'
+                    face_id = os.path.join(faces_dir, f"{face_name}.jpg")
+                    with processing_metrics.timer('crop_save'):
+                        cv2.imwrite(face_id, face_img)
+                    if embedding is not None:
+                        gallery.add(face_id, embedding)
+                if track is not None:
+                    track.face_id = face_id
+            if face_id in tracked_faces:
+                tracked_faces[face_id].update(metrics, weight=item['weight'])
+            else:
+                face_metrics = FaceMetrics(face_id, max_history=metrics_history_size)
+                face_metrics.update(metrics, weight=item['weight'])
+                tracked_faces[face_id] = face_metrics
+            
+            if detections_file is not None:
+                detections_writer.writerow([
+                    item['frame_count'], round((item['frame_count'] - 1) / fps, 3) if fps else '', face_id,
+                    x, y, w_face, h_face,
+                    metrics['age'], metrics['gender'], metrics['race'], metrics['emotion']
+                ])
+            if detection_log is not None:
+                detection_log.append(
+                    item['frame_count'], get_frame_timestamp(item['frame_count'], fps), face_id,
+                    x, y, w_face, h_face,
+                    age=metrics['age'], gender=metrics['gender'], race=metrics['race'], emotion=metrics['emotion'],
+                    confidence=face_result.get('face_confidence'),
+                    track_id=track.track_id if track is not None else None,
+                    weight=item['weight']
+                )
+            if out is None:
+                continue
+            
+            gender_text = tracked_faces[face_id].get_dominant_gender()
+            age_text = tracked_faces[face_id].get_dominant_age()
+            race_text = tracked_faces[face_id].get_dominant_race()
+            emotion_text = tracked_faces[face_id].get_emotion()
+            text = f"{gender_text}, {age_text}, {race_text}, {emotion_text}"
+            annotations.append((x, y, w_face, h_face, text))
         
+        item['annotations'] = annotations
+        last_annotations = annotations
+        processing_metrics.observe('faces_per_frame', len(face_entries))
+        processing_metrics.observe('gallery_size', len(gallery))
+        return item
+
+    def identify_and_checkpoint(item):
+        """
+        Идентифицирует лица кадра и на границе интервала фиксирует состояние для контрольной точки.
+        Состояние сериализуется в потоке инференса, где оно изменяется; сама контрольная точка
+        сохраняется на этапе записи после того, как кадр записан в видео.
+        """
+        nonlocal detection_log, log_part
+        item = identify_faces(item)
+        if checkpoint is None or not checkpoint.is_due(item['frame_count']):
+            return item
+        if detection_log is not None:
+            detection_log.close()
+            log_part += 1
+            detection_log = open_detection_log()
+        if detections_file is not None:
+            detections_file.flush()
+        item['checkpoint'] = checkpoint.snapshot({
+            'frame_count': item['frame_count'],
+            'tracked_faces': tracked_faces,
+            # Общая база лиц хранится на диске: в контрольную точку попадает только номер её последней строки
+            'gallery': None if isinstance(gallery, IdentityStore) else gallery,
+            'identity_max_id': gallery.get_max_id() if isinstance(gallery, IdentityStore) else None,
+            'last_annotations': last_annotations,
+            'log_parts': log_part,
+            'detections_offset': detections_file.tell() if detections_file is not None else None,
+        })
+        return item
+
+    # ===================== Этап аннотации =====================
+    def annotate_frame(item):
+        if not item['weight'] and not annotate_skipped_frames:
+            item['output_frame'] = None
+        else:
+            # Аннотации рисуются прямо в буфере декодированного кадра
+            with processing_metrics.timer('annotation'):
+                item['output_frame'] = annotator.draw(item['frame_image'], item['annotations'])
+        return [item]
+
+    # ===================== Этап кодирования =====================
+    def write_frame(item):
+        nonlocal out, segment_index
+        if item.get('output_frame') is not None:
+            with processing_metrics.timer('encode'):
+                out.write(item['output_frame'])
+        if item['frame_count'] % RSS_SAMPLE_INTERVAL == 0:
+            processing_metrics.observe('rss_mb', get_memory_mb())
+        if item.get('checkpoint') is not None:
+            if out is not None:
+                # Сегмент закрывается, чтобы видео до контрольной точки было полностью записано
+                out.release()
+                if out.frames_written:
+                    segment_index += 1
+                out = open_video_writer()
+            checkpoint.save(item['checkpoint'], segments=segment_index)
         if progress_callback is not None:
-            progress_callback(frame_count, total_frames)
+            progress_callback(item['frame_count'] - first_frame, last_frame - first_frame)
+        return []
     
-    cap.release()
-    out.release()
+    stages = [PipelineStage('inference', infer_frame, flush=flush_inference)]
+    if out is not None:
+        stages.append(PipelineStage('annotation', annotate_frame))
+    pipeline = VideoPipeline(
+        source=read_frames(),
+        stages=stages,
+        sink=PipelineStage('encode', write_frame),
+        # Профилировщики учитывают только текущий поток, поэтому при профилировании этапы выполняются последовательно
+        queue_size=pipeline_queue_size if profiler is None else 0
+    )
+    if profiler is not None and profile_output_path is None:
+        profile_output_path = "profile.pstats" if profiler == 'cprofile' else "profile.html"
+    # Общая база лиц открывается непосредственно перед обработкой, чтобы её соединение
+    # гарантированно закрывалось (процессы-обработчики выполняют много заданий подряд)
+    identity_store = None
+    if gallery is None:
+        identity_store = gallery = IdentityStore(identity_store_dir, source=video_path)  # лица всех обработанных видео
+    try:
+        if resume_state is not None and isinstance(gallery, IdentityStore):
+            # Лица, добавленные после контрольной точки, будут найдены и добавлены повторно
+            gallery.rollback(resume_state['identity_max_id'])
+        with profiling(profiler, profile_output_path):
+            stats = pipeline.run()
+        if isinstance(gallery, IdentityStore):
+            # Лица этого видео переносятся из памяти в индекс общей базы
+            gallery.update_index()
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+        if detections_file is not None:
+            detections_file.close()
+        if detection_log is not None:
+            detection_log.close()
+        if identity_store is not None:
+            identity_store.close()
+    if checkpoint is not None:
+        # Сборка итогового видео и журнала из сегментов, записанных между контрольными точками
+        if out is not None:
+            segment_count = segment_index + (1 if out.frames_written else 0)
+            if segment_count == 1:
+                os.replace(checkpoint.segment_path(0), output_video_path)
+            else:
+                concat_video_segments([checkpoint.segment_path(index) for index in range(segment_count)], output_video_path)
+        if detection_log is not None:
+            merge_detection_logs([checkpoint.log_part_path(index) for index in range(log_part + 1)], detection_log_path)
+        checkpoint.clear()
+    print(format_pipeline_stats(stats))
+    print(format_filter_stats(face_filter.counts))
+    metrics_summary = processing_metrics.summary()
+    print(format_metrics(metrics_summary))
+    if pipeline_stats is not None:
+        pipeline_stats.update(stats)
+    if filter_stats is not None:
+        filter_stats.update(face_filter.counts)
+    if timing_stats is not None:
+        timing_stats.update(metrics_summary)
+    if metrics_output_path is not None:
+        save_metrics(metrics_summary, metrics_output_path)
     
     # Сохранение результатов в CSV с использованием переданного пути
-    conver_and_save_detected_faces(tracked_faces, csv_output_path)
+    if csv_output_path is not None:
+        conver_and_save_detected_faces(tracked_faces, csv_output_path)
     return tracked_faces
 
 def conver_and_save_detected_faces(tracked_faces, csv_output_path):
     """
-    Формирует итоговый CSV с информацией о каждом распознанном лице и сохраняет его.
+    Формирует итоговую таблицу с информацией о каждом распознанном лице за один проход
+    и сохраняет её в CSV и рядом в формате Arrow IPC (video_results.arrow).
     
     Параметры:
       tracked_faces (dict): Словарь с объектами FaceMetrics.
       csv_output_path (str): Путь для сохранения итогового CSV.
     """
-    result_list = []
-    for tr in tracked_faces.values():
-        df1 = pd.DataFrame({'age': [tr.get_dominant_age()]})
-        df2 = pd.DataFrame({'gender': [tr.get_dominant_gender()]})
-        df3 = pd.DataFrame({'race': [tr.get_dominant_race()]})
-        df4 = pd.DataFrame(tr.count_emotions(), index=[0])
-        df_combined = pd.concat([df1, df2, df3, df4], axis=1)
-        result_list.append(df_combined)
-    df_results = pd.concat(result_list, axis=0, ignore_index=True)
-    df_results.to_csv(csv_output_path, index=False)
+    df_results = build_results_table(tracked_faces)
+    save_results_table(df_results, csv_output_path)
     print(f"Результаты сохранены в {csv_output_path}")
-
-def convert_video(input_video_path: str, output_video_path: str) -> None:
-    """
-    Конвертирует видео с использованием ffmpeg для корректного отображения в браузере.
-    
-    Параметры:
-      input_video_path (str): Путь к исходному видеофайлу.
-      output_video_path (str): Путь для сохранения конвертированного видео.
-    """
-    ffmpeg = FFmpeg().option('y').input(input_video_path).output(output_video_path)
-    ffmpeg.execute()
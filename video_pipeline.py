@@ -0,0 +1,255 @@
+import queue
+import threading
+import time
+
+# Маркер окончания потока кадров между этапами конвейера
+_END = object()
+
+
+class PipelineStage:
+    """
+    Этап конвейера обработки видео.
+    Функция process принимает один элемент и возвращает список готовых элементов (возможно, пустой,
+    если этап накапливает элементы), функция flush вызывается в конце и возвращает оставшиеся элементы.
+    """
+    def __init__(self, name, process, flush=None, queue_size=None):
+        """
+        Инициализация этапа.
+
+        Параметры:
+          name (str): Название этапа (используется в статистике).
+          process (function): Обработка одного элемента, возвращает список элементов.
+          flush (function): Выдача накопленных элементов в конце потока (необязательно).
+          queue_size (int): Глубина входной очереди этапа; None — значение конвейера по умолчанию.
+        """
+        self.name = name
+        self.process = process
+        self.flush = flush
+        self.queue_size = queue_size
+
+
+class StageStats:
+    """
+    Статистика одного этапа: число элементов, время работы и максимальная глубина входной очереди.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_time = 0.0  # время выполнения этапа, с
+        self.wait_time = 0.0  # время ожидания входных данных или места в выходной очереди, с
+        self.max_queue_depth = 0
+
+    def as_dict(self):
+        return {
+            'items': self.items,
+            'busy_time': self.busy_time,
+            'wait_time': self.wait_time,
+            'avg_ms': 1000 * self.busy_time / self.items if self.items else 0.0,
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+
+class VideoPipeline:
+    """
+    Конвейер из этапов декодирования, обработки и записи кадров.
+
+    При queue_size > 0 источник (декодирование) и каждый промежуточный этап работают в отдельных
+    потоках, связанных ограниченными очередями: заполненная очередь блокирует предыдущий этап
+    (обратное давление). Последний этап (sink) выполняется в вызывающем потоке. Каждый этап
+    обслуживается одним потоком, поэтому порядок кадров сохраняется.
+    При queue_size = 0 все этапы выполняются последовательно в вызывающем потоке.
+    """
+    def __init__(self, source, stages, sink, queue_size=8, source_name='decode'):
+        """
+        Инициализация конвейера.
+
+        Параметры:
+          source (iterable): Источник элементов (например, генератор кадров).
+          stages (list): Промежуточные этапы PipelineStage.
+          sink (PipelineStage): Последний этап (например, запись видео).
+          queue_size (int): Глубина очередей между этапами по умолчанию; 0 — последовательный режим.
+          source_name (str): Название этапа источника в статистике.
+        """
+        self.source = source
+        self.stages = stages
+        self.sink = sink
+        self.queue_size = queue_size
+        self.source_name = source_name
+        self.stats = {name: StageStats(name) for name in [source_name] + [s.name for s in stages] + [sink.name]}
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self):
+        """
+        Запускает конвейер и ждёт обработки всех элементов.
+
+        Возвращает:
+          dict: Статистика по этапам (название этапа -> словарь StageStats.as_dict()).
+        """
+        if self.queue_size > 0:
+            self._run_threaded()
+        else:
+            self._run_serial()
+        return self.get_stats()
+
+    def get_stats(self):
+        """
+        Возвращает текущую статистику этапов (можно вызывать во время работы конвейера).
+        """
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def _timed(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        stats = self.stats[stage.name]
+        stats.busy_time += time.perf_counter() - start
+        return result
+
+    def _next_from_source(self, iterator):
+        stats = self.stats[self.source_name]
+        start = time.perf_counter()
+        item = next(iterator, _END)
+        stats.busy_time += time.perf_counter() - start
+        if item is not _END:
+            stats.items += 1
+        return item
+
+    # ===================== Последовательный режим =====================
+    def _push_serial(self, index, items):
+        stages = self.stages + [self.sink]
+        for item in items:
+            stage = stages[index]
+            self.stats[stage.name].items += 1
+            outputs = self._timed(stage, stage.process, item)
+            if index + 1 < len(stages):
+                self._push_serial(index + 1, outputs or [])
+
+    def _run_serial(self):
+        iterator = iter(self.source)
+        while True:
+            item = self._next_from_source(iterator)
+            if item is _END:
+                break
+            self._push_serial(0, [item])
+        stages = self.stages + [self.sink]
+        for index, stage in enumerate(stages):
+            if stage.flush is not None:
+                outputs = self._timed(stage, stage.flush)
+                if index + 1 < len(stages):
+                    self._push_serial(index + 1, outputs or [])
+
+    # ===================== Многопоточный режим =====================
+    def _put(self, output_queue, item, stats):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats.wait_time += time.perf_counter() - start
+
+    def _get(self, input_queue, stats):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                item = input_queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            item = _END
+        stats.wait_time += time.perf_counter() - start
+        return item
+
+    def _source_worker(self, output_queue):
+        stats = self.stats[self.source_name]
+        try:
+            iterator = iter(self.source)
+            while not self._stop.is_set():
+                item = self._next_from_source(iterator)
+                self._put(output_queue, item, stats)
+                if item is _END:
+                    break
+        except BaseException as e:
+            self._fail(e)
+
+    def _stage_worker(self, stage, input_queue, output_queue):
+        stats = self.stats[stage.name]
+        try:
+            while not self._stop.is_set():
+                stats.max_queue_depth = max(stats.max_queue_depth, input_queue.qsize())
+                item = self._get(input_queue, stats)
+                if item is _END:
+                    if stage.flush is not None and not self._stop.is_set():
+                        for output in self._timed(stage, stage.flush) or []:
+                            self._put(output_queue, output, stats)
+                    self._put(output_queue, _END, stats)
+                    break
+                stats.items += 1
+                for output in self._timed(stage, stage.process, item) or []:
+                    self._put(output_queue, output, stats)
+        except BaseException as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        self._errors.append(error)
+        self._stop.set()
+
+    def _make_queue(self, stage):
+        size = stage.queue_size if stage.queue_size is not None else self.queue_size
+        return queue.Queue(maxsize=size)
+
+    def _run_threaded(self):
+        stages = self.stages + [self.sink]
+        queues = [self._make_queue(stage) for stage in stages]
+        threads = [threading.Thread(target=self._source_worker, args=(queues[0],), name=self.source_name, daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._stage_worker, args=(stage, queues[index], queues[index + 1]), name=stage.name, daemon=True
+            ))
+        for thread in threads:
+            thread.start()
+
+        # Последний этап выполняется в вызывающем потоке
+        sink_queue = queues[-1]
+        stats = self.stats[self.sink.name]
+        try:
+            while True:
+                stats.max_queue_depth = max(stats.max_queue_depth, sink_queue.qsize())
+                item = self._get(sink_queue, stats)
+                if item is _END:
+                    break
+                stats.items += 1
+                self._timed(self.sink, self.sink.process, item)
+            if self.sink.flush is not None and not self._stop.is_set():
+                self._timed(self.sink, self.sink.flush)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+
+def format_pipeline_stats(stats):
+    """
+    Формирует текстовую сводку статистики конвейера.
+
+    Параметры:
+      stats (dict): Статистика из VideoPipeline.run().
+
+    Возвращает:
+      str: Сводка по этапам.
+    """
+    lines = []
+    for name, stage_stats in stats.items():
+        lines.append(
+            f"{name}: кадров {stage_stats['items']}, работа {stage_stats['busy_time']:.2f} с "
+            f"({stage_stats['avg_ms']:.1f} мс/кадр), ожидание {stage_stats['wait_time']:.2f} с, "
+            f"макс. очередь {stage_stats['max_queue_depth']}"
+        )
+    return "\n".join(lines)